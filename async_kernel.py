@@ -0,0 +1,126 @@
+import queue
+import threading
+
+_DELETE = object()
+
+
+class AsyncKernel:
+    """
+    Kernel backend that programs another backend from a dedicated writer thread, so that the RIB does not wait for
+    a slow forwarding plane.
+    Changes are kept in a bounded set of pending prefixes: a change for a prefix that is already pending replaces the
+    previous one. When there is no room for the prefixes of a batch, apply_batch() blocks until the writer catches up
+    (or raises queue.Full after timeout seconds), or raises queue.Full right away if block is False. A batch is queued
+    as a whole: when queue.Full is raised none of its changes have been queued. A batch larger than max_pending is
+    queued once nothing else is pending.
+    Attributes of this class are:
+        - backend: kernel backend programmed by the writer thread
+        - max_pending: maximum number of pending prefixes
+        - block: if True apply_batch() waits for room in the queue, else it raises queue.Full
+        - timeout: maximum number of seconds to wait for room in the queue (None waits forever)
+    """
+
+    def __init__(self, backend, max_pending=10000, block=True, timeout=None):
+        self.backend = backend
+        self.max_pending = max_pending
+        self.block = block
+        self.timeout = timeout
+        self._pending = {}
+        self._in_flight = False
+        self._error = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="kernel-writer", daemon=True)
+        self._thread.start()
+
+    def apply_batch(self, adds, deletes):
+        """
+        Queue a batch of changes for the writer thread
+        :param adds: (dict) routes to add or replace. Keys are prefixes, values are the sets of next hops
+        :param deletes: (iterable) prefixes to delete
+        :return:
+        """
+        changes = [(prefix, _DELETE) for prefix in deletes]
+        changes.extend(adds.items())
+        with self._condition:
+            self._raise_error()
+            self._wait_for_room(changes)
+            self._pending.update(changes)
+            self._condition.notify_all()
+
+    def wait_synced(self, timeout=None):
+        """
+        Wait until all the queued changes have been applied to the backend
+        :param timeout: (float|None) maximum number of seconds to wait
+        :return: (boolean) True if the backend is in sync, False if the timeout expired
+        """
+        with self._condition:
+            synced = self._condition.wait_for(lambda: self._error or not (self._pending or self._in_flight), timeout)
+            self._raise_error()
+            return bool(synced)
+
+    def dump_routes(self):
+        """
+        Wait until the queued changes have been applied and read the routing table of the backend
+        :return: (dict) installed routes. Keys are prefixes, values are the sets of next hops (empty if unreachable)
+        """
+        self.wait_synced()
+        return self.backend.dump_routes()
+
+    def close(self):
+        """
+        Apply the queued changes and stop the writer thread
+        :return:
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._raise_error()
+
+    def _has_room(self, changes):
+        if not self._pending:
+            return True
+        new_prefixes = sum(1 for prefix, _ in changes if prefix not in self._pending)
+        return len(self._pending) + new_prefixes <= self.max_pending
+
+    def _wait_for_room(self, changes):
+        if self._has_room(changes):
+            return
+        if not self.block or \
+                not self._condition.wait_for(lambda: self._error or self._has_room(changes), self.timeout):
+            raise queue.Full("%d kernel changes pending" % len(self._pending))
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    return
+                pending = self._pending
+                self._pending = {}
+                self._in_flight = True
+                self._condition.notify_all()
+            adds = {}
+            deletes = []
+            for prefix, next_hops in pending.items():
+                if next_hops is _DELETE:
+                    deletes.append(prefix)
+                else:
+                    adds[prefix] = next_hops
+            try:
+                self.backend.apply_batch(adds, deletes)
+            except Exception as e:
+                with self._condition:
+                    self._error = e
+                    self._in_flight = False
+                    self._condition.notify_all()
+                return
+            with self._condition:
+                self._in_flight = False
+                self._condition.notify_all()
@@ -0,0 +1,57 @@
+"""
+RIB throughput with a slow kernel, programmed synchronously or from the asynchronous writer thread.
+Run from the repository root:
+    python -m benchmarks.bench_async_kernel [--routes N] [--call-latency S] [--route-latency S]
+"""
+import argparse
+import time
+
+from async_kernel import AsyncKernel
+from fib import Fib
+from rib import Rib
+from rib_route import RibRoute
+from slow_kernel import SlowKernel
+
+
+def make_routes(count):
+    routes = [RibRoute("0.0.0.0/0", 2, ['S1', 'S2', 'S3', 'S4'])]
+    routes.extend(RibRoute("10.%d.%d.0/24" % (i // 256, i % 256), 2, [], ['S%d' % (1 + i % 4)])
+                  for i in range(count - 1))
+    return routes
+
+
+def run(kernel, routes, flaps):
+    rib = Rib(Fib(kernel))
+    start = time.perf_counter()
+    for rte in routes:
+        rib.put_route(rte)
+    for _ in range(flaps):
+        rib.put_route(RibRoute("0.0.0.0/0", 2, ['S1', 'S3', 'S4']))
+        rib.put_route(RibRoute("0.0.0.0/0", 2, ['S1', 'S2', 'S3', 'S4']))
+    rib_time = time.perf_counter() - start
+    if isinstance(kernel, AsyncKernel):
+        kernel.close()
+    return rib_time, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--routes", type=int, default=2000, help="number of routes")
+    parser.add_argument("--flaps", type=int, default=5, help="number of default route flaps")
+    parser.add_argument("--call-latency", type=float, default=0.0001, help="kernel latency per call (s)")
+    parser.add_argument("--route-latency", type=float, default=0.00001, help="kernel latency per route (s)")
+    args = parser.parse_args()
+    routes = make_routes(args.routes)
+
+    print("%-6s %14s %14s %14s" % ("mode", "rib time (s)", "synced (s)", "routes/s"))
+    for mode in ("sync", "async"):
+        kernel = SlowKernel(args.call_latency, args.route_latency)
+        if mode == "async":
+            kernel = AsyncKernel(kernel)
+        rib_time, synced_time = run(kernel, routes, args.flaps)
+        operations = len(routes) + 2 * args.flaps
+        print("%-6s %14.3f %14.3f %14.0f" % (mode, rib_time, synced_time, operations / rib_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+FIB size and kernel writes with and without FIB compression, on a fabric where most prefixes forward like their
+parent prefix. Each pod is a /16 holding /24 prefixes reached through all the spines, like the default route. A
+fraction of the pods is behind a failed link: a /16 negative disaggregation excludes the spine of the link, and the
+/24 prefixes of the pod are reached through the other spines. A few /24 prefixes are only reached through some
+spines.
+Run from the repository root:
+    python -m benchmarks.bench_compression [--pods N] [--prefixes N] [--failed-pods F] [--failures N]
+
+Operations, each one applied in a batch as the routes of a converged SPF:
+    - build: all the routes of the fabric
+    - spine: a spine failing and recovering, removed from the default route and from every /24 route through it
+    - link: a link failing and being repaired in a healthy pod, with its /16 negative disaggregation
+"""
+import argparse
+import time
+
+from benchmarks.bench_rib import DEFAULT_PREFIX, SPINES, S_SPF, _slash16
+from rib import Rib
+from rib_route import RibRoute
+
+
+def pod_routes(pod, prefixes, failed_spine=None):
+    pod_prefix = _slash16(pod)
+    routes = []
+    for index in range(1, prefixes + 1):
+        next_hops = SPINES[index % 8:index % 8 + 4] if index % 50 == 0 else SPINES
+        routes.append(RibRoute(pod_prefix.replace(".0.0/16", ".%d.0/24" % index), S_SPF,
+                               [spine for spine in next_hops if spine != failed_spine]))
+    return routes
+
+
+def fabric_table(pods, prefixes, failed_pods):
+    routes = []
+    for pod in range(pods):
+        failed_spine = SPINES[pod % len(SPINES)] if pod < failed_pods else None
+        if failed_spine is not None:
+            routes.append(RibRoute(_slash16(pod), S_SPF, [], [failed_spine]))
+        routes.extend(pod_routes(pod, prefixes, failed_spine))
+    return routes
+
+
+def timed_batch(rib, operations):
+    """
+    :return: (tuple) seconds taken by the batch and routes written to the kernel
+    """
+    writes = rib.metrics.counter("kernel_routes_total", "").value
+    start = time.perf_counter()
+    with rib.batch():
+        for operation, argument in operations:
+            operation(argument)
+    return time.perf_counter() - start, rib.metrics.counter("kernel_routes_total", "").value - writes
+
+
+def run(pods, prefixes, failed_pods, failures, compress):
+    rib = Rib(compress=compress)
+    routes = [RibRoute(DEFAULT_PREFIX, S_SPF, SPINES)] + fabric_table(pods, prefixes, failed_pods)
+    results = {"build": timed_batch(rib, ((rib.put_route, rte) for rte in routes))}
+    rib_size = len(rib.destinations)
+    fib_size = len(rib.fib.routes)
+
+    results["spine"] = [0.0, 0]
+    for failure in range(failures):
+        spine = SPINES[failure % len(SPINES)]
+        # Routes through the spine, without it
+        failed = [RibRoute(rte.prefix, rte.owner, rte.positive_next_hops - {spine}, rte.negative_next_hops)
+                  for rte in routes if spine in rte.positive_next_hops]
+        recovered = [rte for rte in routes if spine in rte.positive_next_hops]
+        for changes in (failed, recovered):
+            seconds, writes = timed_batch(rib, ((rib.put_route, rte) for rte in changes))
+            results["spine"][0] += seconds
+            results["spine"][1] += writes
+
+    results["link"] = [0.0, 0]
+    for failure in range(failures):
+        pod = pods - 1 - failure % (pods - failed_pods)
+        spine = SPINES[failure % len(SPINES)]
+        for changes in ([(rib.put_route, RibRoute(_slash16(pod), S_SPF, [], [spine]))] +
+                        [(rib.put_route, rte) for rte in pod_routes(pod, prefixes, spine)],
+                        [(rib.put_route, rte) for rte in pod_routes(pod, prefixes)] +
+                        [(lambda prefix: rib.del_route(prefix, S_SPF), _slash16(pod))]):
+            seconds, writes = timed_batch(rib, changes)
+            results["link"][0] += seconds
+            results["link"][1] += writes
+    return rib_size, fib_size, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pods", type=int, default=200, help="number of /16 pods")
+    parser.add_argument("--prefixes", type=int, default=100, help="number of /24 prefixes of each pod")
+    parser.add_argument("--failed-pods", type=float, default=0.1, help="fraction of the pods behind a failed link")
+    parser.add_argument("--failures", type=int, default=10, help="number of spine and of link failures")
+    args = parser.parse_args()
+
+    failed_pods = max(1, int(args.pods * args.failed_pods))
+    for compress in (False, True):
+        rib_size, fib_size, results = run(args.pods, args.prefixes, failed_pods, args.failures, compress)
+        print("compression %-3s  RIB prefixes: %d  FIB routes: %d (%.1f%%)" %
+              ("on" if compress else "off", rib_size, fib_size, 100.0 * fib_size / rib_size))
+        for operation, (seconds, writes) in results.items():
+            print("    %-6s %8.3f s  kernel writes: %d" % (operation, seconds, writes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+FIB work of a flapping default route with and without flap dampening. The default route loses and recovers a spine
+once per second (simulated clock), then stays stable until the dampened changes are released.
+Run from the repository root:
+    python -m benchmarks.bench_dampening [--routes N] [--flaps N]
+"""
+import argparse
+import time
+
+from benchmarks.bench_rib import DEFAULT_PREFIX, SPINES, S_SPF, negative_table
+from dampening import FlapDampening
+from rib import Rib
+from rib_route import RibRoute
+
+
+def run(routes, flaps, dampening):
+    clock = [0.0]
+    if dampening:
+        dampening = FlapDampening(half_life=15.0, descendant_penalty=0.01, clock=lambda: clock[0])
+    rib = Rib(dampening=dampening or None)
+    with rib.batch():
+        rib.put_route(RibRoute(DEFAULT_PREFIX, S_SPF, SPINES))
+        for rte in routes:
+            rib.put_route(rte)
+    writes = rib.metrics.counter("fib_writes_total", "")
+    initial_writes = writes.value
+    start = time.perf_counter()
+    for flap in range(flaps):
+        clock[0] += 1.0
+        rib.put_route(RibRoute(DEFAULT_PREFIX, S_SPF, SPINES[1:] if flap % 2 == 0 else SPINES))
+    flap_time = time.perf_counter() - start
+    # Stable until the penalty decays
+    clock[0] += 3600.0
+    rib.release_dampened()
+    counters = {name: rib.metrics.counter(name, "").value for name in
+                ("rib_dampening_held_total", "rib_dampening_released_total", "rib_dampening_writes_avoided_total")}
+    return flap_time, writes.value - initial_writes, counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--routes", type=int, default=50000, help="number of routes under the default route")
+    parser.add_argument("--flaps", type=int, default=20, help="number of default route changes")
+    args = parser.parse_args()
+
+    routes = negative_table(args.routes)
+    for dampening in (False, True):
+        flap_time, fib_writes, counters = run(routes, args.flaps, dampening)
+        print("dampening %-3s  flaps: %.2f s  FIB writes: %d  held: %d  released: %d  writes avoided: %d" %
+              ("on" if dampening else "off", flap_time, fib_writes, counters["rib_dampening_held_total"],
+               counters["rib_dampening_released_total"], counters["rib_dampening_writes_avoided_total"]))
+
+
+if __name__ == "__main__":
+    main()
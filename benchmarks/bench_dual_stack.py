@@ -0,0 +1,60 @@
+"""
+Convergence of IPv4 and IPv6 tables made of chains of negative disaggregations.
+Run from the repository root:
+    python -m benchmarks.bench_dual_stack [--routes N] [--flaps N]
+"""
+import argparse
+import time
+
+from rib import Rib
+from rib_route import RibRoute
+
+S_SPF = 2
+SPINES = ["S%d" % i for i in range(1, 129)]
+
+
+def ipv4_chains(count, depth):
+    return [RibRoute("%d.%d.0.0/%d" % (10 + chain // 256, chain % 256, 16 + level), S_SPF, [],
+                     [SPINES[level % len(SPINES)]])
+            for chain in range(count // depth) for level in range(depth)]
+
+
+def ipv6_chains(count, depth):
+    return [RibRoute("2001:db8:%x::/%d" % (chain, 48 + level), S_SPF, [], [SPINES[level % len(SPINES)]])
+            for chain in range(count // depth) for level in range(depth)]
+
+
+def run(default_prefix, routes, flaps):
+    rib = Rib()
+    rib.put_route(RibRoute(default_prefix, S_SPF, SPINES))
+    start = time.perf_counter()
+    for rte in routes:
+        rib.put_route(rte)
+    put_time = time.perf_counter() - start
+    flap_routes = [RibRoute(default_prefix, S_SPF, SPINES[:-1]), RibRoute(default_prefix, S_SPF, SPINES)]
+    start = time.perf_counter()
+    for flap_route in flap_routes * flaps:
+        rib.put_route(flap_route)
+    flap_time = (time.perf_counter() - start) / (2 * flaps)
+    return put_time / len(routes), flap_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--routes", type=int, default=20000, help="number of routes of each table")
+    parser.add_argument("--flaps", type=int, default=5, help="number of default route flaps")
+    args = parser.parse_args()
+
+    tables = [
+        ("ipv4", 16, "0.0.0.0/0", ipv4_chains(args.routes, 16)),
+        ("ipv6", 16, "::/0", ipv6_chains(args.routes, 16)),
+        ("ipv6", 80, "::/0", ipv6_chains(args.routes, 80))
+    ]
+    print("%-6s %6s %8s %14s %14s" % ("family", "depth", "routes", "put (us/route)", "flap (ms)"))
+    for family, depth, default_prefix, routes in tables:
+        put_time, flap_time = run(default_prefix, routes, args.flaps)
+        print("%-6s %6d %8d %14.2f %14.2f" % (family, depth, len(routes), put_time * 1e6, flap_time * 1e3))
+
+
+if __name__ == "__main__":
+    main()
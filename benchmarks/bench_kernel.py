@@ -0,0 +1,50 @@
+"""
+Per-route cost of programming the kernel through the FIB with different batch sizes.
+Run from the repository root:
+    python -m benchmarks.bench_kernel [--routes N]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from fib import Fib
+from ip_batch_kernel import IpBatchKernel
+from kernel import Kernel
+from rib_route import RibRoute
+
+BATCH_SIZES = [1, 100, 10000]
+
+
+def make_routes(count):
+    return [RibRoute("%d.%d.%d.0/24" % (10 + i // 65536, (i // 256) % 256, i % 256), 2, ['S1', 'S2', 'S3'])
+            for i in range(count)]
+
+
+def run(fib, routes):
+    start = time.perf_counter()
+    for rte in routes:
+        fib.put_route(rte)
+    fib.flush()
+    return (time.perf_counter() - start) / len(routes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--routes", type=int, default=100000, help="number of routes to program")
+    args = parser.parse_args()
+    routes = make_routes(args.routes)
+
+    print("%-10s %10s %16s" % ("backend", "batch", "us/route"))
+    for batch_size in BATCH_SIZES:
+        per_route = run(Fib(Kernel(), batch_size), routes)
+        print("%-10s %10d %16.3f" % ("memory", batch_size, per_route * 1e6))
+    for batch_size in BATCH_SIZES:
+        with tempfile.NamedTemporaryFile("w", delete=False) as stream:
+            per_route = run(Fib(IpBatchKernel(stream), batch_size), routes)
+        os.unlink(stream.name)
+        print("%-10s %10d %16.3f" % ("ip-batch", batch_size, per_route * 1e6))
+
+
+if __name__ == "__main__":
+    main()
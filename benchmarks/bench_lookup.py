@@ -0,0 +1,65 @@
+"""
+Longest prefix match of sampled destination addresses: one trie lookup per address compared to the vectorized
+lookup table of the FIB. Requires NumPy.
+Run from the repository root:
+    python -m benchmarks.bench_lookup [--routes N] [--addresses N]
+"""
+import argparse
+import random
+import time
+
+from benchmarks.bench_snapshot import make_routes
+from fib_lookup import NO_ROUTE, pack_addresses
+from rib import Rib
+from rib_route import RibRoute
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--routes", type=int, default=200000, help="number of routes")
+    parser.add_argument("--addresses", type=int, default=1000000, help="number of addresses to look up")
+    args = parser.parse_args()
+
+    rib = Rib()
+    with rib.batch():
+        for rte in make_routes(args.routes):
+            rib.put_route(rte)
+    rnd = random.Random(1)
+    # Half of the addresses fall in the /16 and /24 prefixes of the table
+    addresses = ["%d.%d.%d.%d" % (10 if index % 2 else rnd.randrange(256), rnd.randrange(256), rnd.randrange(256),
+                                  rnd.randrange(256)) for index in range(args.addresses)]
+    packed = pack_addresses(addresses)
+
+    start = time.perf_counter()
+    expected = []
+    for address in addresses:
+        destination = rib.destinations.get(address)
+        expected.append(rib.fib.routes[destination.prefix].group_id if destination is not None else NO_ROUTE)
+    trie_time = time.perf_counter() - start
+
+    table = rib.fib.lookup_table()
+    start = time.perf_counter()
+    table.lookup(packed[:1])
+    compile_time = time.perf_counter() - start
+    start = time.perf_counter()
+    group_ids = table.lookup(packed)
+    lookup_time = time.perf_counter() - start
+    assert group_ids.tolist() == expected
+
+    # A flap of the next hops of 1000 routes only updates the compiled table in place
+    prefixes = rnd.sample(sorted(rib.fib.routes), 1000)
+    start = time.perf_counter()
+    for prefix in prefixes:
+        rib.put_route(RibRoute(prefix, rib.destinations.get(prefix).best_route.owner, ["S9"]))
+    table.lookup(packed)
+    update_time = time.perf_counter() - start
+
+    print("routes:                 %d" % len(rib.fib.routes))
+    print("trie lookups:           %.2f s (%.0f addresses/s)" % (trie_time, args.addresses / trie_time))
+    print("compile table:          %.2f s" % compile_time)
+    print("vectorized lookups:     %.3f s (%.0f addresses/s)" % (lookup_time, args.addresses / lookup_time))
+    print("1000 changes + lookups: %.3f s" % update_time)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Memory used by the RIB, FIB and in-memory kernel, in bytes per prefix.
+Run from the repository root:
+    python -m benchmarks.bench_memory [--routes N [N ...]]
+"""
+import argparse
+import gc
+import tracemalloc
+
+from rib import Rib
+from rib_route import RibRoute
+
+SPINES = ['S1', 'S2', 'S3', 'S4']
+
+
+def make_route(index):
+    """
+    Every 16th prefix is a negative disaggregation, the other ones are positive routes
+    """
+    prefix = "%d.%d.%d.0/24" % (10 + index // 65536, (index // 256) % 256, index % 256)
+    if index % 16 == 0:
+        return RibRoute(prefix, 2, [], [SPINES[index // 16 % 4]])
+    return RibRoute(prefix, 2, SPINES[:2 + index % 3])
+
+
+def measure(count):
+    gc.collect()
+    tracemalloc.start()
+    rib = Rib()
+    rib.put_route(RibRoute("0.0.0.0/0", 2, SPINES))
+    for index in range(count):
+        rib.put_route(make_route(index))
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--routes", type=int, nargs="+", default=[100000, 1000000], help="table sizes")
+    args = parser.parse_args()
+    print("%-10s %16s" % ("routes", "bytes/prefix"))
+    for count in args.routes:
+        print("%-10d %16.1f" % (count, measure(count)))
+
+
+if __name__ == "__main__":
+    main()
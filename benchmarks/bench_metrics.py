@@ -0,0 +1,105 @@
+"""
+Overhead of the metrics on the RIB operations, compared to the overhead budget.
+Latency: runs with and without latency measurement. The runs of both configurations are interleaved, alternating which
+one goes first, so that warm-up and drifts of the machine do not favour one of them, and the overhead is the median of
+the slowdowns of each pair of runs.
+Counters: counters cannot be disabled, so their cost is the number of Counter.inc() calls of a run times the time of
+one call, relative to the time of the run without latency measurement.
+Run from the repository root:
+    python -m benchmarks.bench_metrics [--routes N] [--repeat N]
+"""
+import argparse
+import gc
+import statistics
+import time
+import timeit
+
+from benchmarks.bench_rib import TABLES, DEFAULT_PREFIX, SPINES, S_SPF
+from fib import Fib
+from metrics import Counter, Metrics
+from rib import Rib
+from rib_route import RibRoute
+
+# Maximum accepted slowdown of the RIB operations, for the counters and for the latency measurement
+OVERHEAD_BUDGET = 0.10
+
+
+def run(routes, latency):
+    rib = Rib(Fib(metrics=Metrics(latency=latency)))
+    flap_routes = [RibRoute(DEFAULT_PREFIX, S_SPF, SPINES[1:]), RibRoute(DEFAULT_PREFIX, S_SPF, SPINES)]
+    gc.collect()
+    start = time.perf_counter()
+    rib.put_route(flap_routes[1])
+    for rte in routes:
+        rib.put_route(rte)
+    for flap_route in flap_routes * 5:
+        rib.put_route(flap_route)
+    for rte in routes:
+        rib.del_route(rte.prefix, S_SPF)
+    return time.perf_counter() - start
+
+
+def count_inc_calls(routes):
+    """
+    :return: (int) number of Counter.inc() calls of a run
+    """
+    calls = [0]
+    inc = Counter.inc
+
+    def counting_inc(counter, amount=1):
+        calls[0] += 1
+        inc(counter, amount)
+
+    Counter.inc = counting_inc
+    try:
+        run(routes, False)
+    finally:
+        Counter.inc = inc
+    return calls[0]
+
+
+def inc_seconds():
+    """
+    :return: (float) time of one Counter.inc() call, through an attribute as in the RIB and the FIB
+    """
+    class Owner:
+        def __init__(self):
+            self.counter = Counter("bench_total", "")
+
+    number = 1000000
+    return min(timeit.repeat("owner.counter.inc()", globals={"owner": Owner()}, number=number, repeat=5)) / number
+
+
+def budget(overhead):
+    return "" if overhead <= OVERHEAD_BUDGET else "OVER BUDGET"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--routes", type=int, default=20000, help="number of routes of each table")
+    parser.add_argument("--repeat", type=int, default=9, help="runs of each configuration")
+    args = parser.parse_args()
+    inc_time = inc_seconds()
+
+    print("%-10s %12s %12s %10s %12s %10s" % ("table", "off (s)", "on (s)", "latency", "inc calls", "counters"))
+    for name in sorted(TABLES):
+        routes = TABLES[name](args.routes)
+        # Warm-up
+        run(routes, False)
+        times = {False: [], True: []}
+        for i in range(args.repeat):
+            for latency in (False, True) if i % 2 == 0 else (True, False):
+                times[latency].append(run(routes, latency))
+        off = min(times[False])
+        on = min(times[True])
+        latency_overhead = statistics.median(on_time / off_time - 1
+                                             for off_time, on_time in zip(times[False], times[True]))
+        calls = count_inc_calls(routes)
+        counters_overhead = calls * inc_time / off
+        print("%-10s %12.3f %12.3f %9.1f%% %12d %9.1f%% %s" % (
+            name, off, on, latency_overhead * 100, calls, counters_overhead * 100,
+            budget(max(latency_overhead, counters_overhead))))
+
+
+if __name__ == "__main__":
+    main()
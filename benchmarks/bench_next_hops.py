@@ -0,0 +1,77 @@
+"""
+Cost per route of the next hops computation of negative disaggregation through RibRoute and Fib.
+Run from the repository root:
+    python -m benchmarks.bench_next_hops [--routes N] [--flaps N]
+
+Operations, for each number of spines:
+    - compute: RibRoute.next_hops_mask of every route after its cache is dropped
+    - fib check: Fib.put_route of every route whose next hops did not change
+    - flap: default route losing and recovering a spine, propagated to the routes and written to the FIB
+    - decode: RibRoute.next_hops of every route, as a set of names
+"""
+import argparse
+import random
+import time
+
+from rib import Rib
+from rib_route import RibRoute
+
+S_SPF = 2
+DEFAULT_PREFIX = "0.0.0.0/0"
+SPINES = [64, 512]
+
+
+def make_routes(names, count, rnd):
+    return [RibRoute("%d.%d.%d.0/24" % (10 + i // 65536, (i // 256) % 256, i % 256), S_SPF,
+                     rnd.sample(names, rnd.randint(0, 1)), rnd.sample(names, rnd.randint(1, 4)))
+            for i in range(count)]
+
+
+def per_route(operation, routes, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        operation(routes)
+    return (time.perf_counter() - start) / (len(routes) * repeat) * 1e6
+
+
+def compute(routes):
+    for rte in routes:
+        rte.invalidate_next_hops()
+        rte.next_hops_mask
+
+
+def decode(routes):
+    for rte in routes:
+        rte.next_hops
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--routes", type=int, default=20000, help="number of disaggregated routes")
+    parser.add_argument("--flaps", type=int, default=4, help="number of default route flaps")
+    args = parser.parse_args()
+    rnd = random.Random(1)
+
+    print("%-8s %14s %14s %14s %14s" % ("spines", "compute (us)", "fib check (us)", "flap (us)", "decode (us)"))
+    for spines in SPINES:
+        names = ["S%d" % i for i in range(1, spines + 1)]
+        routes = make_routes(names, args.routes, rnd)
+        rib = Rib()
+        rib.put_route(RibRoute(DEFAULT_PREFIX, S_SPF, names))
+        for rte in routes:
+            rib.put_route(rte)
+        flap_routes = [RibRoute(DEFAULT_PREFIX, S_SPF, names[1:]), RibRoute(DEFAULT_PREFIX, S_SPF, names)]
+
+        def flap(_):
+            for i in range(2 * args.flaps):
+                rib.put_route(flap_routes[i % 2])
+
+        compute_time = per_route(compute, routes)
+        fib_time = per_route(lambda rtes: list(map(rib.fib.put_route, rtes)), routes)
+        flap_time = per_route(flap, routes) / (2 * args.flaps)
+        decode_time = per_route(decode, routes)
+        print("%-8d %14.3f %14.3f %14.3f %14.3f" % (spines, compute_time, fib_time, flap_time, decode_time))
+
+
+if __name__ == "__main__":
+    main()
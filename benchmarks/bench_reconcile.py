@@ -0,0 +1,81 @@
+"""
+Restart of a RIB whose kernel still holds the routes programmed before the restart: reprogramming every route
+compared to reconciling the converged FIB with the kernel table.
+Run from the repository root:
+    python -m benchmarks.bench_reconcile [--routes N] [--changed FRACTION]
+"""
+import argparse
+import random
+import time
+
+from benchmarks.bench_snapshot import make_routes
+from fib import Fib
+from kernel import Kernel
+from rib import Rib
+from rib_route import RibRoute
+
+
+class CountingKernel(Kernel):
+    def __init__(self, routes):
+        super().__init__()
+        self.routes = dict(routes)
+        self.programmed = 0
+
+    def apply_batch(self, adds, deletes):
+        deletes = list(deletes)
+        self.programmed += len(adds) + len(deletes)
+        super().apply_batch(adds, deletes)
+
+
+def converge(routes, fib):
+    start = time.perf_counter()
+    rib = Rib(fib)
+    with rib.batch():
+        for rte in routes:
+            rib.put_route(rte)
+    return rib, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--routes", type=int, default=200000, help="number of routes")
+    parser.add_argument("--changed", type=float, default=0.01,
+                        help="fraction of the routes that changed or disappeared while the process was down")
+    args = parser.parse_args()
+
+    routes = make_routes(args.routes)
+    before, _ = converge(routes, Fib())
+    # While the process is down some routes change next hops and some disappear
+    rng = random.Random(2)
+    after = []
+    changed = 0
+    for rte in routes:
+        if rng.random() >= args.changed:
+            after.append(rte)
+            continue
+        changed += 1
+        if rng.random() < 0.5:
+            after.append(RibRoute(rte.prefix, rte.owner, ["S9"]))
+    kernel_routes = before.fib.kernel.routes
+
+    kernel = CountingKernel(kernel_routes)
+    rib, reprogram_time = converge(after, Fib(kernel, batch_size=1000))
+    reprogram_writes = kernel.programmed
+    # Without reconciliation the routes that disappeared stay in the kernel
+    stale = set(kernel_routes) - set(rib.fib.routes)
+    expected = {prefix: next_hops for prefix, next_hops in kernel.routes.items() if prefix not in stale}
+
+    kernel = CountingKernel(kernel_routes)
+    rib, converge_time = converge(after, Fib(kernel, batch_size=1000, reconcile=True))
+    report = rib.fib.reconcile()
+    assert kernel.routes == expected
+
+    print("routes:             %d (%d changed or removed)" % (len(routes), changed))
+    print("reprogram:          %.2f s, %d kernel writes, %d stale routes left" %
+          (reprogram_time, reprogram_writes, len(stale)))
+    print("reconcile:          %.2f s, %d kernel writes (%s)" %
+          (converge_time + report.seconds, kernel.programmed, report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Throughput and latency of the RIB operations on synthetic tables, reported as JSON.
+Run from the repository root:
+    python -m benchmarks.bench_rib [--routes N] [--flaps N] [--tables NAME ...] [--output FILE]
+
+Tables:
+    - flat: positive /24 routes under the default route
+    - nested: chains of negative disaggregations, from /16 down to /31
+    - wide: /16 negative disaggregations, each with 255 /24 negative disaggregations as siblings
+    - negative: negative disaggregations of one spine under the default route
+Operations:
+    - put: Rib.put_route of every route of the table
+    - flap: default route losing and recovering a spine
+    - superfluous: /16 routes negatively disaggregating all the spines, deleting their children
+    - delete: Rib.del_route of every route of the table
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+from rib import Rib
+from rib_route import RibRoute
+
+S_SPF = 2
+DEFAULT_PREFIX = "0.0.0.0/0"
+SPINES = ["S%d" % i for i in range(1, 33)]
+
+
+def _slash24(index):
+    return "%d.%d.%d.0/24" % (10 + index // 65536, (index // 256) % 256, index % 256)
+
+
+def _slash16(index):
+    return "%d.%d.0.0/16" % (10 + index // 256, index % 256)
+
+
+def flat_table(count):
+    return [RibRoute(_slash24(i), S_SPF, SPINES[i % 8:i % 8 + 4]) for i in range(count)]
+
+
+def nested_table(count):
+    routes = []
+    for chain in range(count // 16 + 1):
+        base = "%d.%d" % (10 + chain // 256, chain % 256)
+        for depth in range(16):
+            if len(routes) == count:
+                return routes
+            routes.append(RibRoute("%s.0.0/%d" % (base, 16 + depth), S_SPF, [], [SPINES[(chain + depth) % len(SPINES)]]))
+    return routes
+
+
+def wide_table(count):
+    routes = []
+    for parent in range(count // 256 + 1):
+        parent_prefix = _slash16(parent)
+        routes.append(RibRoute(parent_prefix, S_SPF, [], [SPINES[parent % len(SPINES)]]))
+        for child in range(1, 256):
+            if len(routes) == count:
+                return routes
+            routes.append(RibRoute(parent_prefix.replace(".0.0/16", ".%d.0/24" % child), S_SPF, [],
+                                   [SPINES[child % len(SPINES)]]))
+    return routes[:count]
+
+
+def negative_table(count):
+    return [RibRoute(_slash24(i), S_SPF, [], [SPINES[i % len(SPINES)]]) for i in range(count)]
+
+
+TABLES = {
+    "flat": flat_table,
+    "nested": nested_table,
+    "wide": wide_table,
+    "negative": negative_table
+}
+
+
+def percentile(sorted_samples, fraction):
+    return sorted_samples[min(len(sorted_samples) - 1, int(fraction * len(sorted_samples)))]
+
+
+def summarize(table, routes, operation, samples):
+    samples = sorted(samples)
+    total = sum(samples)
+    return {
+        "table": table,
+        "routes": routes,
+        "operation": operation,
+        "count": len(samples),
+        "ops_per_sec": len(samples) / total if total else None,
+        "latency_us": {
+            "p50": percentile(samples, 0.5) * 1e6,
+            "p90": percentile(samples, 0.9) * 1e6,
+            "p99": percentile(samples, 0.99) * 1e6,
+            "max": samples[-1] * 1e6
+        }
+    }
+
+
+def timed(operations):
+    samples = []
+    clock = time.perf_counter
+    for operation, argument in operations:
+        start = clock()
+        operation(*argument)
+        samples.append(clock() - start)
+    return samples
+
+
+def new_rib():
+    rib = Rib()
+    rib.put_route(RibRoute(DEFAULT_PREFIX, S_SPF, SPINES))
+    return rib
+
+
+def run_table(name, count, flaps):
+    routes = TABLES[name](count)
+    results = []
+
+    rib = new_rib()
+    samples = timed((rib.put_route, (rte,)) for rte in routes)
+    results.append(summarize(name, len(routes), "put", samples))
+
+    flap_routes = [RibRoute(DEFAULT_PREFIX, S_SPF, SPINES[1:]), RibRoute(DEFAULT_PREFIX, S_SPF, SPINES)]
+    samples = timed((rib.put_route, (flap_routes[i % 2],)) for i in range(2 * flaps))
+    results.append(summarize(name, len(routes), "flap", samples))
+
+    samples = timed((rib.del_route, (rte.prefix, S_SPF)) for rte in routes)
+    results.append(summarize(name, len(routes), "delete", samples))
+
+    rib = new_rib()
+    for rte in routes:
+        rib.put_route(rte)
+    parents = sorted({_slash16(i) for i in range(max(1, len(routes) // 256))})
+    samples = timed((rib.put_route, (RibRoute(prefix, S_SPF + 1, [], SPINES),)) for prefix in parents)
+    results.append(summarize(name, len(routes), "superfluous", samples))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--routes", type=int, default=20000, help="number of routes of each table")
+    parser.add_argument("--flaps", type=int, default=20, help="number of default route flaps")
+    parser.add_argument("--tables", nargs="+", choices=sorted(TABLES), default=sorted(TABLES),
+                        help="tables to benchmark")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    report = {
+        "python": platform.python_version(),
+        "timestamp": time.time(),
+        "parameters": {"routes": args.routes, "flaps": args.flaps},
+        "results": [result for name in args.tables for result in run_table(name, args.routes, args.flaps)]
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
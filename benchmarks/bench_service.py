@@ -0,0 +1,74 @@
+"""
+Throughput and acknowledgement latency of the asyncio RIB service, with one N_SPF and one S_SPF producer sending
+updates for the same prefixes.
+Run from the repository root:
+    python -m benchmarks.bench_service [--prefixes N] [--updates N] [--max-batch N ...]
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks.bench_rib import DEFAULT_PREFIX, SPINES, S_SPF, percentile
+from rib_route import RibRoute
+from rib_service import RibService
+
+N_SPF = 1
+
+
+async def produce(service, owner, prefixes, updates, rnd, latencies):
+    """
+    Send updates for random prefixes, without waiting for the acknowledgements before sending the next update
+    """
+    acks = []
+    for index in range(updates):
+        prefix = rnd.choice(prefixes)
+        if owner == S_SPF:
+            rte = RibRoute(prefix, owner, [], [rnd.choice(SPINES)])
+        else:
+            rte = RibRoute(prefix, owner, rnd.sample(SPINES, 4))
+        start = time.perf_counter()
+        ack = await service.put_route(rte)
+        ack.add_done_callback(lambda _, start=start: latencies.append(time.perf_counter() - start))
+        acks.append(ack)
+        if index % 100 == 0:
+            # Let the other producer and the service run
+            await asyncio.sleep(0)
+    await asyncio.gather(*acks)
+
+
+async def run(prefixes, updates, max_batch):
+    latencies = []
+    async with RibService(max_batch=max_batch) as service:
+        await (await service.put_route(RibRoute(DEFAULT_PREFIX, S_SPF, SPINES)))
+        start = time.perf_counter()
+        await asyncio.gather(produce(service, N_SPF, prefixes, updates, random.Random(1), latencies),
+                             produce(service, S_SPF, prefixes, updates, random.Random(2), latencies))
+        elapsed = time.perf_counter() - start
+        coalesced = service.rib.metrics.counter("rib_service_coalesced_total", "").value
+        batches = service.rib.metrics.counter("rib_service_batches_total", "").value
+    latencies.sort()
+    return elapsed, coalesced, batches, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--prefixes", type=int, default=20000, help="number of prefixes updated by the producers")
+    parser.add_argument("--updates", type=int, default=100000, help="number of updates sent by each producer")
+    parser.add_argument("--max-batch", type=int, nargs="+", default=[100, 1000, 10000],
+                        help="maximum numbers of updates per RIB batch")
+    args = parser.parse_args()
+
+    prefixes = ["%d.%d.%d.0/24" % (10 + index // 65536, (index // 256) % 256, index % 256)
+                for index in range(args.prefixes)]
+    print("%-10s %12s %10s %8s %10s %10s" % ("max batch", "updates/s", "coalesced", "batches", "p50 (ms)",
+                                             "p99 (ms)"))
+    for max_batch in args.max_batch:
+        elapsed, coalesced, batches, latencies = asyncio.run(run(prefixes, args.updates, max_batch))
+        print("%-10d %12.0f %10d %8d %10.1f %10.1f" % (max_batch, 2 * args.updates / elapsed, coalesced, batches,
+                                                      percentile(latencies, 0.5) * 1e3,
+                                                      percentile(latencies, 0.99) * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Convergence time of a default route flap on a RIB split across worker processes, compared to a single RIB.
+The speedup depends on the number of available cores.
+Run from the repository root:
+    python -m benchmarks.bench_sharded [--routes N] [--flaps N] [--shards N [N ...]] [--split-length N]
+"""
+import argparse
+import multiprocessing
+import time
+
+from benchmarks.bench_rib import DEFAULT_PREFIX, SPINES, S_SPF, negative_table
+from rib import Rib
+from rib_route import RibRoute
+from sharded_rib import ShardedRib
+
+
+def flap(rib, flaps):
+    """
+    :return: (float) mean seconds to converge after the default route loses or recovers a spine
+    """
+    start = time.perf_counter()
+    for _ in range(flaps):
+        rib.put_route(RibRoute(DEFAULT_PREFIX, S_SPF, SPINES[1:]))
+        rib.put_route(RibRoute(DEFAULT_PREFIX, S_SPF, SPINES))
+    return (time.perf_counter() - start) / (2 * flaps)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--routes", type=int, default=200000, help="number of routes")
+    parser.add_argument("--flaps", type=int, default=5, help="number of default route flaps")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8], help="numbers of shards to run")
+    parser.add_argument("--split-length", type=int, default=16, help="prefix length splitting the shards")
+    args = parser.parse_args()
+
+    routes = [RibRoute(DEFAULT_PREFIX, S_SPF, SPINES)] + negative_table(args.routes)
+    rib = Rib()
+    with rib.batch():
+        for rte in routes:
+            rib.put_route(rte)
+    single_time = flap(rib, args.flaps)
+
+    print("cores:   %d" % multiprocessing.cpu_count())
+    print("routes:  %d" % len(routes))
+    print("%-8s %12s %9s" % ("shards", "flap (ms)", "speedup"))
+    print("%-8s %12.1f %9.2f" % ("single", single_time * 1e3, 1.0))
+    for shards in args.shards:
+        with ShardedRib(shards, args.split_length) as sharded_rib:
+            with sharded_rib.batch():
+                for rte in routes:
+                    sharded_rib.put_route(rte)
+            sharded_time = flap(sharded_rib, args.flaps)
+            assert sharded_rib.routes.keys() == rib.fib.routes.keys()
+        print("%-8d %12.1f %9.2f" % (shards, sharded_time * 1e3, single_time / sharded_time))
+
+
+if __name__ == "__main__":
+    main()
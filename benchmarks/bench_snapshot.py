@@ -0,0 +1,67 @@
+"""
+Restart time of a RIB: replaying every route through put_route compared to restoring a binary snapshot.
+Run from the repository root:
+    python -m benchmarks.bench_snapshot [--routes N]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.bench_rib import DEFAULT_PREFIX, SPINES, S_SPF
+from rib import Rib
+from rib_route import RibRoute
+from snapshot import write_snapshot, restore_snapshot
+
+
+def make_routes(count):
+    """
+    /16 negative disaggregations, each with /24 more specifics (one in four negatively disaggregated), in random
+    order as received from the network
+    """
+    routes = [RibRoute(DEFAULT_PREFIX, S_SPF, SPINES)]
+    for index in range(count - 1):
+        parent, child = divmod(index, 256)
+        prefix = "%d.%d" % (10 + parent // 256, parent % 256)
+        if child == 0:
+            routes.append(RibRoute(prefix + ".0.0/16", S_SPF, [], [SPINES[parent % len(SPINES)]]))
+        elif child % 4 == 0:
+            routes.append(RibRoute("%s.%d.0/24" % (prefix, child), S_SPF, [], [SPINES[child % len(SPINES)]]))
+        else:
+            routes.append(RibRoute("%s.%d.0/24" % (prefix, child), S_SPF, SPINES[child % 8:child % 8 + 4]))
+    random.Random(1).shuffle(routes)
+    return routes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--routes", type=int, default=200000, help="number of routes")
+    args = parser.parse_args()
+
+    routes = make_routes(args.routes)
+    start = time.perf_counter()
+    rib = Rib()
+    for rte in routes:
+        rib.put_route(rte)
+    replay_time = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "rib.snapshot")
+        start = time.perf_counter()
+        write_snapshot(rib, path)
+        write_time = time.perf_counter() - start
+        size = os.path.getsize(path)
+        start = time.perf_counter()
+        restored = restore_snapshot(path)
+        restore_time = time.perf_counter() - start
+    assert restored.fib.kernel.routes == rib.fib.kernel.routes
+
+    print("routes:             %d" % len(routes))
+    print("replay put_route:   %.2f s" % replay_time)
+    print("write snapshot:     %.2f s (%.1f bytes/route)" % (write_time, size / len(routes)))
+    print("restore snapshot:   %.2f s" % restore_time)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import math
+import time
+
+
+class FlapDampening:
+    """
+    Flap dampening of the RIB destinations, with exponentially decaying penalties as in BGP route flap dampening.
+    Each change of the best route of a prefix already installed in the FIB is a flap and adds a penalty to the prefix,
+    and the penalty halves every half_life seconds. When the penalty of a prefix reaches suppress_threshold, its changes
+    are held: the RIB is updated but the FIB write and the propagation to the children are delayed until the penalty
+    decays below reuse_threshold, when the final state of the prefix is propagated once.
+    The penalty of a flap grows with the size of the subtree of the destination (descendant_penalty for each more
+    specific prefix in the RIB), so that ancestors with large subtrees can be dampened more strictly than leaves.
+    Attributes of this class are:
+        - half_life: seconds for a penalty to decay to half of its value
+        - flap_penalty: penalty added by each flap
+        - descendant_penalty: additional penalty for each descendant of the flapping destination
+        - suppress_threshold: penalty that suppresses the changes of a prefix
+        - reuse_threshold: penalty under which a suppressed prefix is released
+        - max_penalty: maximum penalty of a prefix, which bounds the time a prefix stays suppressed
+        - clock: function returning the current time in seconds
+        - penalties: dict of (penalty, time of the penalty) tuples, keyed by prefix
+        - suppressed: set of prefixes whose changes are held
+        - next_release: earliest time at which a suppressed prefix can be released
+    """
+
+    def __init__(self, half_life=15.0, flap_penalty=1000.0, descendant_penalty=0.0, suppress_threshold=2000.0,
+                 reuse_threshold=750.0, max_penalty=12000.0, clock=time.monotonic):
+        assert reuse_threshold < suppress_threshold <= max_penalty
+        self.half_life = half_life
+        self.flap_penalty = flap_penalty
+        self.descendant_penalty = descendant_penalty
+        self.suppress_threshold = suppress_threshold
+        self.reuse_threshold = reuse_threshold
+        self.max_penalty = max_penalty
+        self.clock = clock
+        self.penalties = {}
+        self.suppressed = set()
+        self.next_release = math.inf
+        # FIB writes of the last propagated change of each penalized prefix
+        self._writes = {}
+
+    def penalty(self, prefix, now=None):
+        """
+        :param prefix: (string) prefix
+        :param now: (float|None) current time, read from the clock if None
+        :return: (float) current penalty of the prefix
+        """
+        entry = self.penalties.get(prefix)
+        if entry is None:
+            return 0.0
+        now = self.clock() if now is None else now
+        return entry[0] * 2 ** ((entry[1] - now) / self.half_life)
+
+    def flap(self, destination):
+        """
+        Record a flap of the given destination
+        :param destination: (Destination) destination whose best route changed
+        :return: (boolean) True if the change must be held
+        """
+        prefix = destination.prefix
+        now = self.clock()
+        penalty = min(self.penalty(prefix, now) + self.flap_penalty + self.descendant_penalty * destination.descendants,
+                      self.max_penalty)
+        self.penalties[prefix] = (penalty, now)
+        if prefix not in self.suppressed:
+            if penalty < self.suppress_threshold:
+                return False
+            self.suppressed.add(prefix)
+        self.next_release = min(self.next_release, self._release_time(penalty, now))
+        return True
+
+    def avoided_writes(self, prefix):
+        """
+        :param prefix: (string) prefix of a held change
+        :return: (int) FIB writes caused by the last propagated change of the prefix, as an estimate of the writes
+                 avoided by holding a change
+        """
+        return self._writes.get(prefix, 1)
+
+    def propagated(self, prefix, writes):
+        """
+        Record the FIB writes caused by the propagation of a change of the prefix
+        :param prefix: (string) prefix whose change has been propagated
+        :param writes: (int) FIB writes of the prefix and of its descendants
+        :return:
+        """
+        if prefix in self.penalties:
+            self._writes[prefix] = writes
+
+    def forget(self, prefix):
+        """
+        Stop holding the changes of a prefix removed from the RIB. Its penalty is kept, as the prefix may come back
+        :param prefix: (string) removed prefix
+        :return:
+        """
+        self.suppressed.discard(prefix)
+
+    def releasable(self):
+        """
+        Remove from the suppressed prefixes the ones whose penalty decayed below the reuse threshold, and forget the
+        penalties that decayed to a negligible value
+        :return: (list) prefixes whose held changes must be propagated
+        """
+        now = self.clock()
+        if now < self.next_release:
+            return []
+        released = [prefix for prefix in self.suppressed if self.penalty(prefix, now) <= self.reuse_threshold]
+        self.suppressed.difference_update(released)
+        self.next_release = min((self._release_time(self.penalty(prefix, now), now) for prefix in self.suppressed),
+                                default=math.inf)
+        for prefix in [prefix for prefix in self.penalties
+                       if prefix not in self.suppressed and self.penalty(prefix, now) < self.reuse_threshold / 100]:
+            del self.penalties[prefix]
+            self._writes.pop(prefix, None)
+        return released
+
+    def _release_time(self, penalty, now):
+        """
+        :return: (float) time at which the given penalty decays below the reuse threshold
+        """
+        return now + self.half_life * math.log2(penalty / self.reuse_threshold)
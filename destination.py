@@ -1,28 +1,40 @@
+_NO_CHILDREN = frozenset()
+
+
 class Destination:
     """
     Class that contains all routes for a given prefix destination
     Attributes of this class are:
-        - rib: reference to the RIB
+        - preferences: PreferenceTable of the RIB, ranking the owners of the routes
         - prefix: prefix associated to this destination
-        - routes: list of RibRoute objects, in decreasing order or owner (= in decreasing order of preference, higher
-                  numerical value is more preferred). For a given owner, at most one route is allowed to be in the list
+        - routes: list of RibRoute objects, in decreasing order of owner preference (see PreferenceTable). For a
+                  given owner, at most one route is allowed to be in the list
+        - routes_by_owner: dict of the same RibRoute objects, keyed by owner. Most destinations have a single route,
+                           so the dict is only built when there are two routes or more, and is None otherwise
+        - parent: Destination object of the nearest less specific prefix in the RIB, None if there is none
+        - children: set of Destination objects whose nearest less specific prefix in the RIB is this one.
+                    Destinations without children share the same empty set
+        - descendants: number of destinations of the more specific prefixes in the RIB
+    Parent and children links and the number of descendants are maintained by the RIB when destinations are added or
+    removed, so walking the tree never looks up the trie.
     """
+    __slots__ = ('preferences', 'prefix', 'routes', 'routes_by_owner', 'parent', 'children', 'descendants')
 
-    def __init__(self, rib, prefix):
-        self.rib = rib
+    def __init__(self, preferences, prefix):
+        self.preferences = preferences
         self.prefix = prefix
         self.routes = []
+        self.routes_by_owner = None
+        self.parent = None
+        self.children = _NO_CHILDREN
+        self.descendants = 0
 
     @property
     def parent_prefix_dest(self):
         """
         :return: the Destination object associated to the parent prefix of the current one
         """
-        parent_prefix = self.rib.destinations.parent(self.prefix)
-        if parent_prefix is None:
-            return None
-
-        return self.rib.destinations.get(parent_prefix)
+        return self.parent
 
     @property
     def best_route(self):
@@ -31,44 +43,97 @@ class Destination:
         """
         return self.routes[0]
 
+    def add_children(self, children):
+        """
+        Add Destination objects to the children of this destination
+        :param children: (collection) Destination objects to add
+        :return:
+        """
+        if self.children is _NO_CHILDREN:
+            if children:
+                self.children = set(children)
+        else:
+            self.children.update(children)
+
+    def discard_child(self, child):
+        """
+        Remove a Destination object from the children of this destination, if present
+        :param child: (Destination) object to remove
+        :return:
+        """
+        if child in self.children:
+            self.children.remove(child)
+            if not self.children:
+                self.children = _NO_CHILDREN
+
+    def clear_children(self):
+        self.children = _NO_CHILDREN
+
+    def refresh_next_hops(self):
+        """
+        Recompute the next hops of the routes of this destination, e.g. after its parent prefix changed.
+        The best route is recomputed only if it depends on the parent, that is if it has negative next hops.
+        :return: (int) bitmask of the next hops of the best route that changed, -1 if they were not cached
+        """
+        best_route = self.best_route
+        for rte in self.routes:
+            if rte is not best_route:
+                rte.invalidate_next_hops()
+        if not best_route.negative_next_hops_mask:
+            return 0
+        return best_route.refresh_next_hops()
+
+    def update_next_hops(self, parent_changed_mask, parent_next_hops_mask):
+        """
+        Update the next hops of the routes of this destination after the best route of the parent prefix changed.
+        The best route is updated with the changed next hops of the parent (see RibRoute.update_next_hops()), the
+        other routes are computed again when they are read.
+        :param parent_changed_mask: (int) bitmask of the next hops added to or removed from the parent best route
+        :param parent_next_hops_mask: (int) bitmask of the new computed next hops of the parent best route
+        :return: (int) bitmask of the next hops of the best route that changed, -1 if they were not cached
+        """
+        best_route = self.best_route
+        for rte in self.routes:
+            if rte is not best_route:
+                rte.invalidate_next_hops()
+        return best_route.update_next_hops(parent_changed_mask, parent_next_hops_mask)
+
     def get_route(self, owner):
         """
         Get RibRoute object for a given owner if present
         :param owner: (int) owner of the route
         :return: (RibRoute|None) desired RibRoute object if present, else None
         """
-        for rte in self.routes:
-            if rte.owner == owner:
-                return rte
+        if self.routes_by_owner is not None:
+            return self.routes_by_owner.get(owner)
+        if self.routes and self.routes[0].owner == owner:
+            return self.routes[0]
         return None
 
     def put_route(self, new_route):
         """
         Add a new RibRoute object in the list of routes for the current prefix. Route is added with proper priority.
         :param new_route: (RibRoute) route to add to the list
-        :return:
+        :return: (boolean) True if the new route is the best route
         """
         assert self.prefix == new_route.prefix
-        added = False
-        best_changed = False
-        index = 0
-        for existing_route in self.routes:
-            if existing_route.owner == new_route.owner:
-                self.routes[index] = new_route
-                added = True
-                break
-            elif existing_route.owner < new_route.owner:
-                self.routes.insert(index, new_route)
-                added = True
-                break
-            index += 1
-        if not added:
-            self.routes.append(new_route)
-        if index == 0:
-            best_changed = True
-        # Update the Route Destination object instance with the current object
+        # Update the Route Destination object instance with the current object, the parent of the route may have
+        # changed since its next hops were cached
         new_route.destination = self
-        return best_changed
+        new_route.invalidate_next_hops()
+        if not self.routes:
+            self.routes.append(new_route)
+            return True
+        index = self._route_index(new_route.owner)
+        if self.get_route(new_route.owner) is not None:
+            self.routes[index] = new_route
+        else:
+            self.routes.insert(index, new_route)
+        if self.routes_by_owner is not None:
+            self.routes_by_owner[new_route.owner] = new_route
+        elif len(self.routes) > 1:
+            self.routes_by_owner = {rte.owner: rte for rte in self.routes}
+        return index == 0
 
     def del_route(self, owner):
         """
@@ -77,19 +142,38 @@ class Destination:
         :return: (tuple) first element is a boolean that indicates if the route has been deleted, second element is a
                          boolean that indicates if the best route changed
         """
-        best_changed = False
-        for index, rte in enumerate(self.routes):
-            if rte.owner == owner:
-                del self.routes[index]
-                if index == 0:
-                    best_changed = True
-                return True, best_changed
-        return False, best_changed
+        if self.get_route(owner) is None:
+            return False, False
+        index = self._route_index(owner)
+        del self.routes[index]
+        if len(self.routes) > 1:
+            del self.routes_by_owner[owner]
+        else:
+            self.routes_by_owner = None
+        return True, index == 0
+
+    def _route_index(self, owner):
+        """
+        :param owner: (int) owner of a route
+        :return: (int) index of the route of the owner in the routes list, or where it would be inserted
+        """
+        # Binary search on the ranks of the owners, without the key argument of bisect (Python 3.10 or later)
+        rank = self.preferences.rank
+        owner_rank = rank(owner)
+        routes = self.routes
+        low, high = 0, len(routes)
+        while low < high:
+            middle = (low + high) // 2
+            if rank(routes[middle].owner) < owner_rank:
+                low = middle + 1
+            else:
+                high = middle
+        return low
 
     def __repr__(self):
-        parent_prefix = "(Parent: " + self.parent_prefix_dest.prefix + ")" if self.parent_prefix_dest else ""
+        parent_prefix = "(Parent: " + self.parent.prefix + ")" if self.parent else ""
         return "%s\n%s %s\nBest Computed: %s\n\n" % (self.prefix, parent_prefix, str(self.routes),
-                                                     str(self.best_route.next_hops))
+                                                     str(set(self.best_route.next_hops)))
 
     @staticmethod
     def routes_significantly_different(route1, route2):
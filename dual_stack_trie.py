@@ -0,0 +1,50 @@
+import pytricia
+
+
+class DualStackTrie:
+    """
+    Patricia Trie for both IPv4 and IPv6 prefixes, made of two PyTricia tries (32 and 128 bits wide). Each prefix is
+    stored in the trie of its address family, so IPv4 and IPv6 prefixes are never parent of each other.
+    It provides the subset of the PyTricia API used by the RIB. Iteration yields IPv4 prefixes first.
+    Attributes of this class are:
+        - ipv4: PyTricia trie of the IPv4 prefixes
+        - ipv6: PyTricia trie of the IPv6 prefixes
+    """
+
+    def __init__(self):
+        self.ipv4 = pytricia.PyTricia(32)
+        self.ipv6 = pytricia.PyTricia(128)
+
+    def _trie(self, prefix):
+        return self.ipv6 if ":" in prefix else self.ipv4
+
+    def has_key(self, prefix):
+        return self._trie(prefix).has_key(prefix)
+
+    def get(self, prefix, default=None):
+        return self._trie(prefix).get(prefix, default)
+
+    def insert(self, prefix, value):
+        self._trie(prefix).insert(prefix, value)
+
+    def delete(self, prefix):
+        self._trie(prefix).delete(prefix)
+
+    def parent(self, prefix):
+        return self._trie(prefix).parent(prefix)
+
+    def children(self, prefix):
+        return self._trie(prefix).children(prefix)
+
+    def keys(self):
+        return self.ipv4.keys() + self.ipv6.keys()
+
+    def __contains__(self, prefix):
+        return prefix in self._trie(prefix)
+
+    def __iter__(self):
+        yield from self.ipv4
+        yield from self.ipv6
+
+    def __len__(self):
+        return len(self.ipv4) + len(self.ipv6)
@@ -1,37 +1,259 @@
+import itertools
+import time
+
 from kernel import Kernel
 from fib_route import FibRoute
+from metrics import Metrics
+from next_hop_registry import registry
+from next_hop_group import NextHopGroupTable
 
 
 class Fib:
     """
     A simple FIB.
+    Installed next hops are interned in a NextHopGroupTable, so FIB and kernel entries with the same next hops share
+    one NextHopGroup object. Routes are compared with the installed groups by next hops bitmask.
+    Changes are buffered and sent to the kernel backend with apply_batch() every batch_size changes. Pending changes
+    for the same prefix are collapsed into the last one, and a prefix added and deleted before being sent is not sent
+    at all. Use flush() to send the pending changes right away.
+    put_route() and delete_route() do not raise the errors of the kernel backend (like queue.Full, raised by an
+    AsyncKernel whose queue is full), so that a caller updating several routes, like the RIB propagating a change to
+    the descendants of a prefix, is not interrupted halfway: the changes are kept pending, and the error is raised by
+    flush_deferred() once the caller is done.
+    A FIB created with reconcile=True does not send anything to the kernel until reconcile() is called: this lets the
+    RIB converge after a restart, and then programs only the differences with the routes still held by the kernel.
+    Attributes of this class are:
+        - routes: dict of FibRoute objects, keyed by prefix
+        - next_hop_groups: NextHopGroupTable of the next hop groups used by the routes
+        - kernel: kernel backend (default is the in-memory Kernel)
+        - batch_size: number of changes that triggers a write to the kernel backend
+        - metrics: Metrics of the FIB and of the kernel (shared with the RIB using this FIB)
+        - reconciling: True until reconcile() is called on a FIB created with reconcile=True
     """
 
-    def __init__(self):
+    def __init__(self, kernel=None, batch_size=1, metrics=None, reconcile=False):
         self.routes = {}
-        self.kernel = Kernel()
+        self.next_hop_groups = NextHopGroupTable()
+        self.kernel = kernel if kernel is not None else Kernel()
+        self.batch_size = batch_size
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.reconciling = reconcile
+        self._lookup = None
+        self._pending_adds = {}
+        self._pending_deletes = set()
+        # Prefixes of the pending adds that are not installed in the kernel
+        self._pending_new = set()
+        # Error of the last automatic write to the kernel backend, raised by flush_deferred()
+        self._flush_error = None
+        self._writes = self.metrics.counter("fib_writes_total", "Routes installed or replaced in the FIB")
+        self._writes_suppressed = self.metrics.counter("fib_writes_suppressed_total",
+                                                       "FIB writes suppressed because the next hops did not change")
+        self._deletes = self.metrics.counter("fib_deletes_total", "Routes deleted from the FIB")
+        self._kernel_batches = self.metrics.counter("kernel_batches_total", "Batches sent to the kernel backend")
+        self._kernel_routes = self.metrics.counter("kernel_routes_total",
+                                                   "Route additions and deletions sent to the kernel backend")
+        self._kernel_seconds = self.metrics.histogram("kernel_apply_batch_seconds",
+                                                      "Latency of the kernel backend apply_batch() calls")
 
     def put_route(self, rte):
+        """
+        Install the route in the FIB and in the kernel if its next hops differ from the installed ones
+        :param rte: (RibRoute) route to install
+        :return: (boolean) True if the route has been written
+        """
+        if self._install_route(rte):
+            self._flush_if_full()
+            return True
+        return False
+
+    def put_routes(self, rtes):
+        """
+        Install several routes, sending all the changes to the kernel in a single batch
+        :param rtes: (iterable) RibRoute objects to install
+        :return: (int) number of routes written
+        """
+        written = 0
+        for rte in rtes:
+            if self._install_route(rte):
+                written += 1
+        self.flush()
+        return written
+
+    def _install_route(self, rte):
         if self._is_route_different(rte):
-            fib_route = FibRoute(rte.prefix, rte.next_hops)
+            fib_route = FibRoute(rte.prefix, self.next_hop_groups.acquire(rte.next_hops_mask))
+            old_fib_route = self.routes.get(rte.prefix)
+            if old_fib_route is not None:
+                self.next_hop_groups.release(old_fib_route.group)
+            elif rte.prefix not in self._pending_deletes:
+                self._pending_new.add(rte.prefix)
             self.routes[rte.prefix] = fib_route
-            self.kernel.put_route(fib_route.prefix, fib_route.next_hops)
+            if self._lookup is not None:
+                self._lookup.route_changed(rte.prefix, fib_route.group)
+            self._pending_deletes.discard(fib_route.prefix)
+            self._pending_adds[fib_route.prefix] = fib_route.group
+            self._writes.inc()
+            return True
+        self._writes_suppressed.inc()
+        return False
 
     def delete_route(self, prefix):
-        del self.routes[prefix]
-        self.kernel.delete_route(prefix)
+        self.next_hop_groups.release(self.routes.pop(prefix).group)
+        if self._lookup is not None:
+            self._lookup.route_deleted(prefix)
+        self._pending_adds.pop(prefix, None)
+        if prefix in self._pending_new:
+            # The prefix has never been sent to the kernel, there is nothing to delete
+            self._pending_new.discard(prefix)
+        else:
+            self._pending_deletes.add(prefix)
+        self._deletes.inc()
+        self._flush_if_full()
+
+    def flush(self):
+        """
+        Send all the pending changes to the kernel backend. Nothing is sent while the FIB is reconciling.
+        If the backend raises an exception, the changes are kept pending and sent again by the next flush
+        :return:
+        """
+        if self.reconciling:
+            return
+        if self._pending_adds or self._pending_deletes:
+            adds, deletes, new = self._pending_adds, self._pending_deletes, self._pending_new
+            self._pending_adds = {}
+            self._pending_deletes = set()
+            self._pending_new = set()
+            self._kernel_batches.inc()
+            self._kernel_routes.inc(len(adds) + len(deletes))
+            try:
+                if self.metrics.sample(self._kernel_batches):
+                    start = time.perf_counter()
+                    self.kernel.apply_batch(adds, deletes)
+                    self._kernel_seconds.observe(time.perf_counter() - start)
+                else:
+                    self.kernel.apply_batch(adds, deletes)
+            except BaseException:
+                self._pending_adds, self._pending_deletes, self._pending_new = adds, deletes, new
+                raise
+        self._flush_error = None
+
+    def flush_deferred(self):
+        """
+        If a write to the kernel backend failed in put_route() or delete_route(), send the pending changes again and
+        raise the error of the backend if it still fails. The changes stay pending until a flush succeeds
+        :return:
+        """
+        if self._flush_error is None:
+            return
+        self._flush_error = None
+        try:
+            self.flush()
+        except Exception as e:
+            self._flush_error = e
+            raise
+
+    def reconcile(self, kernel_routes=None):
+        """
+        Compare the FIB with the routes installed in the kernel and program only the differences: FIB routes missing
+        from the kernel are added, the ones with different next hops are replaced and the kernel routes that are not
+        in the FIB are deleted. The FIB then leaves the reconciling state and sends the following changes as usual
+        :param kernel_routes: (dict|None) routes installed in the kernel, in the format returned by
+                              dump_routes(). If None they are read with the dump_routes() method of the kernel
+        :return: (ReconcileReport) counts of the programmed changes and time taken
+        """
+        start = time.perf_counter()
+        if kernel_routes is None:
+            kernel_routes = self.kernel.dump_routes()
+        adds = {}
+        changed = 0
+        for prefix, fib_route in self.routes.items():
+            next_hops = kernel_routes.get(prefix)
+            if next_hops is None:
+                adds[prefix] = fib_route.group
+            elif fib_route.group != next_hops:
+                adds[prefix] = fib_route.group
+                changed += 1
+        deletes = {prefix for prefix in kernel_routes if prefix not in self.routes}
+        self.reconciling = False
+        self._pending_adds = adds
+        self._pending_deletes = deletes
+        self._pending_new = set()
+        self.flush()
+        return ReconcileReport(len(adds) - changed, changed, len(deletes), len(self.routes) - len(adds),
+                               time.perf_counter() - start)
+
+    def _flush_if_full(self):
+        # Once a write failed, changes are accumulated until flush_deferred() or flush() is called
+        if self._flush_error is None and len(self._pending_adds) + len(self._pending_deletes) >= self.batch_size:
+            try:
+                self.flush()
+            except Exception as e:
+                self._flush_error = e
 
     def _is_route_different(self, rte):
         if rte.prefix not in self.routes:
             return True
 
-        return rte.next_hops != self.routes[rte.prefix].next_hops
+        return rte.next_hops_mask != self.routes[rte.prefix].group.mask
+
+    def lookup_table(self):
+        """
+        Get the longest prefix match table of the FIB, creating it on the first call. The table is kept up to date
+        as the FIB changes. It requires NumPy
+        :return: (FibLookup) lookup table of the FIB
+        """
+        if self._lookup is None:
+            from fib_lookup import FibLookup
+            self._lookup = FibLookup(self)
+        return self._lookup
+
+    def show(self, prefixes=None, next_hop=None, offset=0, limit=None):
+        """
+        Stream the routes of the FIB, one line per route, without building the whole output
+        :param prefixes: (iterable|None) prefixes to show, the ones missing from the FIB are skipped. All the routes
+                         are shown if None
+        :param next_hop: (string|None) show only the routes forwarding to this next hop
+        :param offset: (int) number of lines to skip
+        :param limit: (int|None) maximum number of lines to return
+        :return: (iterator) lines of the output
+        """
+        if prefixes is None:
+            fib_routes = iter(self.routes.values())
+        else:
+            fib_routes = filter(None, map(self.routes.get, prefixes))
+        if next_hop is not None:
+            next_hop_mask = registry.lookup(next_hop)
+            fib_routes = (fib_route for fib_route in fib_routes if fib_route.group.mask & next_hop_mask)
+        return itertools.islice(map(str, fib_routes), offset, None if limit is None else offset + limit)
+
+    def __str__(self):
+        return "".join("%s\n" % fib_route for fib_route in self.routes.values())
+
+    def __repr__(self):
+        return str(self)
+
+
+class ReconcileReport:
+    """
+    Summary of a FIB reconciliation.
+    Attributes of this class are:
+        - added: number of FIB routes missing from the kernel
+        - changed: number of kernel routes replaced because their next hops differed from the FIB
+        - deleted: number of stale kernel routes deleted
+        - unchanged: number of kernel routes left untouched
+        - seconds: time taken by the reconciliation, including reading the kernel routes
+    """
+
+    def __init__(self, added, changed, deleted, unchanged, seconds):
+        self.added = added
+        self.changed = changed
+        self.deleted = deleted
+        self.unchanged = unchanged
+        self.seconds = seconds
 
     def __str__(self):
-        repr_str = ""
-        for prefix in self.routes:
-            repr_str += "%s\n" % self.routes[prefix]
-        return repr_str
+        return "%d added, %d changed, %d deleted, %d unchanged in %.3f s" % \
+               (self.added, self.changed, self.deleted, self.unchanged, self.seconds)
 
     def __repr__(self):
         return str(self)
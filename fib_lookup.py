@@ -0,0 +1,178 @@
+"""
+Vectorized longest prefix match on the routes of a FIB.
+This module requires NumPy, which is an optional dependency: it is only imported when Fib.lookup_table() is first
+called.
+"""
+import socket
+
+import numpy
+
+# Group index returned for the addresses without a matching route
+NO_ROUTE = -1
+
+
+class FibLookup:
+    """
+    Array based snapshot of the routes of a FIB, used to look up many destination addresses at once.
+    Prefixes of each address family are compiled into sorted, disjoint address ranges: the range containing an
+    address is found with a binary search (numpy.searchsorted) and maps to the slot of its longest matching prefix.
+    Each slot stores the next hop group index (group_id) of its route.
+    The table is kept up to date by the FIB: a route whose next hops change only updates the group index of its slot,
+    while added or deleted prefixes mark the family to be compiled again on the next lookup.
+    IPv4 addresses are given as uint32 integers, IPv6 addresses as 16 bytes strings in network order (dtype S16), see
+    pack_addresses().
+    Attributes of this class are:
+        - fib: FIB whose routes are looked up
+        - cache_size: maximum number of addresses cached by lookup_address()
+    """
+
+    def __init__(self, fib, cache_size=4096):
+        self.fib = fib
+        self.cache_size = cache_size
+        self._families = {socket.AF_INET: _CompiledFamily(), socket.AF_INET6: _CompiledFamily()}
+        for fib_route in fib.routes.values():
+            self._family(fib_route.prefix).prefixes[fib_route.prefix] = None
+        self._cache = {}
+
+    def route_changed(self, prefix, group):
+        """
+        Called by the FIB when a route is added or its next hops change
+        :param prefix: (string) prefix of the route
+        :param group: (NextHopGroup) next hop group of the route
+        :return:
+        """
+        self._cache.clear()
+        family = self._family(prefix)
+        slot = family.prefixes.get(prefix)
+        if slot is not None:
+            family.groups[slot] = group.group_id
+        else:
+            family.prefixes[prefix] = None
+            family.compiled = False
+
+    def route_deleted(self, prefix):
+        """
+        Called by the FIB when a route is deleted
+        :param prefix: (string) prefix of the route
+        :return:
+        """
+        self._cache.clear()
+        family = self._family(prefix)
+        del family.prefixes[prefix]
+        family.compiled = False
+
+    def lookup(self, addresses, family=socket.AF_INET):
+        """
+        Longest prefix match of many addresses of the same family
+        :param addresses: (numpy.ndarray) uint32 IPv4 addresses or S16 packed IPv6 addresses
+        :param family: (int) socket.AF_INET or socket.AF_INET6
+        :return: (numpy.ndarray) next hop group index of each address, NO_ROUTE if no route matches
+        """
+        compiled = self._compiled(family)
+        slots = compiled.slots[numpy.searchsorted(compiled.starts, addresses, side="right") - 1]
+        return compiled.groups[slots]
+
+    def lookup_address(self, address):
+        """
+        Longest prefix match of a single address. Results are cached until the FIB changes
+        :param address: (string) IPv4 or IPv6 address
+        :return: (int) next hop group index, NO_ROUTE if no route matches
+        """
+        group_id = self._cache.get(address)
+        if group_id is None:
+            family = socket.AF_INET6 if ":" in address else socket.AF_INET
+            group_id = int(self.lookup(pack_addresses([address], family), family)[0])
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[address] = group_id
+        return group_id
+
+    def _family(self, prefix):
+        return self._families[socket.AF_INET6 if ":" in prefix else socket.AF_INET]
+
+    def _compiled(self, family):
+        compiled = self._families[family]
+        if not compiled.compiled:
+            compiled.compile(family, self.fib.routes)
+        return compiled
+
+
+class _CompiledFamily:
+    """
+    Compiled ranges of the prefixes of one address family.
+    Attributes of this class are:
+        - prefixes: dict of the slots of the prefixes, keyed by prefix (slots are None until compiled)
+        - compiled: False if prefixes have been added or deleted since the last compilation
+        - starts: sorted array of the first address of each range
+        - slots: array of the slot of each range, -1 if no prefix covers the range
+        - groups: array of the group index of each slot, followed by NO_ROUTE (so that slot -1 has no route)
+    """
+
+    def __init__(self):
+        self.prefixes = {}
+        self.compiled = False
+        self.starts = self.slots = self.groups = None
+
+    def compile(self, family, fib_routes):
+        """
+        Build the ranges of the prefixes, walking the prefixes sorted by first address and length with a stack of
+        the prefixes containing the current address
+        :param family: (int) address family of the prefixes
+        :param fib_routes: (dict) FibRoute objects of the FIB, keyed by prefix
+        :return:
+        """
+        width = 32 if family == socket.AF_INET else 128
+        entries = []
+        for prefix in self.prefixes:
+            address, length = prefix.split("/")
+            start = int.from_bytes(socket.inet_pton(family, address), "big")
+            entries.append((start, int(length), prefix))
+        entries.sort()
+        groups = []
+        starts = [0]
+        slots = [-1]
+        # Ranges still open, as (end, slot) tuples. Ends are exclusive
+        stack = []
+
+        def add_range(range_start, slot):
+            if starts[-1] == range_start:
+                slots[-1] = slot
+            elif slots[-1] != slot:
+                starts.append(range_start)
+                slots.append(slot)
+
+        for start, length, prefix in entries:
+            while stack and stack[-1][0] <= start:
+                end = stack.pop()[0]
+                add_range(end, stack[-1][1] if stack else -1)
+            slot = len(groups)
+            self.prefixes[prefix] = slot
+            groups.append(fib_routes[prefix].group_id)
+            add_range(start, slot)
+            stack.append((start + (1 << (width - length)), slot))
+        while stack:
+            end = stack.pop()[0]
+            if end < 1 << width:
+                add_range(end, stack[-1][1] if stack else -1)
+        groups.append(NO_ROUTE)
+
+        if family == socket.AF_INET:
+            self.starts = numpy.array(starts, dtype=numpy.uint32)
+        else:
+            self.starts = numpy.array([start.to_bytes(16, "big") for start in starts], dtype="S16")
+        self.slots = numpy.array(slots, dtype=numpy.intp)
+        self.groups = numpy.array(groups, dtype=numpy.int64)
+        self.compiled = True
+
+
+def pack_addresses(addresses, family=socket.AF_INET):
+    """
+    Convert addresses to the array format used by FibLookup.lookup()
+    :param addresses: (iterable) IPv4 or IPv6 addresses, as strings
+    :param family: (int) socket.AF_INET or socket.AF_INET6
+    :return: (numpy.ndarray) uint32 array of IPv4 addresses or S16 array of packed IPv6 addresses
+    """
+    if family == socket.AF_INET:
+        return numpy.array([int.from_bytes(socket.inet_aton(address), "big") for address in addresses],
+                           dtype=numpy.uint32)
+    return numpy.array([socket.inet_pton(family, address) for address in addresses], dtype="S16")
@@ -1,7 +1,23 @@
 class FibRoute:
-    def __init__(self, prefix, next_hops):
+    """
+    A route installed in the FIB.
+    Attributes of this class are:
+        - prefix: prefix of the route
+        - group: NextHopGroup the prefix forwards to
+    """
+    __slots__ = ('prefix', 'group')
+
+    def __init__(self, prefix, group):
         self.prefix = prefix
-        self.next_hops = set(next_hops)
+        self.group = group
+
+    @property
+    def group_id(self):
+        return self.group.group_id
+
+    @property
+    def next_hops(self):
+        return self.group
 
     def __str__(self):
         sorted_next_hops = sorted(self.next_hops)
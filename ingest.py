@@ -0,0 +1,137 @@
+"""
+Streaming ingestion of route events.
+Events are newline-delimited JSON objects, read lazily from a file or from the standard input and applied to the RIB
+in batches:
+    {"op": "put", "prefix": "10.0.0.0/16", "owner": "S_SPF", "positive": ["S2"], "negative": ["S1"]}
+    {"op": "del", "prefix": "10.0.0.0/16", "owner": "S_SPF"}
+Owners are integers or the names N_SPF (1) and S_SPF (2). Empty lines and lines starting with # are ignored.
+Usage:
+    python ingest.py [--batch-size N] FILE|-
+"""
+import argparse
+import itertools
+import json
+import sys
+import time
+
+from rib import Rib
+from rib_route import RibRoute
+
+OWNERS = {"N_SPF": 1, "S_SPF": 2}
+
+
+class IngestReport:
+    """
+    Summary of an ingestion run.
+    Attributes of this class are:
+        - events: number of applied events
+        - batches: number of committed batches
+        - elapsed: seconds spent reading and applying the events
+        - fib_size: number of routes in the FIB at the end of the run
+    """
+
+    def __init__(self, events, batches, elapsed, fib_size):
+        self.events = events
+        self.batches = batches
+        self.elapsed = elapsed
+        self.fib_size = fib_size
+
+    @property
+    def events_per_second(self):
+        return self.events / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return "%d events in %d batches, %.3f s (%.0f events/s), FIB size %d" % \
+               (self.events, self.batches, self.elapsed, self.events_per_second, self.fib_size)
+
+    def __repr__(self):
+        return str(self)
+
+
+def read_events(lines):
+    """
+    Parse route events lazily
+    :param lines: (iterable) lines of newline-delimited JSON events, e.g. a file object
+    :return: (generator) tuples ("put", RibRoute) or ("del", (prefix, owner))
+    """
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            event = json.loads(line)
+            op = event["op"]
+            owner = event["owner"]
+            owner = OWNERS[owner] if isinstance(owner, str) else int(owner)
+            if op == "put":
+                yield op, RibRoute(event["prefix"], owner, event.get("positive", []), event.get("negative"))
+            elif op == "del":
+                yield op, (event["prefix"], owner)
+            else:
+                raise ValueError("unknown operation %r" % op)
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError("Invalid route event at line %d: %s" % (line_number, e)) from e
+
+
+def batched(events, batch_size):
+    """
+    Group events in lists of at most batch_size events
+    :param events: (iterable) events to group
+    :param batch_size: (int) maximum number of events of each list, it must be positive
+    :return: (generator) lists of events
+    """
+    if batch_size <= 0:
+        raise ValueError("batch_size must be positive, got %r" % batch_size)
+    return _batches(iter(events), batch_size)
+
+
+def _batches(events, batch_size):
+    while True:
+        batch = list(itertools.islice(events, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def apply_events(rib, events, batch_size=1000):
+    """
+    Apply route events to the RIB, committing a RIB batch every batch_size events
+    :param rib: (Rib) RIB to update
+    :param events: (iterable) events, as returned by read_events()
+    :param batch_size: (int) number of events of each RIB batch, it must be positive
+    :return: (IngestReport) summary of the run
+    """
+    applied = 0
+    batches = 0
+    start = time.perf_counter()
+    for batch in batched(events, batch_size):
+        with rib.batch():
+            for op, argument in batch:
+                if op == "put":
+                    rib.put_route(argument)
+                else:
+                    rib.del_route(*argument)
+        applied += len(batch)
+        batches += 1
+    return IngestReport(applied, batches, time.perf_counter() - start, len(rib.fib.routes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay newline-delimited JSON route events into a RIB")
+    parser.add_argument("trace", help="file with the route events, - for the standard input")
+    parser.add_argument("--batch-size", type=int, default=1000, help="number of events of each RIB batch")
+    args = parser.parse_args(argv)
+    if args.batch_size <= 0:
+        parser.error("--batch-size must be positive")
+
+    rib = Rib()
+    if args.trace == "-":
+        report = apply_events(rib, read_events(sys.stdin), args.batch_size)
+    else:
+        with open(args.trace) as trace:
+            report = apply_events(rib, read_events(trace), args.batch_size)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+class IpBatchKernel:
+    """
+    Kernel backend that streams the changes as commands in the format read by "ip -batch".
+    Each batch is written with a single call and the stream is flushed after it.
+    Attributes of this class are:
+        - stream: file object where the commands are written
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def apply_batch(self, adds, deletes):
+        """
+        Write a batch of changes as "ip -batch" commands
+        :param adds: (dict) routes to add or replace. Keys are prefixes, values are the sets of next hops
+        :param deletes: (iterable) prefixes to delete
+        :return:
+        """
+        lines = ["route del %s\n" % prefix for prefix in deletes]
+        for prefix, next_hops in adds.items():
+            if next_hops:
+                lines.append("route replace %s %s\n" % (prefix, " ".join("nexthop via %s" % next_hop
+                                                                          for next_hop in sorted(next_hops))))
+            else:
+                lines.append("route replace unreachable %s\n" % prefix)
+        self.stream.write("".join(lines))
+        self.stream.flush()
+
+
+def read_ip_routes(lines, proto=None):
+    """
+    Parse the output of "ip route show" (or "ip -6 route show") into the format returned by dump_routes(), so that a
+    Fib using an IpBatchKernel can be reconciled with the routes already installed in the kernel.
+    Only gateway routes (single or multipath) and unreachable routes are returned: routes without a next hop, like
+    the connected ones, are not managed by the FIB and are skipped.
+    :param lines: (iterable) lines of the "ip route show" output
+    :param proto: (string|None) if set, only the routes installed by this protocol are returned
+    :return: (dict) installed routes. Keys are prefixes, values are the sets of next hops (empty if unreachable)
+    """
+    routes = {}
+    multipath = set()
+    prefix = None
+    for line in lines:
+        words = line.split()
+        if not words:
+            continue
+        if line[0].isspace():
+            # Next hop of the multipath route on the previous lines
+            if prefix is not None and words[0] == "nexthop" and "via" in words:
+                routes[prefix].add(words[words.index("via") + 1])
+            continue
+        prefix = None
+        unreachable = words[0] == "unreachable"
+        if unreachable:
+            words = words[1:]
+        if proto is not None and ("proto" not in words or words[words.index("proto") + 1] != proto):
+            continue
+        dst = words[0]
+        if dst == "default":
+            dst = "::/0" if ":" in line else "0.0.0.0/0"
+        elif "/" not in dst:
+            dst = "%s/%d" % (dst, 128 if ":" in dst else 32)
+        if "via" in words:
+            routes[dst] = {words[words.index("via") + 1]}
+        elif unreachable:
+            routes[dst] = set()
+        elif "dev" not in words:
+            # Multipath routes list their next hops on the following lines
+            routes[dst] = set()
+            multipath.add(dst)
+            prefix = dst
+    for dst in multipath:
+        if not routes[dst]:
+            del routes[dst]
+    return routes
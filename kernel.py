@@ -1,13 +1,36 @@
 class Kernel:
     """
     A simple class representing the kernel routing table.
+    This is the in-memory kernel backend. A kernel backend is any object providing apply_batch(adds, deletes),
+    which is the only method used by the FIB to program routes. Backends that can read back their routing table also
+    provide dump_routes(), used by Fib.reconcile().
     """
 
     def __init__(self):
         self.routes = {}
 
+    def apply_batch(self, adds, deletes):
+        """
+        Program a batch of changes
+        :param adds: (dict) routes to add or replace. Keys are prefixes, values are the sets of next hops
+        :param deletes: (iterable) prefixes to delete
+        :return:
+        """
+        for prefix in deletes:
+            self.routes.pop(prefix, None)
+        for prefix, next_hops in adds.items():
+            self.routes[prefix] = "unreachable" if not next_hops else next_hops
+
+    def dump_routes(self):
+        """
+        Read the whole routing table
+        :return: (dict) installed routes. Keys are prefixes, values are the sets of next hops (empty if unreachable)
+        """
+        return {prefix: frozenset() if next_hops == "unreachable" else frozenset(next_hops)
+                for prefix, next_hops in self.routes.items()}
+
     def put_route(self, prefix, next_hops):
-        self.routes[prefix] = "unreachable" if not next_hops else next_hops
+        self.apply_batch({prefix: next_hops}, ())
 
     def delete_route(self, prefix):
-        del self.routes[prefix]
+        self.apply_batch({}, (prefix,))
@@ -0,0 +1,140 @@
+from bisect import bisect_left
+
+# Upper bounds of the latency histogram buckets, in seconds: from 1us to about 1s, doubling at each bucket
+LATENCY_BUCKETS = tuple(1e-6 * 2 ** i for i in range(21))
+
+
+class Counter:
+    """
+    A monotonic counter.
+    Attributes of this class are:
+        - name: name of the counter
+        - help: description of the counter
+        - value: current value
+    """
+    __slots__ = ('name', 'help', 'value')
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Histogram:
+    """
+    A histogram of observed values with fixed buckets.
+    Attributes of this class are:
+        - name: name of the histogram
+        - help: description of the histogram
+        - buckets: tuple of the upper bounds of the buckets, in increasing order
+        - counts: list of the number of observations of each bucket, plus one for the values above the last bound
+        - count: number of observations
+        - sum: sum of the observed values
+    """
+    __slots__ = ('name', 'help', 'buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, fraction):
+        """
+        :param fraction: (float) percentile to compute, between 0 and 1
+        :return: (float|None) upper bound of the bucket containing the percentile, None if there are no observations
+                 or if it falls above the last bucket
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return None
+
+
+class Metrics:
+    """
+    Registry of the counters and latency histograms of a RIB, its FIB and its kernel.
+    Counters are always updated. Latency is measured for one operation every latency_sampling, since timing needs
+    two clock reads and a histogram update, and not at all if latency is False.
+    Attributes of this class are:
+        - latency: if True, the latency of the operations is measured
+        - latency_sampling: one operation every latency_sampling is measured
+        - counters: dict of Counter objects, keyed by name
+        - histograms: dict of Histogram objects, keyed by name
+    """
+
+    def __init__(self, latency=True, latency_sampling=16):
+        self.latency = latency
+        self.latency_sampling = latency_sampling
+        self.counters = {}
+        self.histograms = {}
+
+    def sample(self, counter):
+        """
+        :param counter: (Counter) counter of the operation, already incremented for the current operation
+        :return: (boolean) True if the latency of the current operation has to be measured
+        """
+        return self.latency and counter.value % self.latency_sampling == 0
+
+    def counter(self, name, help):
+        """
+        :return: (Counter) the counter with the given name, created if needed
+        """
+        if name not in self.counters:
+            self.counters[name] = Counter(name, help)
+        return self.counters[name]
+
+    def histogram(self, name, help):
+        """
+        :return: (Histogram) the histogram with the given name, created if needed
+        """
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(name, help)
+        return self.histograms[name]
+
+    def snapshot(self):
+        """
+        :return: (dict) current values: counters are mapped to their value, histograms to a dict with count, sum,
+                 p50 and p99
+        """
+        values = {name: counter.value for name, counter in self.counters.items()}
+        for name, histogram in self.histograms.items():
+            values[name] = {"count": histogram.count, "sum": histogram.sum,
+                            "p50": histogram.percentile(0.5), "p99": histogram.percentile(0.99)}
+        return values
+
+    def to_prometheus(self):
+        """
+        :return: (string) all the metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for counter in self.counters.values():
+            lines.append("# HELP %s %s" % (counter.name, counter.help))
+            lines.append("# TYPE %s counter" % counter.name)
+            lines.append("%s %d" % (counter.name, counter.value))
+        for histogram in self.histograms.values():
+            lines.append("# HELP %s %s" % (histogram.name, histogram.help))
+            lines.append("# TYPE %s histogram" % histogram.name)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append('%s_bucket{le="%g"} %d' % (histogram.name, bound, cumulative))
+            lines.append('%s_bucket{le="+Inf"} %d' % (histogram.name, histogram.count))
+            lines.append("%s_sum %r" % (histogram.name, histogram.sum))
+            lines.append("%s_count %d" % (histogram.name, histogram.count))
+        return "\n".join(lines) + "\n"
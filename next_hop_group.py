@@ -0,0 +1,69 @@
+from next_hop_registry import registry
+
+
+class NextHopGroup(frozenset):
+    """
+    An immutable set of next hops shared by all the FIB and kernel entries that forward to it.
+    Attributes of this class are:
+        - group_id: integer identifier of the group, stable for the lifetime of the group
+        - mask: bitmask of the next hops of the group in the shared NextHopRegistry
+        - refcount: number of FIB entries that use the group
+    """
+    __slots__ = ('group_id', 'mask', 'refcount')
+
+    def __repr__(self):
+        return "NextHopGroup(%d: %s)" % (self.group_id, ", ".join(sorted(self)))
+
+
+class NextHopGroupTable:
+    """
+    Table of interned next hop groups. Equal sets of next hops are mapped to the same NextHopGroup object, which is
+    removed from the table when its last user releases it.
+    Attributes of this class are:
+        - groups: dict of NextHopGroup objects, keyed by next hops bitmask
+        - groups_by_id: dict of NextHopGroup objects, keyed by group_id
+    """
+
+    def __init__(self):
+        self.groups = {}
+        self.groups_by_id = {}
+        self._next_group_id = 0
+
+    def find(self, mask):
+        """
+        :param mask: (int) bitmask of the next hops to look up
+        :return: (NextHopGroup|None) the group with the given next hops, if present
+        """
+        return self.groups.get(mask)
+
+    def acquire(self, mask):
+        """
+        Get the group with the given next hops, creating it if needed, and increment its reference count
+        :param mask: (int) bitmask of the next hops of the group
+        :return: (NextHopGroup) the interned group
+        """
+        group = self.groups.get(mask)
+        if group is None:
+            group = NextHopGroup(registry.decode(mask))
+            group.group_id = self._next_group_id
+            group.mask = mask
+            group.refcount = 0
+            self._next_group_id += 1
+            self.groups[mask] = group
+            self.groups_by_id[group.group_id] = group
+        group.refcount += 1
+        return group
+
+    def release(self, group):
+        """
+        Decrement the reference count of the group, removing it from the table when it is no longer used
+        :param group: (NextHopGroup) group to release
+        :return:
+        """
+        group.refcount -= 1
+        if group.refcount == 0:
+            del self.groups[group.mask]
+            del self.groups_by_id[group.group_id]
+
+    def __len__(self):
+        return len(self.groups)
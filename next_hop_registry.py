@@ -0,0 +1,86 @@
+import functools
+import threading
+
+_EMPTY = frozenset()
+
+
+class NextHopRegistry:
+    """
+    Registry that maps each next hop to a bit position, so that sets of next hops can be stored as integer bitmasks.
+    Union, difference and equality of sets of next hops become single integer operations; sets of names are only
+    built when they are needed (API and string representation), and the decoded sets of the cache_size most recently
+    used masks are cached.
+    Bit positions are never reused, so the masks of existing routes stay valid: the registry grows with the number of
+    distinct next hops ever seen, which is bounded by the neighbors of the node. Registering a next hop is protected by
+    a lock and the decode cache is thread-safe, so the registry can be shared by threads.
+    Attributes of this class are:
+        - bits: dict of bit positions, keyed by next hop
+        - next_hops: list of next hops, indexed by bit position
+        - cache_size: maximum number of decoded sets kept in the cache
+    """
+
+    def __init__(self, cache_size=65536):
+        self.bits = {}
+        self.next_hops = []
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._decode = functools.lru_cache(maxsize=cache_size)(self._decode_uncached)
+
+    def encode(self, next_hops):
+        """
+        :param next_hops: (iterable) next hops to encode, new next hops are registered
+        :return: (int) bitmask of the given next hops
+        """
+        mask = 0
+        for next_hop in next_hops:
+            bit = self.bits.get(next_hop)
+            if bit is None:
+                bit = self._register(next_hop)
+            mask |= 1 << bit
+        return mask
+
+    def _register(self, next_hop):
+        with self._lock:
+            bit = self.bits.get(next_hop)
+            if bit is None:
+                bit = len(self.next_hops)
+                # The next hop is added to the list first, so that a bit read from bits can always be decoded
+                self.next_hops.append(next_hop)
+                self.bits[next_hop] = bit
+            return bit
+
+    def lookup(self, next_hop):
+        """
+        :param next_hop: (string) next hop to look up, it is not registered if it is new
+        :return: (int) bitmask of the next hop, 0 if it is not registered
+        """
+        bit = self.bits.get(next_hop)
+        return 0 if bit is None else 1 << bit
+
+    def decode(self, mask):
+        """
+        :param mask: (int) bitmask of next hops
+        :return: (frozenset) set of next hops of the given bitmask
+        """
+        if not mask:
+            return _EMPTY
+        return self._decode(mask)
+
+    def _decode_uncached(self, mask):
+        names = []
+        remaining = mask
+        while remaining:
+            lowest = remaining & -remaining
+            names.append(self.next_hops[lowest.bit_length() - 1])
+            remaining ^= lowest
+        return frozenset(names)
+
+    def cache_info(self):
+        """
+        :return: (CacheInfo) hits, misses, maximum and current size of the decode cache
+        """
+        return self._decode.cache_info()
+
+
+# Registry shared by all the routes
+registry = NextHopRegistry()
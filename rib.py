@@ -1,20 +1,227 @@
-import pytricia
+import ipaddress
+import itertools
+import time
+from contextlib import contextmanager
 
 from destination import Destination
+from dual_stack_trie import DualStackTrie
 from fib import Fib
+from next_hop_registry import registry
+from rib_batch import RibBatch, BatchReport
+from route_preference import PreferenceTable
 
 
 class Rib:
     """
     Class representing the RIB of a node.
     Attributes of this class are:
-        - destinations: a Patricia Trie. Keys are IP prefixes and values are Destination objects
-        - fib: instance of the FIB of this node
+        - destinations: a dual stack Patricia Trie. Keys are IPv4 or IPv6 prefixes and values are Destination objects
+        - fib: instance of the FIB of this node (a new Fib with the in-memory kernel if not given)
+        - metrics: Metrics of the RIB, shared with the FIB
+        - preferences: PreferenceTable used to select the best route among the routes of different owners (a table
+                       ranking the owners by their numerical value if not given). It must not be changed once routes
+                       have been added
+        - dampening: FlapDampening of the best route changes, None to disable dampening
+        - compress: True to install in the FIB only the prefixes whose computed next hops differ from the ones of
+                    their parent prefix. The other prefixes forward like their nearest installed ancestor, which is
+                    found by the longest prefix match in their place. The RIB keeps every destination, and prefixes
+                    are installed or removed as the next hops of their parent change
+    Operations can be grouped in a batch (see begin(), commit() and rollback()): the RIB is updated right away, while
+    next hops propagation and FIB writes are performed once per prefix when the batch is committed.
+    Errors of the kernel backend, like queue.Full raised by an AsyncKernel whose queue is full, are raised once an
+    operation has been propagated to the RIB and the FIB: the changes that could not be sent stay pending in the FIB,
+    and are sent by the next write to the kernel backend (see Fib.flush_deferred()).
     """
 
-    def __init__(self):
-        self.destinations = pytricia.PyTricia()
-        self.fib = Fib()
+    def __init__(self, fib=None, preferences=None, dampening=None, compress=False):
+        self.destinations = DualStackTrie()
+        self.fib = fib if fib is not None else Fib()
+        self.preferences = preferences if preferences is not None else PreferenceTable()
+        self.metrics = self.fib.metrics
+        self.dampening = dampening
+        self.compress = compress
+        self._batch = None
+        self._put_routes = self.metrics.counter("rib_put_route_total", "Calls to Rib.put_route")
+        self._del_routes = self.metrics.counter("rib_del_route_total", "Calls to Rib.del_route")
+        self._children_visited = self.metrics.counter("rib_children_visited_total",
+                                                      "Descendants whose next hops were refreshed by propagation")
+        self._children_changed = self.metrics.counter("rib_children_changed_total",
+                                                      "Descendants whose next hops changed during propagation")
+        self._children_skipped = self.metrics.counter(
+            "rib_children_skipped_total",
+            "Descendants skipped by propagation because the changed next hops do not reach them")
+        self._compressed = self.metrics.counter(
+            "rib_fib_compressed_total",
+            "Routes left out of the FIB by compression because they forward like their parent prefix")
+        self._put_route_seconds = self.metrics.histogram("rib_put_route_seconds", "Latency of Rib.put_route")
+        self._del_route_seconds = self.metrics.histogram("rib_del_route_seconds", "Latency of Rib.del_route")
+        self._dampening_held = self.metrics.counter("rib_dampening_held_total",
+                                                    "Best route changes held by flap dampening")
+        self._dampening_released = self.metrics.counter("rib_dampening_released_total",
+                                                        "Dampened prefixes released after their penalty decayed")
+        self._dampening_writes_avoided = self.metrics.counter(
+            "rib_dampening_writes_avoided_total",
+            "FIB writes avoided by flap dampening, estimated from the last propagated change of each held prefix")
+
+    def begin(self):
+        """
+        Start a batch of operations. Until commit() or rollback() is called, put_route() and del_route() only update
+        the RIB and record which destinations changed.
+        :return: (RibBatch) the object recording the batch
+        """
+        if self._batch is not None:
+            raise RuntimeError("A batch is already in progress")
+        self._batch = RibBatch()
+        return self._batch
+
+    def commit(self):
+        """
+        Commit the current batch. Changed destinations are processed top-down, recomputing each affected subtree,
+        and exactly one FIB write is sent for each prefix whose forwarding changed.
+        A destination whose best route changed during the batch is handled as if its final best route had been put.
+        :return: (BatchReport) summary of the batch
+        """
+        batch = self._batch
+        if batch is None:
+            raise RuntimeError("No batch in progress")
+        for prefix in batch.deleted:
+            if batch.rolled_back and self.destinations.has_key(prefix):
+                # The prefix has been put back, it is written with its best route below
+                continue
+            batch.write(prefix, None)
+            if self.dampening is not None:
+                self.dampening.forget(prefix)
+        changed_prefixes = sorted(batch.dirty | batch.refresh, key=lambda x: int(x.split('/')[1]))
+        destinations = 0
+        for prefix in changed_prefixes:
+            # Destination may have been removed by a superfluous children deletion
+            if not self.destinations.has_key(prefix):
+                continue
+            destination = self.destinations.get(prefix)
+            destinations += 1
+            if prefix in batch.dirty:
+                # Next hops computed while the batch was open may come from an ancestor that changed afterwards
+                destination.refresh_next_hops()
+                if batch.rolled_back:
+                    # The best route is the one before the batch, which stays held if the prefix was dampened. It is
+                    # not a new best route, so its children are not checked for superfluous ones
+                    if self.dampening is None or prefix not in self.dampening.suppressed:
+                        self._fib_put_route(destination.best_route)
+                        self._update_prefix_children(destination)
+                # A prefix deleted and added again during the batch is new, it is not a flap
+                elif prefix in batch.deleted or not self._dampened(destination):
+                    self._best_route_changed(destination)
+            else:
+                changed_mask = destination.refresh_next_hops()
+                # With compression, the new parent may also change whether the prefix is installed
+                if changed_mask or self.compress:
+                    self._fib_put_route(destination.best_route)
+                if changed_mask:
+                    self._update_prefix_children(destination, changed_mask)
+        self._batch = None
+
+        fib_writes = 0
+        for prefix, rte in batch.writes.items():
+            if rte is None:
+                if prefix in self.fib.routes:
+                    self.fib.delete_route(prefix)
+                    fib_writes += 1
+            elif self.fib.put_route(rte):
+                fib_writes += 1
+        batch.report = BatchReport(batch.operations, destinations, fib_writes, batch.write_requests - fib_writes)
+        self.release_dampened()
+        self.fib.flush()
+        return batch.report
+
+    def rollback(self):
+        """
+        Undo the operations of the current batch and commit it. The routes replaced or deleted during the batch are
+        put back and the routes added are deleted, so that the RIB and the FIB are left as they were when the batch
+        began (the FIB is not written while the batch is open, only the prefixes recomputed since are written again)
+        :return: (BatchReport) summary of the batch, its operations include the ones performed to undo the batch
+        """
+        batch = self._batch
+        if batch is None:
+            raise RuntimeError("No batch in progress")
+        undo, batch.undo = batch.undo, None
+        for (prefix, owner), (rte, stale) in undo.items():
+            if rte is None:
+                self._del_route(prefix, owner)
+            else:
+                self._put_route(rte)
+                rte.stale = stale
+        batch.rolled_back = True
+        return self.commit()
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager that performs the enclosed operations in a batch, committing it on exit. If the enclosed
+        block raises an exception, the batch is rolled back instead (see rollback()) and the exception is raised again.
+        The report is available in the report attribute of the yielded RibBatch object.
+        """
+        batch = self.begin()
+        try:
+            yield batch
+        except BaseException:
+            self.rollback()
+            raise
+        self.commit()
+
+    def load(self, routes):
+        """
+        Fill an empty RIB with the given routes and build the FIB in one top-down pass, without propagating each
+        route to the children of its prefix. Routes must be sorted from the less specific to the more specific
+        prefix, and must not contain superfluous children (as it happens for the routes of a converged RIB).
+        :param routes: (iterable) RibRoute objects to load
+        :return:
+        """
+        if len(self.destinations):
+            raise RuntimeError("Routes can only be loaded in an empty RIB")
+        for route in routes:
+            if not self.destinations.has_key(route.prefix):
+                # Routes are sorted, so the trie does not contain more specific prefixes yet
+                prefix_destination = self._add_destination(route.prefix, leaf=True)
+            else:
+                prefix_destination = self.destinations.get(route.prefix)
+            prefix_destination.put_route(route)
+        # Parents are visited before their children
+        best_routes = (self.destinations.get(prefix).best_route for prefix in self.destinations)
+        if self.compress:
+            best_routes = (rte for rte in best_routes if not self._forwards_like_parent(rte))
+        self.fib.put_routes(best_routes)
+
+    def mark_stale(self, owner):
+        """
+        Mark as stale all the routes of the given owner, e.g. after a restart or an adjacency reset. Routes put again
+        afterwards replace the stale ones, the others are removed by sweep_stale().
+        :param owner: (int) owner of the routes
+        :return: (int) number of routes marked as stale
+        """
+        marked = 0
+        for prefix in self.destinations:
+            rte = self.destinations.get(prefix).get_route(owner)
+            if rte is not None:
+                rte.stale = True
+                marked += 1
+        return marked
+
+    def sweep_stale(self, owner):
+        """
+        Delete all the stale routes of the given owner in a single batch, so that each affected subtree is
+        recomputed once and a single FIB delta is sent.
+        :param owner: (int) owner of the routes
+        :return: (BatchReport) summary of the batch, its operations are the deleted routes
+        """
+        stale_prefixes = []
+        for prefix in self.destinations:
+            rte = self.destinations.get(prefix).get_route(owner)
+            if rte is not None and rte.stale:
+                stale_prefixes.append(prefix)
+        with self.batch() as batch:
+            for prefix in stale_prefixes:
+                self.del_route(prefix, owner)
+        return batch.report
 
     def put_route(self, route):
         """
@@ -22,37 +229,49 @@ class Rib:
         :param route: (RibRoute) the object to add to the Destination associated to the prefix
         :return:
         """
+        self._put_routes.inc()
+        if not self.metrics.sample(self._put_routes):
+            self._put_route(route)
+        else:
+            start = time.perf_counter()
+            self._put_route(route)
+            self._put_route_seconds.observe(time.perf_counter() - start)
+        if self._batch is None:
+            self.fib.flush_deferred()
+
+    def _put_route(self, route):
+        """
+        Implementation of put_route(), without metrics
+        """
+        if self.dampening is not None and self._batch is None:
+            self.release_dampened()
         # If there is no Destination object for the prefix, create a new Destination object
         # for the given prefix and insert it in the Trie
         if not self.destinations.has_key(route.prefix):
-            prefix_destination = Destination(self, route.prefix)
-            self.destinations.insert(route.prefix, prefix_destination)
+            if self._batch is not None:
+                self._batch.record(route.prefix, route.owner, None)
+            prefix_destination = self._add_destination(route.prefix)
         else:
             prefix_destination = self.destinations.get(route.prefix)
+            if self._batch is not None:
+                self._batch.record(route.prefix, route.owner, prefix_destination.get_route(route.owner))
+        route.stale = False
+        # Next hops the children of the prefix have been computed from
+        old_next_hops_mask = prefix_destination.routes[0].cached_next_hops_mask if prefix_destination.routes else None
         # Insert desired route in destination object
         best_changed = prefix_destination.put_route(route)
 
-        # Get children prefixes before performing actions on the prefix (it can be deleted from the Trie)
-        children_prefixes = self.destinations.children(prefix_destination.prefix)
-
-        # TODO: ask if this case can occur
-        # update_fib = True
-        # if prefix_dest.parent_prefix_dest is not None and \
-        #         prefix_dest.best_route.next_hops == prefix_dest.parent_prefix_dest.best_route.next_hops:
-        #     del self.destinations[prefix_dest.prefix]
-        #     self.fib.delete_route(prefix_dest.prefix)
-        #     update_fib = False
-        #
-        # if update_fib:
-
         # If best route changed in Destination object
         if best_changed:
-            # Update prefix in the fib
-            self.fib.put_route(prefix_destination.best_route)
-            # Try to delete superfluous children
-            if not self._delete_superfluous_children(prefix_destination, children_prefixes):
-                # If children have not been deleted, update them
-                self._update_prefix_children(children_prefixes)
+            if self._batch is not None:
+                # Changes are propagated when the batch is committed
+                self._batch.operations += 1
+                self._batch.write_requests += 1
+                self._batch.dirty.add(prefix_destination.prefix)
+            elif not self._dampened(prefix_destination):
+                self._best_route_changed(prefix_destination, old_next_hops_mask)
+        elif self._batch is not None:
+            self._batch.operations += 1
 
     def del_route(self, prefix, owner):
         """
@@ -62,65 +281,416 @@ class Rib:
         :param owner: (int) owner of the prefix
         :return: (boolean) if the route has been deleted or not
         """
+        self._del_routes.inc()
+        if not self.metrics.sample(self._del_routes):
+            deleted = self._del_route(prefix, owner)
+        else:
+            start = time.perf_counter()
+            deleted = self._del_route(prefix, owner)
+            self._del_route_seconds.observe(time.perf_counter() - start)
+        if self._batch is None:
+            self.fib.flush_deferred()
+        return deleted
+
+    def _del_route(self, prefix, owner):
+        """
+        Implementation of del_route(), without metrics
+        """
+        if self.dampening is not None and self._batch is None:
+            self.release_dampened()
         destination_deleted = False
         best_changed = False
-        children_prefixes = None
+        destination = None
         # Check if the prefix is stored in the trie
         if self.destinations.has_key(prefix):
-            # Get children prefixes before performing actions on the prefix (it can be deleted from the Trie)
-            children_prefixes = self.destinations.children(prefix)
             destination = self.destinations.get(prefix)
+            old_next_hops_mask = destination.best_route.cached_next_hops_mask
+            if self.dampening is not None and prefix in self.dampening.suppressed:
+                # Held changes have not been propagated, the children have been computed from older next hops
+                old_next_hops_mask = None
+            if self._batch is not None:
+                self._batch.record(prefix, owner, destination.get_route(owner))
             # Delete route from the Destination object
             deleted, best_changed = destination.del_route(owner)
             # Route was not present in Destination object, nothing to do
             if not deleted:
                 return
+            if self._batch is not None:
+                self._batch.operations += 1
             if not destination.routes:
                 # No more routes available for current prefix, delete it from trie and FIB
-                self.destinations.delete(prefix)
-                self.fib.delete_route(prefix)
+                self._remove_destination(destination)
+                if self._batch is not None:
+                    # Children of the removed destination are refreshed against their new parent at commit time
+                    self._batch.write_requests += 1
+                    self._batch.deleted.add(prefix)
+                    self._batch.dirty.discard(prefix)
+                    self._batch.refresh.discard(prefix)
+                    self._batch.refresh.update(child.prefix for child in destination.children)
+                    return deleted
+                self._fib_delete_route(prefix)
                 destination_deleted = True
+                # Children now inherit the next hops of the new parent, or none if there is no parent. Children left
+                # without parent must also be installed in a compressed FIB, whatever their next hops
+                if old_next_hops_mask is None or (self.compress and destination.parent is None):
+                    changed_mask = -1
+                else:
+                    changed_mask = old_next_hops_mask ^ self._inherited_next_hops_mask(destination)
             elif best_changed:
+                if self._batch is not None:
+                    self._batch.write_requests += 1
+                    self._batch.dirty.add(prefix)
+                    return deleted
+                if self._dampened(destination):
+                    return deleted
                 # Best route changed, push it in the FIB
-                self.fib.put_route(destination.best_route)
+                self._fib_put_route(destination.best_route)
+                changed_mask = destination.best_route.changed_next_hops_mask(old_next_hops_mask)
         else:
             deleted = False
         if deleted and (best_changed or destination_deleted):
-            # If route has been deleted and an event occurred (best changed or destination deleted), update children
-            self._update_prefix_children(children_prefixes)
+            # If route has been deleted and an event occurred (best changed or destination deleted), update children.
+            # If the destination has been deleted, its children are now attached to its parent.
+            self._update_prefix_children(destination, changed_mask)
         return deleted
 
-    def _update_prefix_children(self, children_prefixes):
+    def _add_destination(self, prefix, leaf=False):
+        """
+        Create a Destination object for the given prefix, insert it in the trie and link it between its parent and
+        the children of the parent that are covered by the new prefix
+        :param prefix: (string) prefix of the new destination
+        :param leaf: (boolean) True if the trie is known not to contain more specific prefixes
+        :return: (Destination) the new Destination object
+        """
+        destination = Destination(self.preferences, prefix)
+        self.destinations.insert(prefix, destination)
+        parent_prefix = self.destinations.parent(prefix)
+        parent_destination = self.destinations.get(parent_prefix) if parent_prefix is not None else None
+        children = None
+        descendants = None if leaf else self.destinations.children(prefix)
+        if descendants:
+            # The children of the new destination are the descendants that were children of its parent: the smaller
+            # of the two sets is filtered, without looking up the parent of each descendant in the trie
+            if parent_destination is not None and len(parent_destination.children) < len(descendants):
+                descendants = set(descendants)
+                children = [child for child in parent_destination.children if child.prefix in descendants]
+            else:
+                children = [child for child in map(self.destinations.get, descendants)
+                            if child.parent is parent_destination]
+        if children:
+            for child_destination in children:
+                child_destination.parent = destination
+                if parent_destination is not None:
+                    parent_destination.discard_child(child_destination)
+            destination.add_children(children)
+            destination.descendants = len(children) + sum(child.descendants for child in children)
+        if parent_destination is not None:
+            destination.parent = parent_destination
+            parent_destination.add_children((destination,))
+            self._count_descendants(destination, 1)
+        return destination
+
+    @staticmethod
+    def _count_descendants(destination, count):
+        """
+        Update the number of descendants of the ancestors of the given destination
+        :param destination: (Destination) object whose ancestors are updated
+        :param count: (int) number of descendants added to the ancestors, negative if descendants have been removed
+        :return:
+        """
+        ancestor = destination.parent
+        while ancestor is not None:
+            ancestor.descendants += count
+            ancestor = ancestor.parent
+
+    def _remove_destination(self, destination):
+        """
+        Delete the given Destination object from the trie and attach its children to its parent
+        :param destination: (Destination) the object to remove
+        :return:
+        """
+        parent_destination = destination.parent
+        self.destinations.delete(destination.prefix)
+        self._count_descendants(destination, -1)
+        # In a batch, the prefix is forgotten at commit time unless the batch is rolled back
+        if self.dampening is not None and self._batch is None:
+            self.dampening.forget(destination.prefix)
+        for child_destination in destination.children:
+            child_destination.parent = parent_destination
+        if parent_destination is not None:
+            parent_destination.discard_child(destination)
+            parent_destination.add_children(destination.children)
+
+    def _best_route_changed(self, prefix_dest, old_next_hops_mask=None):
+        """
+        Push the best route of the given destination in the FIB and propagate the change to its children
+        :param prefix_dest: (Destination) object whose best route changed
+        :param old_next_hops_mask: (int|None) bitmask of the next hops the children have been computed from, None if
+                                   it is not known and the dependent children must be computed from scratch
+        :return:
+        """
+        # Update prefix in the fib
+        self._fib_put_route(prefix_dest.best_route)
+        # Try to delete superfluous children
+        if not self._delete_superfluous_children(prefix_dest):
+            # If children have not been deleted, update them
+            changed = self._update_prefix_children(
+                prefix_dest, prefix_dest.best_route.changed_next_hops_mask(old_next_hops_mask))
+            if self.dampening is not None:
+                self.dampening.propagated(prefix_dest.prefix, 1 + changed)
+
+    def _dampened(self, prefix_dest):
+        """
+        Record a flap of the given destination if dampening is enabled. Only changes of prefixes already in the FIB
+        are flaps, new prefixes (and, with compression, prefixes forwarding like their parent) are always installed
+        :param prefix_dest: (Destination) object whose best route changed
+        :return: (boolean) True if the change must be held
+        """
+        if self.dampening is None or prefix_dest.prefix not in self.fib.routes or \
+                not self.dampening.flap(prefix_dest):
+            return False
+        self._dampening_held.inc()
+        self._dampening_writes_avoided.inc(self.dampening.avoided_writes(prefix_dest.prefix))
+        return True
+
+    def release_dampened(self):
+        """
+        Propagate the held changes of the dampened prefixes whose penalty decayed below the reuse threshold, including
+        the changes of their parents, by installing their best route and computing their descendants from scratch. It
+        is called by put_route(), del_route() and commit(), and should also be called periodically when the RIB is
+        idle
+        :return: (int) number of released prefixes
+        """
+        if self.dampening is None or self._batch is not None:
+            return 0
+        released = 0
+        for prefix in sorted(self.dampening.releasable(), key=lambda x: int(x.split('/')[1])):
+            if self.destinations.has_key(prefix):
+                self._best_route_changed(self.destinations.get(prefix))
+                released += 1
+        self._dampening_released.inc(released)
+        if released:
+            self.fib.flush_deferred()
+        return released
+
+    def _fib_put_route(self, rte):
         """
-        Refresh children next hops
-        :param children_prefixes: (list) all the children at each level of a given prefix
+        Install a route in the FIB, or record it in the batch being committed. With compression, a route forwarding
+        like its parent prefix is removed from the FIB instead
+        :param rte: (RibRoute) route to install
         :return:
         """
-        for child_prefix in children_prefixes:
-            child_prefix_dest = self.destinations.get(child_prefix)
-            self.fib.put_route(child_prefix_dest.best_route)
+        if self.compress and self._forwards_like_parent(rte):
+            self._compressed.inc()
+            self._fib_delete_route(rte.prefix)
+        elif self._batch is not None:
+            self._batch.write(rte.prefix, rte)
+        else:
+            self.fib.put_route(rte)
+
+    def _fib_delete_route(self, prefix):
+        """
+        Delete a prefix from the FIB if it is installed, or record the deletion in the batch being committed
+        :param prefix: (string) prefix to delete
+        :return:
+        """
+        if self._batch is not None:
+            self._batch.write(prefix, None)
+        elif prefix in self.fib.routes:
+            self.fib.delete_route(prefix)
+
+    def _update_prefix_children(self, prefix_dest, changed_mask=-1):
+        """
+        Update next hops of the descendants that depend on the given destination, propagating the next hops that
+        changed: each descendant only copies the changed next hops it inherits, and passes its own changed next hops
+        to its children. Only descendants with negative next hops depend on their parent, descendants whose positive
+        and negative next hops already cover every changed next hop are skipped, and a branch is not visited further
+        once the computed next hops of a descendant did not change, so the work is proportional to the number of
+        routes that actually change.
+        The next hops of a descendant whose changes are held by dampening are updated in the RIB, but neither its FIB
+        entry nor its own descendants are: they are computed again from scratch when the prefix is released.
+        :param prefix_dest: (Destination) object whose best route changed or that has been removed from the trie
+        :param changed_mask: (int) bitmask of the next hops added to or removed from the next hops the children
+                             inherit, -1 if they are not known and the dependent descendants must be computed from
+                             scratch
+        :return: (int) number of descendants whose next hops changed
+        """
+        if not changed_mask:
+            return 0
+        # Flat stack of the pending (children, changed mask, next hops mask of their parent) entries
+        pending = [prefix_dest.children, changed_mask, self._inherited_next_hops_mask(prefix_dest)]
+        visited = skipped = changed = 0
+        compress = self.compress
+        held = self.dampening.suppressed if self.dampening is not None else None
+        while pending:
+            next_hops_mask = pending.pop()
+            changed_mask = pending.pop()
+            for child_prefix_dest in pending.pop():
+                routes = child_prefix_dest.routes
+                best_route = routes[0]
+                if len(routes) > 1:
+                    visited += 1
+                    child_changed_mask = child_prefix_dest.update_next_hops(changed_mask, next_hops_mask)
+                else:
+                    negative_mask = best_route.negative_next_hops_mask
+                    if negative_mask and changed_mask & ~(best_route.positive_next_hops_mask | negative_mask):
+                        visited += 1
+                        child_changed_mask = best_route.update_next_hops(changed_mask, next_hops_mask)
+                    else:
+                        skipped += 1
+                        child_changed_mask = 0
+                if held and child_prefix_dest.prefix in held:
+                    continue
+                if child_changed_mask:
+                    changed += 1
+                    self._fib_put_route(best_route)
+                    if child_prefix_dest.children:
+                        pending.extend((child_prefix_dest.children, child_changed_mask, best_route.next_hops_mask))
+                elif compress and self._parent_match_changed(best_route, changed_mask, next_hops_mask):
+                    self._fib_put_route(best_route)
+        # Most propagations reach no descendant, the counters are only updated when needed
+        if visited:
+            self._children_visited.inc(visited)
+        if skipped:
+            self._children_skipped.inc(skipped)
+        if changed:
+            self._children_changed.inc(changed)
+        return changed
+
+    def _forwards_like_parent(self, rte):
+        """
+        :param rte: (RibRoute) best route of a destination
+        :return: (boolean) True if the computed next hops of the route are the ones of the best route of the parent
+                 prefix, so that the route can be left out of a compressed FIB. A route is never left out while the
+                 changes of its parent are held by dampening, as the FIB entry of the parent may then differ from
+                 its best route
+        """
+        parent_prefix_dest = rte.destination.parent
+        if parent_prefix_dest is None or rte.next_hops_mask != parent_prefix_dest.best_route.next_hops_mask:
+            return False
+        return self.dampening is None or parent_prefix_dest.prefix not in self.dampening.suppressed
+
+    @staticmethod
+    def _parent_match_changed(rte, parent_changed_mask, parent_next_hops_mask):
+        """
+        :param rte: (RibRoute) best route of a child whose computed next hops did not change
+        :param parent_changed_mask: (int) bitmask of the changed next hops of the parent, -1 if not known
+        :param parent_next_hops_mask: (int) bitmask of the new computed next hops of the parent
+        :return: (boolean) True if the route may have started or stopped forwarding like its parent
+        """
+        if parent_changed_mask == -1:
+            return True
+        next_hops_mask = rte.next_hops_mask
+        return (next_hops_mask == parent_next_hops_mask) != \
+            (next_hops_mask == parent_next_hops_mask ^ parent_changed_mask)
+
+    @staticmethod
+    def _inherited_next_hops_mask(prefix_dest):
+        """
+        :param prefix_dest: (Destination) object whose children are updated, possibly removed from the trie
+        :return: (int) bitmask of the next hops the children of the destination inherit: the ones of its best route,
+                 or of the best route of its parent if it has been removed (none if there is no parent)
+        """
+        if prefix_dest.routes:
+            return prefix_dest.best_route.next_hops_mask
+        if prefix_dest.parent is not None:
+            return prefix_dest.parent.best_route.next_hops_mask
+        return 0
 
-    def _delete_superfluous_children(self, prefix_dest, children_prefixes):
+    def _delete_superfluous_children(self, prefix_dest):
         """
         Delete superfluous children of the given prefix from the RIB and the FIB when it is unreachable
         :param prefix_dest: (Destination) object to check for superfluous children
-        :param children_prefixes: (list) children of given prefix
         :return: (boolean) if children of the given prefix have been removed or not
         """
         best_route = prefix_dest.best_route
-        if (not best_route.positive_next_hops and best_route.negative_next_hops) and not best_route.next_hops \
-                and prefix_dest.parent_prefix_dest:
-            for child_prefix in children_prefixes:
+        if (not best_route.positive_next_hops_mask and best_route.negative_next_hops_mask) \
+                and not best_route.next_hops_mask and prefix_dest.parent:
+            for child_prefix in self.destinations.children(prefix_dest.prefix):
                 self.destinations.delete(child_prefix)
-                self.fib.delete_route(child_prefix)
+                # Changes are only propagated outside of a batch or when it is committed, the deletion is final
+                if self.dampening is not None:
+                    self.dampening.forget(child_prefix)
+                self._fib_delete_route(child_prefix)
+            prefix_dest.clear_children()
+            self._count_descendants(prefix_dest, -prefix_dest.descendants)
+            prefix_dest.descendants = 0
             return True
 
         return False
 
+    def show(self, prefix=None, longer_prefixes=False, owner=None, next_hop=None, offset=0, limit=None):
+        """
+        Stream the routes of the RIB, one line per route, without building the whole output. Each line is the route
+        followed by its computed next hops, the best route of each prefix is marked with "*". Prefixes are shown
+        parents first. The RIB must not be changed until the iteration is over.
+        :param prefix: (string|None) show only this prefix (all the prefixes if None)
+        :param longer_prefixes: (boolean) also show the prefixes more specific than the given one
+        :param owner: (int|None) show only the routes of this owner
+        :param next_hop: (string|None) show only the routes whose computed next hops contain this next hop
+        :param offset: (int) number of lines to skip
+        :param limit: (int|None) maximum number of lines to return
+        :return: (iterator) lines of the output
+        """
+        next_hop_mask = registry.lookup(next_hop) if next_hop is not None else None
+        lines = (
+            "%s%s => %s" % ("*" if rte is destination.best_route else " ", rte, ", ".join(sorted(rte.next_hops)))
+            for destination in self._show_destinations(prefix, longer_prefixes)
+            for rte in (destination.routes if owner is None else filter(None, (destination.get_route(owner),)))
+            if next_hop_mask is None or rte.next_hops_mask & next_hop_mask
+        )
+        return itertools.islice(lines, offset, None if limit is None else offset + limit)
+
+    def show_fib(self, prefix=None, longer_prefixes=False, next_hop=None, offset=0, limit=None):
+        """
+        Stream the routes of the FIB, one line per route, selecting the prefixes with the trie of the RIB.
+        See show() for the parameters
+        :return: (iterator) lines of the output
+        """
+        prefixes = (destination.prefix for destination in self._show_destinations(prefix, longer_prefixes))
+        return self.fib.show(prefixes, next_hop, offset, limit)
+
+    def _show_destinations(self, prefix, longer_prefixes):
+        """
+        :param prefix: (string|None) prefix to show, None for all the prefixes
+        :param longer_prefixes: (boolean) also include the prefixes more specific than the given one
+        :return: (iterator) Destination objects to show, parents first
+        """
+        if prefix is None:
+            prefixes = iter(self.destinations)
+        elif not self.destinations.has_key(prefix):
+            prefixes = self._covered_prefixes(prefix) if longer_prefixes else ()
+        elif longer_prefixes:
+            prefixes = itertools.chain((prefix,), self.destinations.children(prefix))
+        else:
+            prefixes = (prefix,)
+        return (self.destinations.get(child_prefix) for child_prefix in prefixes)
+
+    def _covered_prefixes(self, prefix):
+        """
+        Prefixes more specific than a prefix that is not in the trie. The most specific ones are the children of the
+        destination covering the prefix (or the destinations without parent) that fall within the prefix
+        :param prefix: (string) prefix not in the trie
+        :return: (iterator) covered prefixes, parents first
+        """
+        network = ipaddress.ip_network(prefix)
+        covering_destination = self.destinations.get(prefix)
+        if covering_destination is not None:
+            candidates = covering_destination.children
+        else:
+            candidates = (destination for destination in map(self.destinations.get, self.destinations)
+                          if destination.parent is None)
+        tops = []
+        for destination in candidates:
+            candidate_network = ipaddress.ip_network(destination.prefix)
+            if candidate_network.version == network.version and candidate_network.subnet_of(network):
+                tops.append(candidate_network)
+        for top in sorted(tops):
+            yield str(top)
+            yield from self.destinations.children(str(top))
+
     def __str__(self):
-        rep_str = ""
-        for prefix in self.destinations:
-            rep_str += str(self.destinations.get(prefix))
+        rep_str = "".join(str(self.destinations.get(prefix)) for prefix in self.destinations)
         return "RIB:\n%s\n\nFIB:\n%s" % (rep_str, str(self.fib))
 
     def __repr__(self):
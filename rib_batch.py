@@ -0,0 +1,75 @@
+class RibBatch:
+    """
+    Class that records the changes performed on the RIB between Rib.begin() and Rib.commit().
+    Attributes of this class are:
+        - operations: number of put/del operations performed during the batch
+        - write_requests: number of FIB writes requested. It counts the writes that the operations would have sent
+                          to the FIB right away, plus the ones requested while committing
+        - dirty: set of prefixes whose best route changed during the batch
+        - refresh: set of prefixes whose parent prefix changed during the batch (because it has been removed)
+        - deleted: set of prefixes whose Destination object has been removed during the batch
+        - writes: dict of FIB writes collected while committing. Keys are prefixes, values are the RibRoute to install
+                  or None if the prefix has to be deleted. A later write for a prefix replaces the previous one
+        - undo: dict of the routes replaced or deleted during the batch, keyed by (prefix, owner). Values are
+                (route, stale) tuples of the route found before the first operation on the key and of its stale flag,
+                route is None if there was no route. None while the batch is rolled back
+        - rolled_back: True if the operations of the batch have been undone by Rib.rollback()
+        - report: BatchReport of the batch, set when the batch is committed
+    """
+
+    def __init__(self):
+        self.operations = 0
+        self.write_requests = 0
+        self.dirty = set()
+        self.refresh = set()
+        self.deleted = set()
+        self.writes = {}
+        self.undo = {}
+        self.rolled_back = False
+        self.report = None
+
+    def write(self, prefix, rte):
+        """
+        Record a FIB write, replacing any previous write for the same prefix
+        :param prefix: (string) prefix to write
+        :param rte: (RibRoute|None) route to install, None to delete the prefix
+        :return:
+        """
+        self.write_requests += 1
+        self.writes[prefix] = rte
+
+    def record(self, prefix, owner, rte):
+        """
+        Record the route found for the given prefix and owner before an operation, unless an earlier operation of the
+        batch already did
+        :param prefix: (string) prefix of the operation
+        :param owner: (int) owner of the operation
+        :param rte: (RibRoute|None) route of the owner for the prefix, None if there is none
+        :return:
+        """
+        if self.undo is not None and (prefix, owner) not in self.undo:
+            self.undo[(prefix, owner)] = (rte, rte.stale if rte is not None else False)
+
+
+class BatchReport:
+    """
+    Summary of a committed batch.
+    Attributes of this class are:
+        - operations: number of put/del operations performed during the batch
+        - destinations: number of destinations recomputed at commit time
+        - fib_writes: number of writes actually sent to the FIB (and to the kernel)
+        - writes_saved: number of requested FIB writes that have been coalesced or suppressed
+    """
+
+    def __init__(self, operations, destinations, fib_writes, writes_saved):
+        self.operations = operations
+        self.destinations = destinations
+        self.fib_writes = fib_writes
+        self.writes_saved = writes_saved
+
+    def __str__(self):
+        return "%d operations, %d destinations, %d FIB writes, %d writes saved" % \
+               (self.operations, self.destinations, self.fib_writes, self.writes_saved)
+
+    def __repr__(self):
+        return str(self)
@@ -1,3 +1,6 @@
+from next_hop_registry import registry
+
+
 class RibRoute:
     """
     An object that represents a prefix route for a Destination in the RIB.
@@ -8,9 +11,22 @@ class RibRoute:
         - owner: owner of this route
         - destination: Destination object which contains this route
         - stale: boolean that marks the route as stale
-        - positive_next_hops: set of positive next hops for the prefix
-        - negative_next_hops: set of negative next hops for the prefix
+        - positive_next_hops: frozenset of positive next hops for the prefix
+        - negative_next_hops: frozenset of negative next hops for the prefix
+    Next hops are stored as bitmasks of the shared NextHopRegistry (positive_next_hops_mask,
+    negative_next_hops_mask and next_hops_mask), sets of next hops are only built when they are read.
+    positive_next_hops, negative_next_hops and next_hops return frozensets shared with the registry cache, not mutable
+    sets: they cannot be modified in place, use the setters to replace the positive or negative next hops.
+    The computed next hops are cached on the route. When the best route of the parent prefix changes, the cache of the
+    best route is updated with the changed next hops of the parent by update_next_hops(), while the cache of the other
+    routes is dropped by invalidate_next_hops(). The cache is also dropped when the positive or negative next hops of
+    this route are replaced, and when the route is put in a Destination.
+    Replacing the positive or negative next hops only drops the cache of this route: the FIB and the routes of the
+    descendant prefixes are not updated. A route that is already in a RIB must be put again with Rib.put_route()
+    after its next hops are replaced.
     """
+    __slots__ = ('prefix', 'owner', 'destination', 'stale', '_next_hops_mask', 'positive_next_hops_mask',
+                 'negative_next_hops_mask')
 
     def __init__(self, prefix, owner, positive_next_hops, negative_next_hops=None):
         self.prefix = prefix
@@ -18,37 +34,141 @@ class RibRoute:
         self.destination = None
         self.stale = False
 
-        self.positive_next_hops = set(positive_next_hops)
-        self.negative_next_hops = set(negative_next_hops) if negative_next_hops else set()
+        self._next_hops_mask = None
+        self.positive_next_hops_mask = registry.encode(positive_next_hops)
+        self.negative_next_hops_mask = registry.encode(negative_next_hops) if negative_next_hops else 0
+
+    @property
+    def positive_next_hops(self):
+        return registry.decode(self.positive_next_hops_mask)
+
+    @positive_next_hops.setter
+    def positive_next_hops(self, positive_next_hops):
+        self.positive_next_hops_mask = registry.encode(positive_next_hops)
+        self.invalidate_next_hops()
+
+    @property
+    def negative_next_hops(self):
+        return registry.decode(self.negative_next_hops_mask)
+
+    @negative_next_hops.setter
+    def negative_next_hops(self, negative_next_hops):
+        self.negative_next_hops_mask = registry.encode(negative_next_hops) if negative_next_hops else 0
+        self.invalidate_next_hops()
 
     @property
     def next_hops(self):
         """
         :return: the computed next hops for the route ready to be installed in the kernel.
         """
-        return self._compute_next_hops()
+        return registry.decode(self.next_hops_mask)
+
+    @property
+    def next_hops_mask(self):
+        """
+        :return: the bitmask of the computed next hops for the route
+        """
+        if self._next_hops_mask is None:
+            self._resolve_next_hops_mask()
+        return self._next_hops_mask
+
+    def invalidate_next_hops(self):
+        """
+        Drop the cached next hops, they will be computed again on the next access
+        :return:
+        """
+        self._next_hops_mask = None
+
+    @property
+    def cached_next_hops_mask(self):
+        """
+        :return: the cached bitmask of the computed next hops, None if it has not been computed
+        """
+        return self._next_hops_mask
+
+    def changed_next_hops_mask(self, old_next_hops_mask):
+        """
+        :param old_next_hops_mask: (int|None) bitmask of previous computed next hops of the prefix
+        :return: (int) bitmask of the next hops added or removed since the previous computed next hops, -1 if they are
+                 not known
+        """
+        if old_next_hops_mask is None:
+            return -1
+        return old_next_hops_mask ^ self.next_hops_mask
+
+    def refresh_next_hops(self):
+        """
+        Recompute the next hops of the route, replacing the cached ones
+        :return: (int) bitmask of the next hops that changed, -1 if the previous next hops were not cached
+        """
+        old_next_hops_mask = self._next_hops_mask
+        self._next_hops_mask = self._compute_next_hops_mask()
+        return self.changed_next_hops_mask(old_next_hops_mask)
+
+    def update_next_hops(self, parent_changed_mask, parent_next_hops_mask):
+        """
+        Update the cached next hops of the route after the computed next hops of the parent best route changed.
+        Only the next hops that are neither positive nor negative for this route are inherited from the parent, so
+        just the changed next hops among them are copied from the parent, without computing the next hops again.
+        A changed mask of -1 (every next hop may have changed) amounts to computing the next hops from scratch.
+        :param parent_changed_mask: (int) bitmask of the next hops added to or removed from the parent best route
+        :param parent_next_hops_mask: (int) bitmask of the new computed next hops of the parent best route
+        :return: (int) bitmask of the next hops of this route that changed, -1 if the previous next hops were not
+                 cached
+        """
+        negative_next_hops_mask = self.negative_next_hops_mask
+        if not negative_next_hops_mask:
+            return 0
+        old_next_hops_mask = self._next_hops_mask
+        if old_next_hops_mask is None:
+            return self.refresh_next_hops()
+        inherited_changed_mask = parent_changed_mask & ~(self.positive_next_hops_mask | negative_next_hops_mask)
+        if not inherited_changed_mask:
+            return 0
+        next_hops_mask = (old_next_hops_mask & ~inherited_changed_mask) | \
+                         (parent_next_hops_mask & inherited_changed_mask)
+        self._next_hops_mask = next_hops_mask
+        return old_next_hops_mask ^ next_hops_mask
+
+    def _resolve_next_hops_mask(self):
+        """
+        Compute the next hops of this route and of the ancestors it depends on whose next hops are not cached.
+        Ancestors are collected walking up the tree and computed top-down, so that the computation does not recurse
+        one level per ancestor, however deep the nesting is.
+        :return:
+        """
+        unresolved = []
+        rte = self
+        while rte is not None and rte._next_hops_mask is None:
+            unresolved.append(rte)
+            if not rte.negative_next_hops_mask:
+                break
+            parent_prefix_dest = rte.destination.parent
+            rte = parent_prefix_dest.best_route if parent_prefix_dest is not None else None
+        for rte in reversed(unresolved):
+            rte._next_hops_mask = rte._compute_next_hops_mask()
 
-    def _compute_next_hops(self):
+    def _compute_next_hops_mask(self):
         """
         Computes the the real next hops set for this prefix.
         Real next hops set is the set of next hops that can be used to reach this prefix. (the ones
         to be installed in the kernel)
-        :return: the set of real next hops
+        :return: the bitmask of the real next hops
         """
         # The route does not have any negative next hops; there is no disaggregation to be done.
-        if not self.negative_next_hops:
-            return self.positive_next_hops
+        if not self.negative_next_hops_mask:
+            return self.positive_next_hops_mask
 
         # Get the parent prefix destination object from the RIB
         # If there are no parents for the current prefix, then return the positive next hops set.
         # This only occurs when the prefix is the default (0.0.0.0/0)
-        parent_prefix_dest = self.destination.parent_prefix_dest
+        parent_prefix_dest = self.destination.parent
         if parent_prefix_dest is None:
-            return self.positive_next_hops
+            return self.positive_next_hops_mask
 
         # Compute the complementary next hops of the negative next hops.
-        complementary_next_hops = parent_prefix_dest.best_route.next_hops - self.negative_next_hops
-        return self.positive_next_hops.union(complementary_next_hops)
+        complementary_next_hops_mask = parent_prefix_dest.best_route.next_hops_mask & ~self.negative_next_hops_mask
+        return self.positive_next_hops_mask | complementary_next_hops_mask
 
     def __str__(self):
         all_next_hops = []
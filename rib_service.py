@@ -0,0 +1,183 @@
+"""
+asyncio service in front of a Rib.
+Producers (typically one task per route owner) submit route updates with put_route() and del_route() and await the
+returned acknowledgement, which completes once the update has been written to the FIB. Updates are applied to the RIB
+in batches by a worker thread, so the event loop keeps accepting updates while a batch is being processed.
+"""
+import asyncio
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rib import Rib
+
+_PUT = "put"
+_DEL = "del"
+
+
+class RibService:
+    """
+    Service applying the route updates of several producers to a Rib.
+    Pending updates are kept in a queue keyed by (prefix, owner): an update for a key that is already pending replaces
+    the previous one, which is then never applied. Each update still gets its own acknowledgement, done once the last
+    update of the key has been written to the FIB, with the result the update would have had if the updates of the key
+    had been applied one by one: a replaced deletion is True if the route existed before it. Keys are processed in
+    the order they were first queued, at most max_batch keys per Rib batch.
+    When max_pending keys are pending, producers wait for the worker to catch up.
+    Attributes of this class are:
+        - rib: the Rib, only accessed by the worker thread while the service is running
+        - max_batch: maximum number of updates applied in a single Rib batch
+        - max_pending: maximum number of pending keys
+    """
+
+    def __init__(self, rib=None, max_batch=1000, max_pending=10000):
+        self.rib = rib if rib is not None else Rib()
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self._pending = {}
+        self._in_flight = False
+        self._wakeup = None
+        self._room = None
+        self._task = None
+        self._executor = None
+        metrics = self.rib.metrics
+        self._updates = metrics.counter("rib_service_updates_total", "Route updates submitted to the RIB service")
+        self._coalesced = metrics.counter("rib_service_coalesced_total",
+                                          "Route updates replaced by a later update before being applied")
+        self._batches = metrics.counter("rib_service_batches_total", "Batches applied by the RIB service")
+        self._ack_seconds = metrics.histogram("rib_service_ack_seconds",
+                                              "Time from the submission of an update to its acknowledgement")
+
+    async def start(self):
+        """
+        Start the worker task, in the running event loop
+        :return:
+        """
+        if self._task is not None:
+            raise RuntimeError("The service is already running")
+        self._wakeup = asyncio.Event()
+        self._room = asyncio.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rib-service")
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """
+        Apply the pending updates and stop the worker task
+        :return:
+        """
+        async with self._room:
+            await self._room.wait_for(lambda: not (self._pending or self._in_flight))
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._executor.shutdown()
+        self._task = None
+
+    async def put_route(self, route):
+        """
+        Queue a route to add to the RIB
+        :param route: (RibRoute) route to add
+        :return: (asyncio.Future) acknowledgement, done once the update has been written to the FIB
+        """
+        return await self._submit((route.prefix, route.owner), (_PUT, route))
+
+    async def del_route(self, prefix, owner):
+        """
+        Queue a route to delete from the RIB
+        :param prefix: (string) prefix to delete
+        :param owner: (int) owner of the prefix
+        :return: (asyncio.Future) acknowledgement, done once the update has been written to the FIB. Its result is
+                 True if the route has been deleted
+        """
+        return await self._submit((prefix, owner), (_DEL, prefix, owner))
+
+    async def _submit(self, key, operation):
+        if self._task is None:
+            raise RuntimeError("The service is not running")
+        self._updates.inc()
+        if key not in self._pending and len(self._pending) >= self.max_pending:
+            async with self._room:
+                await self._room.wait_for(lambda: len(self._pending) < self.max_pending)
+        pending = self._pending.get(key)
+        ack = asyncio.get_running_loop().create_future()
+        if pending is None:
+            self._pending[key] = [operation, [(operation[0], ack)], time.perf_counter()]
+        else:
+            self._coalesced.inc()
+            pending[0] = operation
+            pending[1].append((operation[0], ack))
+        self._wakeup.set()
+        return ack
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                keys = list(itertools.islice(self._pending, self.max_batch))
+                batch = [self._pending.pop(key) for key in keys]
+                self._in_flight = True
+                async with self._room:
+                    self._room.notify_all()
+                try:
+                    results = await loop.run_in_executor(self._executor, self._apply, [item[0] for item in batch],
+                                                         [len(item[1]) > 1 for item in batch])
+                except Exception as e:
+                    results = None
+                    error = e
+                self._in_flight = False
+                self._batches.inc()
+                now = time.perf_counter()
+                for index, (_, acks, submitted) in enumerate(batch):
+                    self._ack_seconds.observe(now - submitted)
+                    if results is None:
+                        for _, ack in acks:
+                            if not ack.done():
+                                ack.set_exception(error)
+                        continue
+                    result, existed = results[index]
+                    if existed is None:
+                        if not acks[0][1].done():
+                            acks[0][1].set_result(result)
+                        continue
+                    # Results of the updates of the key as if they had been applied one by one
+                    for kind, ack in acks:
+                        if not ack.done():
+                            ack.set_result(existed if kind == _DEL else None)
+                        existed = kind == _PUT
+                async with self._room:
+                    self._room.notify_all()
+
+    def _apply(self, operations, lookups):
+        """
+        Apply a batch of updates to the RIB, in the worker thread
+        :param operations: (list) updates to apply
+        :param lookups: (list) for each update, True if it replaced other updates, whose results depend on the route
+                        present in the RIB before the update
+        :return: (list) tuple of the result of each update and of a boolean that is True if the route of the update was
+                 in the RIB before it, None if it was not looked up
+        """
+        results = []
+        destinations = self.rib.destinations
+        with self.rib.batch():
+            for operation, lookup in zip(operations, lookups):
+                prefix = operation[1].prefix if operation[0] == _PUT else operation[1]
+                owner = operation[1].owner if operation[0] == _PUT else operation[2]
+                existed = None
+                if lookup:
+                    existed = destinations.has_key(prefix) and destinations.get(prefix).get_route(owner) is not None
+                if operation[0] == _PUT:
+                    results.append((self.rib.put_route(operation[1]), existed))
+                else:
+                    results.append((self.rib.del_route(prefix, owner), existed))
+        return results
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.stop()
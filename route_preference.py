@@ -0,0 +1,28 @@
+class PreferenceTable:
+    """
+    Class that ranks the owners (sources) of the routes. When a destination has routes from several owners, the route
+    of the owner with the highest preference is the best one.
+    Owners missing from the table are ranked by their numerical value, so the default table keeps the historical
+    behaviour where a higher owner value is more preferred. An owner missing from the table may get the preference of
+    an owner of the table: owners with the same preference are ranked by their numerical value.
+    Attributes of this class are:
+        - preferences: dict of preferences keyed by owner. Two owners must not have the same preference
+    """
+
+    def __init__(self, preferences=None):
+        self.preferences = dict(preferences) if preferences else {}
+        assert len(set(self.preferences.values())) == len(self.preferences), "Duplicate owner preference"
+
+    def preference(self, owner):
+        """
+        :param owner: (int) owner of a route
+        :return: (int) preference of the owner, higher is more preferred
+        """
+        return self.preferences.get(owner, owner)
+
+    def rank(self, owner):
+        """
+        :param owner: (int) owner of a route
+        :return: (tuple) sort key of the owner, lower is more preferred. Two different owners never have the same key
+        """
+        return -self.preferences.get(owner, owner), -owner
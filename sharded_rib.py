@@ -0,0 +1,272 @@
+"""
+RIB split across worker processes.
+The prefix space is split on the first split_length bits of the IPv4 prefixes and on the first split_length6 bits of
+the IPv6 prefixes: every prefix at least this long belongs to one shard, chosen from the last bits before the split,
+together with all its more specific prefixes. Shorter prefixes (the covering ancestors, like the default route) are
+replicated to every shard, so each shard has all the ancestors of its prefixes and computes the next hops of its
+negative disaggregations locally. IPv6 is split further than IPv4 because the first bits of the IPv6 prefixes in use
+are the same (2000::/3), while the bits before the /48 site prefixes vary.
+Each shard is a Rib running in its own process. The coordinator sends the operations to the shards, which apply them
+in parallel, and merges the FIB changes they return into a single kernel batch.
+A batch is applied by all the shards or by none: the shards apply the operations without committing, and commit only
+once every shard applied them successfully. Otherwise, they roll the batch back.
+"""
+import multiprocessing
+import socket
+from contextlib import contextmanager
+
+from fib import Fib
+from kernel import Kernel
+from rib import Rib
+from rib_batch import BatchReport
+from rib_route import RibRoute
+
+_PUT = "put"
+_DEL = "del"
+_COMMIT = "commit"
+_ROLLBACK = "rollback"
+
+
+class ShardedRib:
+    """
+    Coordinator of a RIB split across worker processes.
+    Operations are sent to the shards in batches (see begin() and commit()): put_route() and del_route() outside of a
+    batch are committed right away.
+    Attributes of this class are:
+        - shards: number of worker processes
+        - split_length: prefix length that splits the IPv4 prefix space between the shards
+        - split_length6: prefix length that splits the IPv6 prefix space between the shards
+        - kernel: kernel backend programmed with the merged FIB changes (default is the in-memory Kernel)
+        - routes: dict of the next hops installed in the kernel, keyed by prefix
+    """
+
+    def __init__(self, shards=None, split_length=8, kernel=None, split_length6=48):
+        self.shards = shards if shards is not None else multiprocessing.cpu_count()
+        self.split_length = split_length
+        self.split_length6 = split_length6
+        self.kernel = kernel if kernel is not None else Kernel()
+        self.routes = {}
+        self._operations = None
+        self._operations_count = 0
+        self._connections = []
+        self._processes = []
+        for index in range(self.shards):
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_run_shard,
+                                              args=(worker_connection, index == 0, split_length, split_length6),
+                                              name="rib-shard-%d" % index, daemon=True)
+            process.start()
+            worker_connection.close()
+            self._connections.append(connection)
+            self._processes.append(process)
+
+    def shard(self, prefix):
+        """
+        :param prefix: (string) IPv4 or IPv6 prefix
+        :return: (int|None) index of the shard owning the prefix, None if the prefix is replicated to all the shards
+        """
+        address, length = prefix.split("/")
+        ipv6 = ":" in address
+        split_length = self.split_length6 if ipv6 else self.split_length
+        if int(length) < split_length:
+            return None
+        packed = socket.inet_pton(socket.AF_INET6 if ipv6 else socket.AF_INET, address)
+        return (int.from_bytes(packed, "big") >> (len(packed) * 8 - split_length)) % self.shards
+
+    def begin(self):
+        """
+        Start a batch of operations, sent to the shards when commit() is called
+        :return:
+        """
+        if self._operations is not None:
+            raise RuntimeError("A batch is already in progress")
+        self._operations = [[] for _ in range(self.shards)]
+        self._operations_count = 0
+
+    def commit(self):
+        """
+        Send the operations of the batch to the shards, wait for all of them and program the kernel with the merged
+        FIB changes in a single batch.
+        If a shard fails to apply its operations, every shard rolls the batch back and the error of the first failing
+        shard is raised: the shards, the routes and the kernel are left as they were before the batch
+        :return: (BatchReport) summary of the batch. Destinations and saved writes are summed over the shards, so
+                 replicated prefixes are counted once per shard
+        """
+        operations = self._operations
+        if operations is None:
+            raise RuntimeError("No batch in progress")
+        self._operations = None
+        for connection, shard_operations in zip(self._connections, operations):
+            connection.send(shard_operations)
+        # Wait for every shard before deciding, so that no reply is left in the pipes
+        errors = [error for error in (connection.recv() for connection in self._connections) if error is not None]
+        decision = _ROLLBACK if errors else _COMMIT
+        for connection in self._connections:
+            connection.send(decision)
+        results = [connection.recv() for connection in self._connections]
+        if errors:
+            raise errors[0]
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        adds = {}
+        deletes = set()
+        destinations = writes_saved = 0
+        for shard_adds, shard_deletes, report in results:
+            destinations += report.destinations
+            writes_saved += report.writes_saved
+            # Shards own disjoint prefixes, and only the first one reports the replicated prefixes
+            adds.update(shard_adds)
+            deletes.update(shard_deletes)
+        for prefix in deletes:
+            self.routes.pop(prefix, None)
+        self.routes.update(adds)
+        if adds or deletes:
+            self.kernel.apply_batch(adds, deletes)
+        return BatchReport(self._operations_count, destinations, len(adds) + len(deletes), writes_saved)
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager that performs the enclosed operations in a batch, committing it on exit. If the enclosed
+        block raises an exception, the operations of the batch are dropped without being sent to the shards
+        """
+        self.begin()
+        try:
+            yield
+        except BaseException:
+            self._operations = None
+            raise
+        self.commit()
+
+    def put_route(self, route):
+        """
+        Add a route to the shard owning its prefix, or to every shard if the prefix is replicated
+        :param route: (RibRoute) route to add
+        :return:
+        """
+        self._add_operation(route.prefix, (_PUT, route.prefix, route.owner, list(route.positive_next_hops),
+                                           list(route.negative_next_hops)))
+
+    def del_route(self, prefix, owner):
+        """
+        Delete the route of the given prefix and owner
+        :param prefix: (string) prefix to delete
+        :param owner: (int) owner of the prefix
+        :return:
+        """
+        self._add_operation(prefix, (_DEL, prefix, owner))
+
+    def close(self):
+        """
+        Stop the worker processes
+        :return:
+        """
+        for connection in self._connections:
+            connection.send(None)
+        for process in self._processes:
+            process.join()
+        for connection in self._connections:
+            connection.close()
+
+    def _add_operation(self, prefix, operation):
+        batched = self._operations is not None
+        if not batched:
+            self.begin()
+        self._operations_count += 1
+        shard = self.shard(prefix)
+        if shard is None:
+            for shard_operations in self._operations:
+                shard_operations.append(operation)
+        else:
+            self._operations[shard].append(operation)
+        if not batched:
+            self.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class _DeltaKernel:
+    """
+    Kernel backend of a shard, collecting the FIB changes to send back to the coordinator.
+    Replicated prefixes are computed by every shard with the same result: only the first shard reports them.
+    Equal sets of next hops are sent as the same frozenset object, which is pickled once.
+    """
+
+    def __init__(self, report_replicated, split_length, split_length6):
+        self.report_replicated = report_replicated
+        self.split_length = split_length
+        self.split_length6 = split_length6
+        self.adds = {}
+        self.deletes = set()
+        self._next_hops = {}
+
+    def apply_batch(self, adds, deletes):
+        for prefix in deletes:
+            if self._is_reported(prefix):
+                self.adds.pop(prefix, None)
+                self.deletes.add(prefix)
+        for prefix, next_hops in adds.items():
+            if self._is_reported(prefix):
+                self.deletes.discard(prefix)
+                plain_next_hops = self._next_hops.get(next_hops)
+                if plain_next_hops is None:
+                    plain_next_hops = self._next_hops[next_hops] = frozenset(next_hops)
+                self.adds[prefix] = plain_next_hops
+
+    def take(self):
+        adds, deletes = self.adds, self.deletes
+        self.adds = {}
+        self.deletes = set()
+        self._next_hops = {}
+        return adds, deletes
+
+    def _is_reported(self, prefix):
+        if self.report_replicated:
+            return True
+        split_length = self.split_length6 if ":" in prefix else self.split_length
+        return int(prefix[prefix.index("/") + 1:]) >= split_length
+
+
+def _run_shard(connection, report_replicated, split_length, split_length6):
+    """
+    Main loop of a shard process: apply each list of operations received from the coordinator in a batch, report
+    whether it succeeded, then commit or roll back the batch as decided by the coordinator and send back the FIB
+    changes
+    :param connection: (Connection) pipe to the coordinator
+    :param report_replicated: (boolean) True if the shard reports the FIB changes of the replicated prefixes
+    :param split_length: (int) IPv4 prefixes shorter than this length are replicated
+    :param split_length6: (int) IPv6 prefixes shorter than this length are replicated
+    :return:
+    """
+    kernel = _DeltaKernel(report_replicated, split_length, split_length6)
+    # Each batch is flushed by Rib.commit(), no need to send smaller batches to the kernel
+    rib = Rib(Fib(kernel, batch_size=1 << 30))
+    while True:
+        operations = connection.recv()
+        if operations is None:
+            return
+        rib.begin()
+        try:
+            for operation in operations:
+                if operation[0] == _PUT:
+                    rib.put_route(RibRoute(*operation[1:]))
+                else:
+                    rib.del_route(*operation[1:])
+        except Exception as e:
+            connection.send(e)
+        else:
+            connection.send(None)
+        try:
+            if connection.recv() == _COMMIT:
+                report = rib.commit()
+            else:
+                report = rib.rollback()
+            adds, deletes = kernel.take()
+            connection.send((adds, deletes, report))
+        except Exception as e:
+            connection.send(e)
@@ -0,0 +1,22 @@
+import time
+
+from kernel import Kernel
+
+
+class SlowKernel(Kernel):
+    """
+    In-memory kernel backend with injectable latency, used to emulate a slow forwarding plane.
+    Attributes of this class are:
+        - call_latency: seconds spent for each apply_batch() call
+        - route_latency: seconds spent for each programmed route
+    """
+
+    def __init__(self, call_latency=0.0, route_latency=0.0):
+        super().__init__()
+        self.call_latency = call_latency
+        self.route_latency = route_latency
+
+    def apply_batch(self, adds, deletes):
+        deletes = list(deletes)
+        time.sleep(self.call_latency + self.route_latency * (len(adds) + len(deletes)))
+        super().apply_batch(adds, deletes)
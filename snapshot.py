@@ -0,0 +1,112 @@
+"""
+Binary snapshot of the routes of a RIB, for a fast restart.
+The file starts with a header (magic, version, number of next hops, number of routes) followed by the table of the
+next hop names and by one record for each route, sorted from the less specific to the more specific prefix:
+    - address family (4 or 6), prefix length, owner, number of positive and of negative next hops
+    - network address (4 or 16 bytes)
+    - indices of the positive and negative next hops in the next hop table
+The snapshot is restored through a memory-mapped reader that loads the routes with Rib.load(), which builds the
+trie and the FIB in a single top-down pass.
+"""
+import gc
+import mmap
+import socket
+import struct
+
+from rib import Rib
+from rib_route import RibRoute
+
+MAGIC = b"RIBS"
+VERSION = 1
+_HEADER = struct.Struct("<4sHII")
+_NAME_LENGTH = struct.Struct("<H")
+_RECORD = struct.Struct("<BBiHH")
+_FAMILIES = {4: (socket.AF_INET, 4), 6: (socket.AF_INET6, 16)}
+
+
+def write_snapshot(rib, path):
+    """
+    Write all the routes of the RIB in a snapshot file
+    :param rib: (Rib) RIB to save
+    :param path: (string) path of the snapshot file
+    :return: (int) number of routes written
+    """
+    names = {}
+    records = []
+    for prefix in rib.destinations:
+        address, length = prefix.split("/")
+        family = 6 if ":" in address else 4
+        packed_address = socket.inet_pton(_FAMILIES[family][0], address)
+        for rte in rib.destinations.get(prefix).routes:
+            positive = [names.setdefault(next_hop, len(names)) for next_hop in rte.positive_next_hops]
+            negative = [names.setdefault(next_hop, len(names)) for next_hop in rte.negative_next_hops]
+            records.append((int(length), family, rte.owner, packed_address, positive, negative))
+    if len(names) > 0xffff:
+        raise ValueError("Too many next hops for a snapshot: %d" % len(names))
+    # Less specific prefixes first, so that parents are restored before their children
+    records.sort(key=lambda record: record[0])
+
+    chunks = [_HEADER.pack(MAGIC, VERSION, len(names), len(records))]
+    for name in names:
+        encoded_name = name.encode()
+        chunks.append(_NAME_LENGTH.pack(len(encoded_name)))
+        chunks.append(encoded_name)
+    for length, family, owner, packed_address, positive, negative in records:
+        chunks.append(_RECORD.pack(family, length, owner, len(positive), len(negative)))
+        chunks.append(packed_address)
+        indices = positive + negative
+        chunks.append(struct.pack("<%dH" % len(indices), *indices))
+    with open(path, "wb") as snapshot:
+        snapshot.write(b"".join(chunks))
+    return len(records)
+
+
+def read_snapshot(data):
+    """
+    Parse the routes of a snapshot lazily
+    :param data: (bytes|mmap) content of the snapshot file
+    :return: (generator) RibRoute objects, from the less specific to the more specific prefix
+    """
+    magic, version, name_count, route_count = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a RIB snapshot")
+    if version != VERSION:
+        raise ValueError("Unsupported RIB snapshot version %d (expected %d)" % (version, VERSION))
+    offset = _HEADER.size
+    names = []
+    for _ in range(name_count):
+        name_length, = _NAME_LENGTH.unpack_from(data, offset)
+        offset += _NAME_LENGTH.size
+        names.append(bytes(data[offset:offset + name_length]).decode())
+        offset += name_length
+    for _ in range(route_count):
+        family, length, owner, positive_count, negative_count = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        address_family, address_size = _FAMILIES[family]
+        address = socket.inet_ntop(address_family, data[offset:offset + address_size])
+        offset += address_size
+        indices = struct.unpack_from("<%dH" % (positive_count + negative_count), data, offset)
+        offset += 2 * len(indices)
+        yield RibRoute("%s/%d" % (address, length), owner, [names[index] for index in indices[:positive_count]],
+                       [names[index] for index in indices[positive_count:]])
+
+
+def restore_snapshot(path, rib=None):
+    """
+    Restore a RIB from a snapshot file
+    :param path: (string) path of the snapshot file
+    :param rib: (Rib|None) empty RIB to fill, a new one if not given
+    :return: (Rib) the restored RIB
+    """
+    rib = rib if rib is not None else Rib()
+    # Loading creates millions of objects and no garbage: avoid repeated full collections while loading
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with open(path, "rb") as snapshot:
+            with mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                rib.load(read_snapshot(data))
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return rib
@@ -1,5 +1,32 @@
+import asyncio
+import inspect
+import io
+import os
+import queue
+import random
+import socket
+import sys
+import struct
+import threading
+
+import pytest
+
+import ingest
+import snapshot
+import tracing
+from async_kernel import AsyncKernel
+from dampening import FlapDampening
+from destination import Destination
+from fib import Fib
+from ip_batch_kernel import IpBatchKernel, read_ip_routes
+from kernel import Kernel
+from metrics import Metrics
+from next_hop_registry import NextHopRegistry
 from rib import Rib
 from rib_route import RibRoute
+from rib_service import RibService
+from route_preference import PreferenceTable
+from sharded_rib import ShardedRib
 
 N_SPF = 1
 S_SPF = 2
@@ -300,6 +327,46 @@ def test_add_two_route_same_destination():
     assert rib.fib.kernel.routes[default_prefix] == best_default_route.next_hops
 
 
+# Test routes from many owners ranked by a preference table instead of the owner value
+def test_owner_preference_table():
+    static, policy = 10, 20
+    rib = Rib(preferences=PreferenceTable({static: 100, policy: 0}))
+    rib.put_route(RibRoute(default_prefix, policy, ['S4']))
+    destination = rib.destinations.get(default_prefix)
+    assert destination.put_route(RibRoute(default_prefix, N_SPF, ['S1'])) is True
+    assert destination.put_route(RibRoute(default_prefix, S_SPF, ['S2'])) is True
+    assert destination.put_route(RibRoute(default_prefix, static, ['S3'])) is True
+    assert destination.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S2'])) is False
+    assert [rte.owner for rte in destination.routes] == [static, S_SPF, N_SPF, policy]
+    assert destination.get_route(S_SPF).positive_next_hops == {'S1', 'S2'}
+    assert destination.del_route(N_SPF) == (True, False)
+    assert destination.del_route(N_SPF) == (False, False)
+    assert destination.del_route(static) == (True, True)
+    assert destination.del_route(S_SPF) == (True, True)
+    assert destination.routes_by_owner is None
+    assert destination.get_route(policy).positive_next_hops == {'S4'}
+    assert destination.get_route(static) is None
+    rib.put_route(RibRoute(default_prefix, static, ['S3']))
+    assert rib.fib.kernel.routes[default_prefix] == {'S3'}
+    rib.del_route(default_prefix, static)
+    assert rib.fib.kernel.routes[default_prefix] == {'S4'}
+
+    # An owner missing from the table can get the preference of an owner of the table: the higher owner wins the tie
+    rib = Rib(preferences=PreferenceTable({static: S_SPF}))
+    rib.put_route(RibRoute(default_prefix, S_SPF, ['S1']))
+    rib.put_route(RibRoute(default_prefix, static, ['S2']))
+    rib.put_route(RibRoute(default_prefix, N_SPF, ['S3']))
+    destination = rib.destinations.get(default_prefix)
+    assert [rte.owner for rte in destination.routes] == [static, S_SPF, N_SPF]
+    assert rib.del_route(default_prefix, S_SPF)
+    assert [rte.owner for rte in destination.routes] == [static, N_SPF]
+    assert rib.fib.kernel.routes[default_prefix] == {'S2'}
+    rib.put_route(RibRoute(default_prefix, S_SPF, ['S4']))
+    assert rib.del_route(default_prefix, static)
+    assert [rte.owner for rte in destination.routes] == [S_SPF, N_SPF]
+    assert rib.fib.kernel.routes[default_prefix] == {'S4'}
+
+
 # Add two destination with different owner to the same destination, then remove the best route (S_SPF),
 # test that the S_SPF is now preferred
 def test_remove_best_route():
@@ -738,4 +805,935 @@ def test_prop_nesting_with_siblings():
 
     assert not rib.destinations.keys()
     assert not rib.fib.routes.keys()
-    assert not rib.fib.kernel.routes.keys()
\ No newline at end of file
+    assert not rib.fib.kernel.routes.keys()
+
+# Test that computed next hops are cached on the route and recomputed only when the parent best route changes
+def test_next_hops_cache_invalidation():
+    rib = Rib()
+    default_route = RibRoute(default_prefix, S_SPF, default_next_hops)
+    rib.put_route(default_route)
+    neg_route = RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops)
+    rib.put_route(neg_route)
+    assert neg_route.next_hops is neg_route.next_hops
+    assert neg_route.next_hops == {'S2', 'S3', 'S4'}
+    rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S3', 'S4']))
+    assert neg_route.next_hops == {'S3', 'S4'}
+    neg_route.negative_next_hops = ['S1', 'S3']
+    assert neg_route.next_hops == {'S4'}
+    assert rib.fib.kernel.routes[first_negative_disagg_prefix] == {'S3', 'S4'}
+    rib.put_route(neg_route)
+    assert rib.fib.kernel.routes[first_negative_disagg_prefix] == {'S4'}
+    # A route moved to another RIB does not keep the next hops computed against its previous parent
+    other_rib = Rib()
+    other_rib.put_route(RibRoute(default_prefix, S_SPF, ['S4', 'S5']))
+    other_rib.put_route(neg_route)
+    assert neg_route.next_hops == {'S4', 'S5'}
+    assert other_rib.fib.kernel.routes[first_negative_disagg_prefix] == {'S4', 'S5'}
+
+
+# Test that children links are kept when a middle prefix is added and removed
+def test_children_links_middle_prefix():
+    rib = Rib()
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute(subnet_disagg_prefix, S_SPF, [], subnet_negative_disagg_next_hops))
+    default_dest = rib.destinations.get(default_prefix)
+    subnet_dest = rib.destinations.get(subnet_disagg_prefix)
+    assert default_dest.children == {subnet_dest}
+    rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops))
+    middle_dest = rib.destinations.get(first_negative_disagg_prefix)
+    assert default_dest.children == {middle_dest}
+    assert middle_dest.children == {subnet_dest}
+    assert (middle_dest.parent, subnet_dest.parent) == (default_dest, middle_dest)
+    assert (default_dest.descendants, middle_dest.descendants, subnet_dest.descendants) == (2, 1, 0)
+    assert subnet_dest.best_route.next_hops == {'S3', 'S4'}
+    rib.del_route(first_negative_disagg_prefix, S_SPF)
+    assert default_dest.children == {subnet_dest}
+    assert subnet_dest.parent == default_dest
+    assert default_dest.descendants == 1
+    assert subnet_dest.best_route.next_hops == {'S1', 'S3', 'S4'}
+    assert rib.fib.kernel.routes[subnet_disagg_prefix] == {'S1', 'S3', 'S4'}
+
+
+# Test that adding a prefix above existing prefixes finds its children without looking up the trie for each of them
+def test_children_links_covering_prefix(monkeypatch):
+    rib = Rib()
+    parent = rib.destinations.parent
+    parent_calls = []
+    monkeypatch.setattr(rib.destinations, "parent", lambda prefix: parent_calls.append(prefix) or parent(prefix))
+    subnets = ["10.0.%d.0/24" % i for i in range(4)]
+    for prefix in ["10.0.0.0/28", "20.0.0.0/16"] + subnets:
+        rib.put_route(RibRoute(prefix, S_SPF, ['S1']))
+    # Without parent, below a parent with more children than descendants, then with fewer
+    for prefix in ["10.0.0.0/16", "0.0.0.0/0", "20.0.0.0/8", "10.0.0.0/22"]:
+        parent_calls.clear()
+        rib.put_route(RibRoute(prefix, S_SPF, ['S2']))
+        assert parent_calls == [prefix]
+    for prefix in rib.destinations:
+        destination = rib.destinations.get(prefix)
+        assert destination.children == {rib.destinations.get(child_prefix)
+                                        for child_prefix in rib.destinations.children(prefix)
+                                        if parent(child_prefix) == prefix}
+        assert destination.parent is (rib.destinations.get(parent(prefix)) if parent(prefix) else None)
+        assert destination.descendants == len(rib.destinations.children(prefix))
+
+
+# Test that next hops computations and propagation walk the parent links without looking up the trie
+def test_parent_links_without_trie_lookups(monkeypatch):
+    rib = Rib()
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops))
+    rib.put_route(RibRoute(subnet_disagg_prefix, S_SPF, [], subnet_negative_disagg_next_hops))
+    monkeypatch.setattr(rib.destinations, "parent", None)
+    rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S2', 'S3']))
+    subnet_dest = rib.destinations.get(subnet_disagg_prefix)
+    assert subnet_dest.parent_prefix_dest.prefix == first_negative_disagg_prefix
+    assert subnet_dest.best_route.next_hops == {'S3'}
+    assert rib.fib.kernel.routes[subnet_disagg_prefix] == {'S3'}
+    assert repr(subnet_dest).startswith(subnet_disagg_prefix + "\n(Parent: " + first_negative_disagg_prefix + ")")
+
+
+# Test the streaming show output of the RIB and FIB with filters and pagination
+def test_show():
+    rib = Rib()
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops))
+    rib.put_route(RibRoute(first_negative_disagg_prefix, N_SPF, ['S1']))
+    rib.put_route(RibRoute(subnet_disagg_prefix, S_SPF, [], subnet_negative_disagg_next_hops))
+    rib.put_route(RibRoute(second_negative_disagg_prefix, S_SPF, [], second_negative_disagg_next_hops))
+    rib.put_route(RibRoute(leaf_prefix, N_SPF, leaf_prefix_positive_next_hops))
+    assert list(rib.show(first_negative_disagg_prefix)) == ["*S_SPF: 10.0.0.0/16 -> ~S1 => S2, S3, S4",
+                                                            " N_SPF: 10.0.0.0/16 -> S1 => S1"]
+    assert list(rib.show(first_negative_disagg_prefix, longer_prefixes=True, owner=S_SPF)) == [
+        "*S_SPF: 10.0.0.0/16 -> ~S1 => S2, S3, S4", "*S_SPF: 10.0.10.0/24 -> ~S2 => S3, S4"]
+    assert [line.split()[1] for line in rib.show("10.0.0.0/8", longer_prefixes=True)] == [
+        first_negative_disagg_prefix, first_negative_disagg_prefix, subnet_disagg_prefix, second_negative_disagg_prefix]
+    assert list(rib.show("10.0.0.0/8")) == []
+    assert [line.split()[1] for line in rib.show(next_hop='S1')] == [default_prefix, first_negative_disagg_prefix,
+                                                                     second_negative_disagg_prefix]
+    assert list(rib.show(next_hop='X1')) == []
+    assert len(list(rib.show())) == 6
+    assert list(rib.show(offset=4, limit=1)) == list(rib.show())[4:5]
+    assert list(rib.show_fib("10.0.0.0/8", longer_prefixes=True, next_hop='S4', limit=2)) == [
+        "10.0.0.0/16 -> S2, S3, S4", "10.0.10.0/24 -> S3, S4"]
+    assert list(rib.fib.show(next_hop='M4')) == ["20.0.0.0/16 -> M4"]
+
+
+# Test that children that do not depend on the changed parent are not recomputed
+def test_propagation_skips_independent_children():
+    rib = Rib()
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    leaf_route = RibRoute(leaf_prefix, S_SPF, leaf_prefix_positive_next_hops)
+    rib.put_route(leaf_route)
+    leaf_subnet_route = RibRoute("20.0.1.0/24", S_SPF, [], ["M4"])
+    rib.put_route(leaf_subnet_route)
+    neg_route = RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops)
+    rib.put_route(neg_route)
+    leaf_next_hops = leaf_route.next_hops
+    leaf_subnet_next_hops = leaf_subnet_route.next_hops
+    rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S3', 'S4']))
+    assert leaf_route.next_hops is leaf_next_hops
+    assert leaf_subnet_route.next_hops is leaf_subnet_next_hops
+    assert neg_route.next_hops == {'S3', 'S4'}
+    assert rib.fib.kernel.routes[first_negative_disagg_prefix] == {'S3', 'S4'}
+
+
+# Test that only the delta of the parent next hops is propagated, skipping the children that pin the changed next hop
+def test_propagation_next_hops_delta():
+    rib = Rib()
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    pinned_route = RibRoute("10.2.0.0/16", S_SPF, [], ['S2'])
+    rib.put_route(pinned_route)
+    neg_route = RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops)
+    rib.put_route(neg_route)
+    subnet_route = RibRoute(subnet_disagg_prefix, S_SPF, ['S1'], subnet_negative_disagg_next_hops)
+    rib.put_route(subnet_route)
+    skipped = rib.metrics.snapshot()["rib_children_skipped_total"]
+    rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S3', 'S4']))
+    # 10.2.0.0/16 and 10.0.10.0/24 already exclude S2
+    assert rib.metrics.snapshot()["rib_children_skipped_total"] == skipped + 2
+    assert pinned_route.next_hops == {'S1', 'S3', 'S4'}
+    assert neg_route.next_hops == {'S3', 'S4'}
+    assert subnet_route.next_hops == {'S1', 'S3', 'S4'}
+    assert rib.fib.kernel.routes[subnet_disagg_prefix] == {'S1', 'S3', 'S4'}
+    rib.del_route(first_negative_disagg_prefix, S_SPF)
+    assert subnet_route.next_hops == {'S1', 'S3', 'S4'}
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    assert subnet_route.next_hops == {'S1', 'S3', 'S4'}
+    assert pinned_route.next_hops == {'S1', 'S3', 'S4'}
+
+    # Incrementally updated next hops match the ones computed from scratch after random changes
+    rng = random.Random(24)
+    prefixes = [default_prefix, "10.0.0.0/8", "10.0.0.0/16", "10.0.0.0/24", "10.0.1.0/24", "10.1.0.0/16",
+                "10.1.2.0/24", "10.1.2.0/25"]
+    rib = Rib()
+    for _ in range(500):
+        prefix = rng.choice(prefixes)
+        owner = rng.choice((N_SPF, S_SPF))
+        if rng.random() < 0.3:
+            rib.del_route(prefix, owner)
+        else:
+            positive = rng.sample(default_next_hops, rng.randint(0 if prefix != default_prefix else 1, 2))
+            negative = rng.sample(default_next_hops, rng.randint(0, 2)) if prefix != default_prefix else []
+            rib.put_route(RibRoute(prefix, owner, positive, negative))
+        for destination in map(rib.destinations.get, rib.destinations):
+            best_route = destination.best_route
+            assert best_route.next_hops_mask == best_route._compute_next_hops_mask()
+            if best_route.next_hops_mask:
+                assert rib.fib.routes[destination.prefix].next_hops == best_route.next_hops
+
+
+# Test that a batch produces the same FIB and kernel as the single operations, with one write per changed prefix
+def test_batch_commit():
+    routes = [RibRoute(default_prefix, S_SPF, default_next_hops),
+              RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops),
+              RibRoute(second_negative_disagg_prefix, S_SPF, [], second_negative_disagg_next_hops),
+              RibRoute(subnet_disagg_prefix, S_SPF, [], subnet_negative_disagg_next_hops),
+              RibRoute(leaf_prefix, N_SPF, leaf_prefix_positive_next_hops)]
+    rib = Rib()
+    for route in routes:
+        rib.put_route(route)
+    batch_rib = Rib()
+    with batch_rib.batch() as batch:
+        for route in routes:
+            batch_rib.put_route(route)
+        assert not batch_rib.fib.routes
+        for _ in range(10):
+            batch_rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S3', 'S4']))
+            batch_rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+        batch_rib.put_route(RibRoute("30.0.0.0/8", S_SPF, ['S1']))
+        batch_rib.del_route("30.0.0.0/8", S_SPF)
+    assert batch.report.operations == 27
+    assert batch.report.fib_writes == len(routes)
+    assert batch.report.writes_saved > 0
+    assert batch_rib.fib.kernel.routes == rib.fib.kernel.routes
+    assert {prefix: rte.next_hops for prefix, rte in batch_rib.fib.routes.items()} == \
+           {prefix: rte.next_hops for prefix, rte in rib.fib.routes.items()}
+
+
+# Test that a route promoted during a batch gets next hops from its final parent, not the ones cached before the batch
+def test_batch_promoted_route():
+    rib = Rib()
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops))
+    rib.put_route(RibRoute(subnet_disagg_prefix, S_SPF, [], ['S3']))
+    backup_route = RibRoute(subnet_disagg_prefix, N_SPF, [], subnet_negative_disagg_next_hops)
+    rib.put_route(backup_route)
+    assert backup_route.next_hops == {'S3', 'S4'}
+    with rib.batch():
+        rib.del_route(first_negative_disagg_prefix, S_SPF)
+        rib.del_route(subnet_disagg_prefix, S_SPF)
+    assert backup_route.next_hops == {'S1', 'S3', 'S4'}
+    assert rib.fib.kernel.routes[subnet_disagg_prefix] == {'S1', 'S3', 'S4'}
+
+
+# Test that deleting a middle prefix in a batch refreshes its children against the new parent
+def test_batch_delete_middle_prefix():
+    rib = Rib()
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops))
+    rib.put_route(RibRoute(subnet_disagg_prefix, S_SPF, [], subnet_negative_disagg_next_hops))
+    rib.begin()
+    rib.del_route(first_negative_disagg_prefix, S_SPF)
+    assert rib.fib.kernel.routes[subnet_disagg_prefix] == {'S3', 'S4'}
+    report = rib.commit()
+    assert report.fib_writes == 2
+    assert first_negative_disagg_prefix not in rib.fib.kernel.routes
+    assert rib.fib.kernel.routes[subnet_disagg_prefix] == {'S1', 'S3', 'S4'}
+
+
+# Test that a batch interrupted by an exception is rolled back, leaving the RIB and the FIB as they were
+def test_batch_rollback():
+    rib = Rib()
+    default_route = RibRoute(default_prefix, S_SPF, default_next_hops)
+    rib.put_route(default_route)
+    neg_route = RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops)
+    rib.put_route(neg_route)
+    subnet_route = RibRoute(subnet_disagg_prefix, S_SPF, [], subnet_negative_disagg_next_hops)
+    rib.put_route(subnet_route)
+    subnet_route.stale = True
+    kernel_routes = dict(rib.fib.kernel.routes)
+    try:
+        with rib.batch() as batch:
+            rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S3']))
+            rib.put_route(RibRoute(default_prefix, N_SPF, ['S4']))
+            rib.del_route(first_negative_disagg_prefix, S_SPF)
+            rib.put_route(RibRoute(subnet_disagg_prefix, S_SPF, ['S2']))
+            rib.put_route(RibRoute(leaf_prefix, S_SPF, ['M1']))
+            assert subnet_route.destination.parent.prefix == default_prefix
+            raise ValueError("interrupted")
+    except ValueError:
+        pass
+    assert batch.rolled_back
+    assert batch.report.fib_writes == 0
+    assert rib.fib.kernel.routes == kernel_routes
+    assert [rib.destinations.get(prefix).routes for prefix in rib.destinations] == \
+           [[default_route], [neg_route], [subnet_route]]
+    assert subnet_route.destination.parent.best_route is neg_route
+    assert subnet_route.next_hops == {'S3', 'S4'}
+    assert subnet_route.stale
+    rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S3']))
+    assert rib.fib.kernel.routes[subnet_disagg_prefix] == {'S3'}
+
+    # A held prefix deleted during a rolled back batch is still held
+    dampening = FlapDampening(half_life=10.0, clock=lambda: 0.0)
+    rib = Rib(dampening=dampening)
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    for next_hop in ('M1', 'M2', 'M3'):
+        rib.put_route(RibRoute(leaf_prefix, S_SPF, [next_hop]))
+    assert leaf_prefix in dampening.suppressed
+    try:
+        with rib.batch():
+            rib.del_route(leaf_prefix, S_SPF)
+            raise ValueError("interrupted")
+    except ValueError:
+        pass
+    assert leaf_prefix in dampening.suppressed
+    assert rib.fib.kernel.routes[leaf_prefix] == {'M2'}
+
+# Test that the FIB buffers kernel changes and collapses pending changes for the same prefix
+def test_fib_kernel_batch_size():
+    rib = Rib(Fib(batch_size=3))
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops))
+    assert not rib.fib.kernel.routes
+    rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S3', 'S4']))
+    assert not rib.fib.kernel.routes
+    # The prefix has never been sent to the kernel, its add is dropped instead of sending a delete
+    rib.del_route(first_negative_disagg_prefix, S_SPF)
+    assert not rib.fib.kernel.routes
+    rib.put_route(RibRoute(unreachable_prefix, S_SPF, [], unreachable_negative_next_hops))
+    assert not rib.fib.kernel.routes
+    rib.put_route(RibRoute(leaf_prefix, S_SPF, leaf_prefix_positive_next_hops))
+    assert rib.fib.kernel.routes == {default_prefix: {'S1', 'S3', 'S4'}, unreachable_prefix: "unreachable",
+                                     leaf_prefix: {'M4'}}
+    rib.put_route(RibRoute(leaf_prefix, S_SPF, ['M1']))
+    rib.del_route(leaf_prefix, S_SPF)
+    assert leaf_prefix in rib.fib.kernel.routes
+    rib.fib.flush()
+    assert leaf_prefix not in rib.fib.kernel.routes
+
+
+# Test the commands written by the "ip -batch" kernel backend
+def test_ip_batch_kernel():
+    stream = io.StringIO()
+    rib = Rib(Fib(IpBatchKernel(stream)))
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute(unreachable_prefix, S_SPF, [], unreachable_negative_next_hops))
+    rib.del_route(unreachable_prefix, S_SPF)
+    assert stream.getvalue().splitlines() == [
+        "route replace 0.0.0.0/0 nexthop via S1 nexthop via S2 nexthop via S3 nexthop via S4",
+        "route replace unreachable 200.0.0.0/16",
+        "route del 200.0.0.0/16"
+    ]
+    # A route deleted before being sent to the kernel is not deleted from the kernel
+    stream = io.StringIO()
+    rib = Rib(Fib(IpBatchKernel(stream), batch_size=10))
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute(unreachable_prefix, S_SPF, [], unreachable_negative_next_hops))
+    rib.del_route(unreachable_prefix, S_SPF)
+    rib.fib.flush()
+    assert stream.getvalue().splitlines() == [
+        "route replace 0.0.0.0/0 nexthop via S1 nexthop via S2 nexthop via S3 nexthop via S4"
+    ]
+
+
+# Test that the asynchronous kernel writer programs the backend and collapses superseded pending writes
+def test_async_kernel():
+    class BlockingKernel(Kernel):
+        def __init__(self):
+            super().__init__()
+            self.batches = []
+            self.started = threading.Event()
+            self.release = threading.Event()
+
+        def apply_batch(self, adds, deletes):
+            self.started.set()
+            self.release.wait()
+            self.batches.append((dict(adds), list(deletes)))
+            super().apply_batch(adds, deletes)
+
+    backend = BlockingKernel()
+    kernel = AsyncKernel(backend, max_pending=2, block=False)
+    rib = Rib(Fib(kernel))
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    # Wait for the writer to take the first change, then queue changes while it is blocked
+    assert backend.started.wait(timeout=5)
+    rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops))
+    rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S3', 'S4']))
+    # No room for the leaf: the batch is not queued and stays pending in the FIB
+    with pytest.raises(queue.Full):
+        rib.put_route(RibRoute(leaf_prefix, S_SPF, leaf_prefix_positive_next_hops))
+    with pytest.raises(queue.Full):
+        rib.put_route(RibRoute(unreachable_prefix, S_SPF, [], unreachable_negative_next_hops))
+    backend.release.set()
+    assert kernel.wait_synced(timeout=5)
+    rib.fib.flush()
+    assert kernel.wait_synced(timeout=5)
+    kernel.close()
+    assert len(backend.batches) == 3
+    assert backend.batches[1][0] == {default_prefix: {'S1', 'S3', 'S4'}, first_negative_disagg_prefix: {'S3', 'S4'}}
+    assert backend.batches[2][0] == {leaf_prefix: {'M4'}, unreachable_prefix: set()}
+    assert backend.routes == {default_prefix: {'S1', 'S3', 'S4'}, first_negative_disagg_prefix: {'S3', 'S4'},
+                              leaf_prefix: {'M4'}, unreachable_prefix: "unreachable"}
+
+    # A batch is queued as a whole, or not at all
+    backend = BlockingKernel()
+    kernel = AsyncKernel(backend, max_pending=2, block=False)
+    kernel.apply_batch({default_prefix: {'S1'}}, [])
+    assert backend.started.wait(timeout=5)
+    kernel.apply_batch({first_negative_disagg_prefix: {'S2'}}, [])
+    with pytest.raises(queue.Full):
+        kernel.apply_batch({leaf_prefix: {'M4'}, first_negative_disagg_prefix: {'S3'}}, [unreachable_prefix])
+    kernel.apply_batch({first_negative_disagg_prefix: {'S4'}}, [])
+    backend.release.set()
+    kernel.close()
+    assert backend.routes == {default_prefix: {'S1'}, first_negative_disagg_prefix: {'S4'}}
+
+    # A change of a parent is propagated to its children before the full queue is reported, in and out of a batch
+    for batched in (False, True):
+        backend = BlockingKernel()
+        kernel = AsyncKernel(backend, max_pending=1, block=False)
+        rib = Rib(Fib(kernel))
+        rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+        assert backend.started.wait(timeout=5)
+        rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops))
+        with pytest.raises(queue.Full):
+            if batched:
+                with rib.batch():
+                    rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S3', 'S4']))
+            else:
+                rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S3', 'S4']))
+        assert rib.destinations.get(first_negative_disagg_prefix).best_route.next_hops == {'S3', 'S4'}
+        backend.release.set()
+        assert kernel.wait_synced(timeout=5)
+        rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S3', 'S4']))
+        kernel.close()
+        assert backend.routes == {default_prefix: {'S1', 'S3', 'S4'}, first_negative_disagg_prefix: {'S3', 'S4'}}
+
+
+# Test that a reconciling FIB programs only the differences with the routes left in the kernel
+def test_fib_reconcile():
+    class CountingKernel(Kernel):
+        def __init__(self):
+            super().__init__()
+            self.batches = []
+
+        def apply_batch(self, adds, deletes):
+            self.batches.append((dict(adds), set(deletes)))
+            super().apply_batch(adds, deletes)
+
+    kernel = CountingKernel()
+    kernel.routes = {default_prefix: {'S1', 'S2', 'S3', 'S4'}, first_negative_disagg_prefix: {'S1', 'S2'},
+                     unreachable_prefix: "unreachable", leaf_prefix: {'M4'}}
+    rib = Rib(Fib(kernel, reconcile=True))
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops))
+    rib.put_route(RibRoute(unreachable_prefix, S_SPF, [], unreachable_negative_next_hops))
+    rib.put_route(RibRoute(subnet_disagg_prefix, S_SPF, ['S1']))
+    assert not kernel.batches
+    report = rib.fib.reconcile()
+    assert (report.added, report.changed, report.deleted, report.unchanged) == (1, 1, 1, 2)
+    assert kernel.batches == [({first_negative_disagg_prefix: {'S2', 'S3', 'S4'}, subnet_disagg_prefix: {'S1'}},
+                               {leaf_prefix})]
+    rib.del_route(subnet_disagg_prefix, S_SPF)
+    assert subnet_disagg_prefix not in kernel.routes
+
+
+# Test the parsing of the "ip route show" output used to reconcile a FIB with the kernel
+def test_read_ip_routes():
+    output = ["default via 192.168.1.1 dev eth0 proto static",
+              "10.0.0.0/8 proto static metric 20",
+              "\tnexthop via 10.1.1.1 dev eth1 weight 1",
+              "\tnexthop via 10.1.1.2 dev eth2 weight 1",
+              "unreachable 10.2.0.0/16 proto static",
+              "10.3.0.1 via 10.1.1.1 dev eth1 proto bgp",
+              "192.168.1.0/24 dev eth0 proto kernel scope link src 192.168.1.10"]
+    assert read_ip_routes(output) == {"0.0.0.0/0": {"192.168.1.1"}, "10.0.0.0/8": {"10.1.1.1", "10.1.1.2"},
+                                      "10.2.0.0/16": set(), "10.3.0.1/32": {"10.1.1.1"}}
+    assert set(read_ip_routes(output, proto="static")) == {"0.0.0.0/0", "10.0.0.0/8", "10.2.0.0/16"}
+
+
+# Test the vectorized longest prefix match table of the FIB and its incremental updates
+def test_fib_lookup():
+    fib_lookup = pytest.importorskip("fib_lookup")
+    rib = Rib()
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops))
+    rib.put_route(RibRoute(subnet_disagg_prefix, S_SPF, [], subnet_negative_disagg_next_hops))
+    rib.put_route(RibRoute("2001:db8::/32", S_SPF, ['S1']))
+    table = rib.fib.lookup_table()
+
+    def group_id(prefix):
+        return rib.fib.routes[prefix].group_id
+
+    addresses = fib_lookup.pack_addresses(["10.0.10.1", "10.0.11.1", "10.1.0.1", "255.255.255.255"])
+    assert list(table.lookup(addresses)) == [group_id(subnet_disagg_prefix), group_id(first_negative_disagg_prefix),
+                                             group_id(default_prefix), group_id(default_prefix)]
+    ipv6_addresses = fib_lookup.pack_addresses(["2001:db8::1", "2001:db9::1"], socket.AF_INET6)
+    assert list(table.lookup(ipv6_addresses, socket.AF_INET6)) == [group_id("2001:db8::/32"), fib_lookup.NO_ROUTE]
+    # Next hops changes update the compiled table, added and deleted prefixes recompile it
+    rib.put_route(RibRoute(subnet_disagg_prefix, S_SPF, ['S4']))
+    assert table.lookup_address("10.0.10.1") == group_id(subnet_disagg_prefix)
+    rib.del_route(first_negative_disagg_prefix, S_SPF)
+    rib.put_route(RibRoute("10.0.11.0/24", S_SPF, ['S2']))
+    assert list(table.lookup(addresses)) == [group_id(subnet_disagg_prefix), group_id("10.0.11.0/24"),
+                                             group_id(default_prefix), group_id(default_prefix)]
+    rib.del_route(default_prefix, S_SPF)
+    assert table.lookup_address("10.1.0.1") == fib_lookup.NO_ROUTE
+
+
+# Test that a RIB split across worker processes programs the same kernel routes as a single RIB
+def test_sharded_rib():
+    routes = [RibRoute(default_prefix, S_SPF, default_next_hops),
+              RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops),
+              RibRoute(second_negative_disagg_prefix, S_SPF, [], second_negative_disagg_next_hops),
+              RibRoute(subnet_disagg_prefix, S_SPF, [], subnet_negative_disagg_next_hops),
+              RibRoute(leaf_prefix, S_SPF, leaf_prefix_positive_next_hops, leaf_prefix_negative_next_hops)]
+    rib = Rib()
+    with ShardedRib(shards=2, split_length=16) as sharded_rib:
+        assert sharded_rib.shard(default_prefix) is None
+        assert sharded_rib.shard(subnet_disagg_prefix) == sharded_rib.shard(first_negative_disagg_prefix)
+        with sharded_rib.batch():
+            for rte in routes:
+                sharded_rib.put_route(rte)
+        for rte in routes:
+            rib.put_route(rte)
+        assert sharded_rib.kernel.routes == rib.fib.kernel.routes
+        sharded_rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S2', 'S3']))
+        rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S2', 'S3']))
+        assert sharded_rib.kernel.routes == rib.fib.kernel.routes
+        sharded_rib.begin()
+        sharded_rib.del_route(first_negative_disagg_prefix, S_SPF)
+        sharded_rib.del_route(default_prefix, S_SPF)
+        report = sharded_rib.commit()
+        rib.del_route(first_negative_disagg_prefix, S_SPF)
+        rib.del_route(default_prefix, S_SPF)
+        assert sharded_rib.kernel.routes == rib.fib.kernel.routes
+        assert report.operations == 2 and report.fib_writes == 5
+        # IPv6 prefixes are split on the bits before the /48 site prefixes, which vary
+        assert sharded_rib.shard("2001:db8::/32") is None
+        assert sharded_rib.shard("2001:db8:1::/48") != sharded_rib.shard("2001:db8:2::/48")
+        assert sharded_rib.shard("2001:db8:1:ff00::/56") == sharded_rib.shard("2001:db8:1::/48")
+        # A batch failing on one shard is rolled back by every shard
+        assert sharded_rib.shard("30.0.0.0/16") != sharded_rib.shard("30.1.0.0/16")
+        kernel_routes = dict(sharded_rib.kernel.routes)
+        sharded_rib.put_route(RibRoute("30.1.0.0/16", S_SPF, ['S1']))
+        sharded_rib.begin()
+        sharded_rib.put_route(RibRoute("30.0.0.0/16", S_SPF, ['S1']))
+        sharded_rib.put_route(RibRoute("30.1.0.0/16", "invalid owner", ['S2']))
+        with pytest.raises(TypeError):
+            sharded_rib.commit()
+        assert sharded_rib.kernel.routes == dict(kernel_routes, **{"30.1.0.0/16": {'S1'}})
+        sharded_rib.del_route("30.1.0.0/16", S_SPF)
+        assert sharded_rib.kernel.routes == kernel_routes
+        # The operations of a batch interrupted by an exception are not sent to the shards
+        with pytest.raises(RuntimeError):
+            with sharded_rib.batch():
+                sharded_rib.put_route(RibRoute("30.0.0.0/16", S_SPF, ['S1']))
+                raise RuntimeError("interrupted")
+        assert sharded_rib.kernel.routes == kernel_routes
+
+
+# Test that the asyncio RIB service coalesces pending updates and acknowledges them once they are in the FIB
+def test_rib_service():
+    async def produce(service, owner, next_hops_list):
+        acks = [await service.put_route(RibRoute(default_prefix, owner, next_hops)) for next_hops in next_hops_list]
+        return await asyncio.gather(*acks)
+
+    async def run():
+        async with RibService(max_batch=1) as service:
+            await asyncio.gather(produce(service, N_SPF, [['S1'], ['S2']]),
+                                 produce(service, S_SPF, [['S3'], ['S3', 'S4'], ['S4']]))
+            assert service.rib.fib.kernel.routes[default_prefix] == {'S4'}
+            assert service.rib.destinations.get(default_prefix).get_route(N_SPF).positive_next_hops == {'S2'}
+            assert service.rib.metrics.counter("rib_service_updates_total", "").value == 5
+            deleted = await service.del_route(default_prefix, S_SPF)
+            missing = await service.del_route(leaf_prefix, S_SPF)
+            assert await asyncio.gather(deleted, missing) == [True, False]
+            assert service.rib.fib.kernel.routes[default_prefix] == {'S2'}
+            # Coalesced updates of a key are acknowledged with the results they would have had one by one
+            coalesced = service.rib.metrics.counter("rib_service_coalesced_total", "").value
+            acks = [await service.put_route(RibRoute(leaf_prefix, S_SPF, ['M1'])),
+                    await service.del_route(leaf_prefix, S_SPF),
+                    await service.del_route(leaf_prefix, S_SPF)]
+            assert service.rib.metrics.counter("rib_service_coalesced_total", "").value == coalesced + 2
+            assert await asyncio.gather(*acks) == [None, True, False]
+            assert leaf_prefix not in service.rib.fib.kernel.routes
+            return service.rib.metrics.counter("rib_service_coalesced_total", "").value
+
+    assert asyncio.run(run()) > 0
+
+
+# Test that the changes of a flapping default route are held once suppressed, and released after the penalty decays
+def test_flap_dampening():
+    now = [0.0]
+    dampening = FlapDampening(half_life=10.0, descendant_penalty=500.0, clock=lambda: now[0])
+    rib = Rib(dampening=dampening)
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops))
+    rib.put_route(RibRoute(leaf_prefix, S_SPF, ['M1']))
+    # The default route has two descendants: a flap costs 2000 and suppresses it at once
+    rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S3', 'S4']))
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S2', 'S4']))
+    assert dampening.penalty(default_prefix) == 6000.0
+    assert rib.fib.kernel.routes[default_prefix] == {'S1', 'S2', 'S3', 'S4'}
+    assert rib.fib.kernel.routes[first_negative_disagg_prefix] == {'S2', 'S3', 'S4'}
+    # A leaf is dampened less strictly
+    rib.put_route(RibRoute(leaf_prefix, S_SPF, ['M2']))
+    assert rib.fib.kernel.routes[leaf_prefix] == {'M2'}
+    assert rib.metrics.counter("rib_dampening_held_total", "").value == 3
+    # The penalty halves every 10 seconds, the default route is released after 30 seconds
+    now[0] = 20.0
+    assert rib.release_dampened() == 0
+    now[0] = 31.0
+    rib.put_route(RibRoute(leaf_prefix, S_SPF, ['M2']))
+    assert rib.fib.kernel.routes[default_prefix] == {'S1', 'S2', 'S4'}
+    assert rib.fib.kernel.routes[first_negative_disagg_prefix] == {'S2', 'S4'}
+    assert rib.metrics.counter("rib_dampening_released_total", "").value == 1
+
+
+# Test that a prefix deleted and added again in one batch is installed, even while its changes are held
+def test_flap_dampening_batch_readd():
+    now = [0.0]
+    dampening = FlapDampening(half_life=10.0, clock=lambda: now[0])
+    rib = Rib(dampening=dampening)
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute(leaf_prefix, S_SPF, ['M1']))
+    rib.put_route(RibRoute(leaf_prefix, S_SPF, ['M2']))
+    rib.put_route(RibRoute(leaf_prefix, S_SPF, ['M3']))
+    assert leaf_prefix in dampening.suppressed
+    assert rib.fib.kernel.routes[leaf_prefix] == {'M2'}
+    with rib.batch():
+        rib.del_route(leaf_prefix, S_SPF)
+        rib.put_route(RibRoute(leaf_prefix, S_SPF, ['M4']))
+    assert rib.fib.kernel.routes[leaf_prefix] == {'M4'}
+
+
+# Test that a change of the parent of a held prefix does not update the FIB entry and the children of the held prefix
+def test_flap_dampening_held_child():
+    now = [0.0]
+    dampening = FlapDampening(half_life=10.0, clock=lambda: now[0])
+    rib = Rib(dampening=dampening)
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], ['S1']))
+    rib.put_route(RibRoute(subnet_disagg_prefix, S_SPF, [], ['S3']))
+    rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], ['S2']))
+    rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], ['S1']))
+    assert dampening.suppressed == {first_negative_disagg_prefix}
+    rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S2', 'S3']))
+    assert rib.fib.kernel.routes[default_prefix] == {'S1', 'S2', 'S3'}
+    assert rib.fib.kernel.routes[first_negative_disagg_prefix] == {'S1', 'S3', 'S4'}
+    assert rib.fib.kernel.routes[subnet_disagg_prefix] == {'S1', 'S4'}
+    # The held prefix and its children are computed again when it is released
+    now[0] = 100.0
+    assert rib.release_dampened() == 1
+    assert rib.fib.kernel.routes[first_negative_disagg_prefix] == {'S2', 'S3'}
+    assert rib.fib.kernel.routes[subnet_disagg_prefix] == {'S2'}
+
+
+# Test that a held prefix deleted as a superfluous child is installed when it is added again
+def test_flap_dampening_superfluous_child():
+    now = [0.0]
+    dampening = FlapDampening(half_life=10.0, clock=lambda: now[0])
+    rib = Rib(dampening=dampening)
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], ['S1']))
+    rib.put_route(RibRoute("10.0.1.0/24", S_SPF, [], ['S2']))
+    rib.put_route(RibRoute("10.0.1.0/24", S_SPF, [], ['S3']))
+    rib.put_route(RibRoute("10.0.1.0/24", S_SPF, [], ['S2']))
+    assert dampening.suppressed == {"10.0.1.0/24"}
+    rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], default_next_hops))
+    assert not rib.destinations.has_key("10.0.1.0/24")
+    assert not dampening.suppressed
+    rib.del_route(first_negative_disagg_prefix, S_SPF)
+    rib.put_route(RibRoute("10.0.1.0/24", S_SPF, [], ['S2']))
+    rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S2', 'S3']))
+    assert rib.fib.kernel.routes == {default_prefix: {'S1', 'S2', 'S3'}, "10.0.1.0/24": {'S1', 'S3'}}
+
+
+# Test that FIB and kernel entries with the same next hops share one next hop group
+def test_next_hop_groups_shared():
+    rib = Rib()
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops))
+    rib.put_route(RibRoute(leaf_prefix, S_SPF, ['S2', 'S3', 'S4']))
+    first_group = rib.fib.routes[first_negative_disagg_prefix].group
+    assert rib.fib.routes[leaf_prefix].group is first_group
+    assert rib.fib.kernel.routes[leaf_prefix] is first_group
+    assert first_group.refcount == 2
+    assert len(rib.fib.next_hop_groups) == 2
+    rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S3', 'S4']))
+    assert first_group.refcount == 1
+    rib.del_route(leaf_prefix, S_SPF)
+    assert first_group.group_id not in rib.fib.next_hop_groups.groups_by_id
+    assert rib.fib.routes[first_negative_disagg_prefix].next_hops == {'S3', 'S4'}
+
+
+# Test the bitmask encoding of next hops
+def test_next_hop_registry():
+    registry = NextHopRegistry()
+    assert registry.encode(['S1', 'S2']) == 0b11
+    assert registry.encode(['S3', 'S1']) == 0b101
+    assert registry.decode(0b110) == {'S2', 'S3'}
+    assert registry.decode(0b110) is registry.decode(0b110)
+    assert registry.decode(0) == set()
+    assert isinstance(registry.decode(0b110), frozenset)
+    # The decode cache is bounded
+    registry = NextHopRegistry(cache_size=2)
+    registry.encode(['S1', 'S2', 'S3'])
+    for mask in range(1, 8):
+        assert registry.decode(mask) == {'S%d' % (bit + 1) for bit in range(3) if mask & 1 << bit}
+    assert registry.cache_info().currsize == 2
+    # Next hops registered concurrently get distinct bits
+    registry = NextHopRegistry()
+    threads = [threading.Thread(target=registry.encode, args=(['T%d' % i for i in range(start, start + 100)],))
+               for start in range(0, 400, 50)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(registry.bits.values()) == list(range(450))
+    assert all(registry.next_hops[bit] == next_hop for next_hop, bit in registry.bits.items())
+    rib = Rib()
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    neg_route = RibRoute(first_negative_disagg_prefix, S_SPF, ['M1'], first_negative_disagg_next_hops)
+    rib.put_route(neg_route)
+    assert isinstance(neg_route.next_hops_mask, int)
+    assert neg_route.next_hops == {'M1', 'S2', 'S3', 'S4'}
+    assert rib.fib.routes[first_negative_disagg_prefix].group.mask == neg_route.next_hops_mask
+
+
+# Test that leaf destinations share the empty children set and that children sets are released when emptied
+def test_destination_children_shared_empty_set():
+    rib = Rib()
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops))
+    rib.put_route(RibRoute(leaf_prefix, S_SPF, leaf_prefix_positive_next_hops))
+    default_dest = rib.destinations.get(default_prefix)
+    assert rib.destinations.get(first_negative_disagg_prefix).children is \
+           rib.destinations.get(leaf_prefix).children
+    rib.del_route(first_negative_disagg_prefix, S_SPF)
+    rib.del_route(leaf_prefix, S_SPF)
+    assert not default_dest.children
+    assert default_dest.children is Destination(rib.preferences, leaf_prefix).children
+
+
+# Test that route events streamed in batches produce the same FIB as the single operations
+def test_ingest_events():
+    trace = io.StringIO('\n'.join([
+        '# slides 55-58',
+        '{"op": "put", "prefix": "0.0.0.0/0", "owner": "S_SPF", "positive": ["S1", "S2", "S3", "S4"]}',
+        '{"op": "put", "prefix": "10.0.0.0/16", "owner": 2, "negative": ["S1"]}',
+        '',
+        '{"op": "put", "prefix": "10.1.0.0/16", "owner": "S_SPF", "negative": ["S4"]}',
+        '{"op": "put", "prefix": "0.0.0.0/0", "owner": "S_SPF", "positive": ["S1", "S3", "S4"]}',
+        '{"op": "put", "prefix": "20.0.0.0/16", "owner": "N_SPF", "positive": ["M4"]}',
+        '{"op": "del", "prefix": "20.0.0.0/16", "owner": "N_SPF"}'
+    ]))
+    rib = Rib()
+    report = ingest.apply_events(rib, ingest.read_events(trace), batch_size=4)
+    assert report.events == 6
+    assert report.batches == 2
+    assert report.fib_size == 3
+    assert rib.fib.kernel.routes == {default_prefix: {'S1', 'S3', 'S4'}, first_negative_disagg_prefix: {'S3', 'S4'},
+                                     second_negative_disagg_prefix: {'S1', 'S3'}}
+    with pytest.raises(ValueError):
+        list(ingest.read_events(['{"op": "put", "owner": 2}']))
+    # A batch size that is not positive is rejected instead of dropping the events
+    for batch_size in (0, -1):
+        with pytest.raises(ValueError):
+            ingest.batched([("del", (default_prefix, S_SPF))], batch_size)
+        with pytest.raises(ValueError):
+            ingest.apply_events(rib, [("del", (default_prefix, S_SPF))], batch_size)
+    assert default_prefix in rib.fib.kernel.routes
+
+
+# Test the operation counters, the latency histograms and their Prometheus export
+def test_metrics():
+    rib = Rib(Fib(metrics=Metrics(latency_sampling=1)))
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops))
+    rib.put_route(RibRoute(leaf_prefix, S_SPF, leaf_prefix_positive_next_hops))
+    rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S3', 'S4']))
+    rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S3', 'S4']))
+    rib.del_route(leaf_prefix, S_SPF)
+    values = rib.metrics.snapshot()
+    assert values["rib_put_route_total"] == 5
+    assert values["rib_del_route_total"] == 1
+    # The leaf has only positive next hops and the identical put propagates an empty delta
+    assert values["rib_children_visited_total"] == 1
+    assert values["rib_children_skipped_total"] == 1
+    assert values["rib_children_changed_total"] == 1
+    assert values["fib_writes_total"] == 5
+    assert values["fib_writes_suppressed_total"] == 1
+    assert values["fib_deletes_total"] == 1
+    assert values["kernel_routes_total"] == 6
+    assert values["rib_put_route_seconds"]["count"] == 5
+    text = rib.metrics.to_prometheus()
+    assert "# TYPE rib_put_route_total counter\nrib_put_route_total 5\n" in text
+    assert 'rib_put_route_seconds_bucket{le="+Inf"} 5\n' in text
+    assert "rib_del_route_seconds_count 1\n" in text
+
+
+# Test the trace hooks and the sampling profiler, and that original methods are restored when tracing stops
+def test_tracing(tmp_path):
+    original_put_route = Rib.put_route
+    time_tracer = tracing.TimeTracer()
+    profiler = tracing.SamplingProfiler(2, str(tmp_path))
+    rib = Rib()
+    with tracing.tracing(time_tracer), tracing.tracing(profiler):
+        assert Rib.put_route is not original_put_route
+        rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+        rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops))
+        rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S3', 'S4']))
+        rib.del_route(first_negative_disagg_prefix, S_SPF)
+    assert Rib.put_route is original_put_route
+    assert time_tracer.totals["Rib.put_route"][0] == 3
+    assert time_tracer.totals["Destination.put_route"][0] == 3
+    assert time_tracer.totals["Rib.del_route"][0] == 1
+    assert time_tracer.totals["Rib._update_prefix_children"][0] == 4
+    assert time_tracer.totals["Fib.put_route"][0] == 4
+    assert profiler.operations == 4
+    assert [os.path.basename(path) for path in profiler.dumps] == ["profile-2.prof", "profile-4.prof"]
+    assert all(os.path.exists(path) for path in profiler.dumps)
+
+
+# Test that IPv4 and IPv6 prefixes are kept in separate tries of the same RIB
+def test_dual_stack():
+    rib = Rib()
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute("::/0", S_SPF, ['S1', 'S2']))
+    rib.put_route(RibRoute("2001:db8::/32", S_SPF, [], ['S1']))
+    rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops))
+    assert rib.destinations.get("2001:db8::/32").parent_prefix_dest.prefix == "::/0"
+    assert rib.destinations.get(first_negative_disagg_prefix).parent_prefix_dest.prefix == default_prefix
+    assert rib.fib.kernel.routes["2001:db8::/32"] == {'S2'}
+    rib.put_route(RibRoute("::/0", S_SPF, ['S1', 'S2', 'S3']))
+    assert rib.fib.kernel.routes["2001:db8::/32"] == {'S2', 'S3'}
+    assert rib.fib.kernel.routes[first_negative_disagg_prefix] == {'S2', 'S3', 'S4'}
+    assert sorted(rib.destinations.keys()) == sorted([default_prefix, first_negative_disagg_prefix, "::/0",
+                                                      "2001:db8::/32"])
+    rib.del_route("::/0", S_SPF)
+    assert rib.fib.kernel.routes["2001:db8::/32"] == "unreachable"
+    assert rib.fib.kernel.routes[first_negative_disagg_prefix] == {'S2', 'S3', 'S4'}
+
+
+# Test that next hops of a chain of negative disaggregations as deep as IPv6 allows are computed without recursion
+def test_ipv6_deep_nesting():
+    spines = ['S%d' % i for i in range(200)]
+    rib = Rib()
+    routes = [RibRoute("::/0", S_SPF, spines)]
+    routes.extend(RibRoute("2001:db8::/%d" % length, S_SPF, [], [spines[length]]) for length in range(1, 129))
+    for route in routes:
+        rib.put_route(route)
+    expected_next_hops = {'S0'} | set(spines[129:])
+    assert routes[-1].next_hops == expected_next_hops
+    for route in routes:
+        route.invalidate_next_hops()
+    recursion_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(len(inspect.stack()) + 50)
+    try:
+        assert routes[-1].next_hops == expected_next_hops
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+    rib.put_route(RibRoute("::/0", S_SPF, spines[:-1]))
+    assert rib.fib.kernel.routes["2001:db8::/128"] == expected_next_hops - {spines[-1]}
+
+
+# Test that stale routes that are not refreshed are swept in a single batch
+def test_mark_and_sweep_stale():
+    rib = Rib()
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops))
+    rib.put_route(RibRoute(subnet_disagg_prefix, S_SPF, [], subnet_negative_disagg_next_hops))
+    rib.put_route(RibRoute(second_negative_disagg_prefix, S_SPF, [], second_negative_disagg_next_hops))
+    rib.put_route(RibRoute(leaf_prefix, N_SPF, leaf_prefix_positive_next_hops))
+    assert rib.mark_stale(S_SPF) == 4
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute(subnet_disagg_prefix, S_SPF, [], subnet_negative_disagg_next_hops))
+    report = rib.sweep_stale(S_SPF)
+    assert report.operations == 2
+    assert report.fib_writes == 3
+    assert rib.fib.kernel.routes == {default_prefix: {'S1', 'S2', 'S3', 'S4'}, subnet_disagg_prefix: {'S1', 'S3', 'S4'},
+                                     leaf_prefix: {'M4'}}
+    assert not rib.destinations.get(leaf_prefix).best_route.stale
+
+
+# Test that a RIB restored from a snapshot has the same routes, FIB and kernel as the saved one
+def test_snapshot_restore(tmp_path):
+    rib = Rib()
+    rib.put_route(RibRoute(subnet_disagg_prefix, S_SPF, [], subnet_negative_disagg_next_hops))
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute(default_prefix, N_SPF, ['S1']))
+    rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops))
+    rib.put_route(RibRoute(leaf_prefix, S_SPF, leaf_prefix_positive_next_hops, leaf_prefix_negative_next_hops))
+    rib.put_route(RibRoute("2001:db8::/32", S_SPF, ['S1']))
+    path = str(tmp_path / "rib.snapshot")
+    assert snapshot.write_snapshot(rib, path) == 6
+    restored = snapshot.restore_snapshot(path)
+    assert sorted(restored.destinations.keys()) == sorted(rib.destinations.keys())
+    for prefix in rib.destinations:
+        assert str(restored.destinations.get(prefix).routes) == str(rib.destinations.get(prefix).routes)
+    assert restored.fib.kernel.routes == rib.fib.kernel.routes
+    restored_default = restored.destinations.get(default_prefix)
+    assert restored_default.children == {restored.destinations.get(first_negative_disagg_prefix),
+                                         restored.destinations.get(leaf_prefix)}
+    with pytest.raises(RuntimeError):
+        snapshot.restore_snapshot(path, restored)
+    with open(path, "r+b") as snapshot_file:
+        snapshot_file.seek(4)
+        snapshot_file.write(struct.pack("<H", snapshot.VERSION + 1))
+    with pytest.raises(ValueError, match="version %d" % (snapshot.VERSION + 1)):
+        snapshot.restore_snapshot(path)
+
+
+# Test that a compressed FIB only installs the prefixes that do not forward like their parent prefix
+def test_fib_compression():
+    rib = Rib(compress=True)
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    rib.put_route(RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops))
+    rib.put_route(RibRoute("10.0.1.0/24", S_SPF, ['S2', 'S3', 'S4']))
+    rib.put_route(RibRoute("10.2.0.0/16", S_SPF, default_next_hops))
+    assert len(rib.destinations) == 4
+    assert rib.fib.kernel.routes == {default_prefix: {'S1', 'S2', 'S3', 'S4'},
+                                     first_negative_disagg_prefix: {'S2', 'S3', 'S4'}}
+    # The /16 positive route forwards differently once the default route loses a next hop, its /24 still does not
+    rib.put_route(RibRoute(default_prefix, S_SPF, ['S1', 'S3', 'S4']))
+    assert rib.fib.kernel.routes == {default_prefix: {'S1', 'S3', 'S4'}, first_negative_disagg_prefix: {'S3', 'S4'},
+                                     "10.0.1.0/24": {'S2', 'S3', 'S4'}, "10.2.0.0/16": {'S1', 'S2', 'S3', 'S4'}}
+    rib.put_route(RibRoute(default_prefix, S_SPF, default_next_hops))
+    assert set(rib.fib.kernel.routes) == {default_prefix, first_negative_disagg_prefix}
+    # Children of a removed prefix are compared with their new parent
+    with rib.batch():
+        rib.del_route(first_negative_disagg_prefix, S_SPF)
+    assert rib.fib.kernel.routes == {default_prefix: {'S1', 'S2', 'S3', 'S4'}, "10.0.1.0/24": {'S2', 'S3', 'S4'}}
+    rib.del_route(default_prefix, S_SPF)
+    assert rib.fib.kernel.routes == {"10.0.1.0/24": {'S2', 'S3', 'S4'}, "10.2.0.0/16": {'S1', 'S2', 'S3', 'S4'}}
+    assert rib.metrics.snapshot()["rib_fib_compressed_total"] > 0
+
+    loaded_rib = Rib(compress=True)
+    loaded_rib.load([RibRoute(default_prefix, S_SPF, default_next_hops),
+                     RibRoute(first_negative_disagg_prefix, S_SPF, [], first_negative_disagg_next_hops),
+                     RibRoute("10.0.1.0/24", S_SPF, ['S2', 'S3', 'S4'])])
+    assert set(loaded_rib.fib.kernel.routes) == {default_prefix, first_negative_disagg_prefix}
+
+
+# Test that a prefix is not left out of a compressed FIB while the changes of its parent are held
+def test_fib_compression_dampening():
+    now = [0.0]
+    dampening = FlapDampening(half_life=10.0, clock=lambda: now[0])
+    rib = Rib(dampening=dampening, compress=True)
+    rib.put_route(RibRoute(default_prefix, S_SPF, ['S3']))
+    rib.put_route(RibRoute("10.0.0.0/8", S_SPF, ['S1']))
+    rib.put_route(RibRoute("10.0.0.0/8", S_SPF, ['S2']))
+    rib.put_route(RibRoute("10.0.0.0/8", S_SPF, ['S1']))
+    assert dampening.suppressed == {"10.0.0.0/8"}
+    assert rib.fib.kernel.routes["10.0.0.0/8"] == {'S2'}
+    # The /16 forwards like the best route of the /8, but not like its FIB entry
+    rib.put_route(RibRoute("10.1.0.0/16", S_SPF, ['S1']))
+    assert rib.fib.kernel.routes["10.1.0.0/16"] == {'S1'}
+    # Once the /8 is released, the /16 forwards like it and is left out
+    now[0] = 100.0
+    assert rib.release_dampened() == 1
+    assert rib.fib.kernel.routes == {default_prefix: {'S3'}, "10.0.0.0/8": {'S1'}}
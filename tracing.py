@@ -0,0 +1,170 @@
+"""
+Opt-in trace hooks around the RIB hot path.
+Hooks are installed by wrapping the traced methods when the first hook is added, and the original methods are
+restored when the last hook is removed, so there is no cost at all when tracing is disabled.
+Traced operations are Rib.put_route, Rib.del_route, Destination.put_route, Rib._update_prefix_children and
+Fib.put_route.
+"""
+import cProfile
+import functools
+import os
+import time
+from contextlib import contextmanager
+
+from destination import Destination
+from fib import Fib
+from rib import Rib
+
+TRACED_METHODS = [
+    (Rib, "put_route"),
+    (Rib, "del_route"),
+    (Destination, "put_route"),
+    (Rib, "_update_prefix_children"),
+    (Fib, "put_route")
+]
+
+_hooks = []
+_originals = {}
+
+
+class TraceHook:
+    """
+    Base class of the trace hooks. enter() is called before a traced operation and exit() after it, also when it
+    raises an exception.
+    """
+
+    def enter(self, operation, args):
+        """
+        :param operation: (string) name of the operation, e.g. "Rib.put_route"
+        :param args: (tuple) positional arguments of the call, starting with the object
+        :return:
+        """
+
+    def exit(self, operation, args, error):
+        """
+        :param operation: (string) name of the operation
+        :param args: (tuple) positional arguments of the call, starting with the object
+        :param error: (Exception|None) exception raised by the operation, if any
+        :return:
+        """
+
+
+class TimeTracer(TraceHook):
+    """
+    Hook that accumulates the number of calls and the time spent in each traced operation.
+    Time of nested operations is also included in the time of the enclosing ones.
+    Attributes of this class are:
+        - totals: dict of [calls, seconds] lists, keyed by operation
+    """
+
+    def __init__(self):
+        self.totals = {}
+        self._starts = []
+
+    def enter(self, operation, args):
+        self._starts.append(time.perf_counter())
+
+    def exit(self, operation, args, error):
+        elapsed = time.perf_counter() - self._starts.pop()
+        total = self.totals.setdefault(operation, [0, 0.0])
+        total[0] += 1
+        total[1] += elapsed
+
+
+class SamplingProfiler(TraceHook):
+    """
+    Hook that runs cProfile on one top-level RIB operation every sample_every, and dumps each profile in
+    output_dir as profile-<operation number>.prof (readable with pstats).
+    Attributes of this class are:
+        - sample_every: profile one operation every sample_every
+        - output_dir: directory where profiles are written
+        - operations: number of top-level operations seen
+        - dumps: list of the paths of the written profiles
+    """
+    TOP_LEVEL_OPERATIONS = ("Rib.put_route", "Rib.del_route")
+
+    def __init__(self, sample_every, output_dir):
+        self.sample_every = sample_every
+        self.output_dir = output_dir
+        self.operations = 0
+        self.dumps = []
+        self._depth = 0
+        self._profile = None
+
+    def enter(self, operation, args):
+        if operation not in self.TOP_LEVEL_OPERATIONS:
+            return
+        self._depth += 1
+        if self._depth == 1:
+            self.operations += 1
+            if self.operations % self.sample_every == 0:
+                self._profile = cProfile.Profile()
+                self._profile.enable()
+
+    def exit(self, operation, args, error):
+        if operation not in self.TOP_LEVEL_OPERATIONS:
+            return
+        self._depth -= 1
+        if self._depth == 0 and self._profile is not None:
+            self._profile.disable()
+            path = os.path.join(self.output_dir, "profile-%d.prof" % self.operations)
+            self._profile.dump_stats(path)
+            self.dumps.append(path)
+            self._profile = None
+
+
+def add_hook(hook):
+    """
+    Add a trace hook, installing the traced methods if it is the first one
+    :param hook: (TraceHook) hook to add
+    :return:
+    """
+    if not _hooks:
+        for cls, name in TRACED_METHODS:
+            original = cls.__dict__[name]
+            _originals[(cls, name)] = original
+            setattr(cls, name, _traced(cls.__name__ + "." + name, original))
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    """
+    Remove a trace hook, restoring the original methods if it was the last one
+    :param hook: (TraceHook) hook to remove
+    :return:
+    """
+    _hooks.remove(hook)
+    if not _hooks:
+        for (cls, name), original in _originals.items():
+            setattr(cls, name, original)
+        _originals.clear()
+
+
+@contextmanager
+def tracing(hook):
+    """
+    Context manager that traces the enclosed code with the given hook
+    """
+    add_hook(hook)
+    try:
+        yield hook
+    finally:
+        remove_hook(hook)
+
+
+def _traced(operation, function):
+    @functools.wraps(function)
+    def traced(*args, **kwargs):
+        hooks = tuple(_hooks)
+        for hook in hooks:
+            hook.enter(operation, args)
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            for hook in reversed(hooks):
+                hook.exit(operation, args, e)
+            raise
+        for hook in reversed(hooks):
+            hook.exit(operation, args, None)
+        return result
+    return traced